@@ -1,18 +1,33 @@
 import streamlit as st
 import pandas as pd
 import json
+import copy
 from datetime import datetime
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
+import altair as alt
 import io
 import os
 import sys
+import threading
 import uuid
-import glob
-from pptx import Presentation
-from pptx.util import Inches, Pt
-from pptx.dml.color import RGBColor
-from pptx.enum.text import PP_ALIGN
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from moteur import (generer_dates_semestres, calculer_projection, consolider_series, normaliser_impact, TYPES_IMPACTS,
+                    TYPES_EVENEMENTS, REGIMES_FISCAUX, FISCALITE_DEFAUT, variations_s1,
+                    TYPES_ACTIFS, projeter_sous_fonds, aligner_sous_fonds,
+                    valeur_a_date, reporter_parametres, previsions_en_lignes, mesurer_precision,
+                    DEVISE_FONDS, devises_utilisees, sensibilite_fx, calculer_surcharges, appliquer_surcharges,
+                    premiere_periode_modifiee, empreinte_calcul, resumer_projection,
+                    ARRONDI_DEFAUT, MODES_CALCUL, REGLES_ARRONDI, GRANULARITES_ARRONDI)
+from stockage import (lire_enregistrement, ecrire_enregistrement, supprimer_enregistrement, lire_index,
+                      valider_simulation, migrer_stockage, lire_fichiers_importes, importer_simulations,
+                      exporter_stockage, restaurer_stockage, MODES_CONFLIT, REPERTOIRE_SAUVEGARDES, empreinte,
+                      nettoyer_nom_fonds, lire_simulation, charger_courbes_fx, sauvegarder_courbes_fx,
+                      dernieres_versions, FICHIER_INDEX, REPERTOIRE_SIMULATIONS)
+from rapports import format_fr_euro, COULEUR_BLEUE
+from taches import (soumettre_tache, annuler_tache, supprimer_tache, lister_taches, marquer_taches_interrompues,
+                    ETATS_FINAUX, LIBELLES_ETATS)
+from brouillons import (planifier_brouillon, supprimer_brouillon, lire_brouillon, lister_brouillons,
+                        compteurs_brouillons, empreinte_brouillon)
 
 # Configuration de base de l'interface Streamlit
 st.set_page_config(page_title="Atterrissage VL", page_icon="📊", layout="wide")
@@ -54,13 +69,39 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # === FONCTION D'UTILITAIRES ===
-def format_fr_euro(valeur):
-    """Formater un nombre en euros format français"""
-    try:
-        valeur_arrondie = round(float(valeur), 2)
-        return f"{valeur_arrondie:,.2f} €".replace(",", " ").replace(".", ",")
-    except (ValueError, TypeError):
-        return "0,00 €"
+def format_fr_nombre(valeur):
+    """Formater un nombre à deux décimales au format français"""
+    return f"{valeur:,.2f}".replace(",", " ").replace(".", ",")
+
+CARACTERES_APERCU = "▁▂▃▄▅▆▇█"
+
+def apercu_texte(valeurs):
+    """Courbe miniature en caractères, à partir de l'aperçu de VL d'une synthèse sauvegardée"""
+    if not valeurs:
+        return ""
+    bas, haut = min(valeurs), max(valeurs)
+    if haut == bas:
+        return CARACTERES_APERCU[3] * len(valeurs)
+    return "".join(CARACTERES_APERCU[round((v - bas) / (haut - bas) * (len(CARACTERES_APERCU) - 1))] for v in valeurs)
+
+def libelle_resume(resume):
+    """VL finale et variation d'une simulation d'après la synthèse sauvegardée avec elle"""
+    if not resume:
+        return "Synthèse non calculée"
+    variation = f" ({resume['variation'] * 100:+.1f} %)".replace(".", ",") if resume['variation'] is not None else ""
+    return f"VL finale {format_fr_euro(resume['vl_finale'])}{variation}"
+
+def style_fr(tableau, formats=None):
+    """Mettre en forme à l'affichage un tableau numérique : montants en euros et dates au format français
+
+    Les données restent numériques ; `formats` donne le format des colonnes qui ne sont pas des montants.
+    """
+    style = tableau.style.format(format_fr_euro, na_rep="")
+    if formats:
+        style = style.format(formats, na_rep="")
+    if isinstance(tableau.index, pd.DatetimeIndex):
+        style = style.format_index(lambda date: date.strftime('%d/%m/%Y'))
+    return style
 
 def champ_numerique(label, valeur, conteneur=st.sidebar):
     """Gérer la saisie d'une valeur numérique au format français"""
@@ -76,6 +117,60 @@ def champ_numerique(label, valeur, conteneur=st.sidebar):
         st.warning(f"Erreur avec le champ {label}: {str(e)}")
         return 0.0
 
+def choisir_devise(label, devise_defaut, key, conteneur=st):
+    """Choisir une devise parmi celle du fonds et celles dotées d'une courbe de change"""
+    options = list(devises_disponibles)
+    if devise_defaut not in options:
+        options.append(devise_defaut)
+    return conteneur.selectbox(label, options=options, index=options.index(devise_defaut), key=key)
+
+def symbole_devise(devise):
+    """Symbole affiché dans les libellés de saisie"""
+    return "€" if devise == DEVISE_FONDS else devise
+
+# === GRAPHIQUES ===
+# Conventions françaises pour les nombres et les dates des graphiques interactifs
+LOCALE_GRAPHIQUES = {
+    "number": {"decimal": ",", "thousands": "\u00a0", "grouping": [3], "currency": ["", "\u00a0€"]},
+    "time": {
+        "dateTime": "%A %e %B %Y à %X", "date": "%d/%m/%Y", "time": "%H:%M:%S",
+        "periods": ["AM", "PM"],
+        "days": ["dimanche", "lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi"],
+        "shortDays": ["dim.", "lun.", "mar.", "mer.", "jeu.", "ven.", "sam."],
+        "months": ["janvier", "février", "mars", "avril", "mai", "juin", "juillet", "août", "septembre",
+                   "octobre", "novembre", "décembre"],
+        "shortMonths": ["janv.", "févr.", "mars", "avr.", "mai", "juin", "juil.", "août", "sept.", "oct.",
+                        "nov.", "déc."]
+    }
+}
+
+def graphique_series(donnees, x, y, serie, titre, titre_y, format_y="$,.2f", type_x="temporal", empile=False):
+    """Graphique interactif rendu par le navigateur : valeurs au survol, zoom et séries masquables par la légende
+
+    `donnees` est au format long (une ligne par point) ; un clic sur la légende
+    isole une série, la molette zoome et le glisser déplace la vue.
+    """
+    choix_series = alt.selection_point(fields=[serie], bind="legend")
+    format_x = "%d/%m/%Y" if type_x == "temporal" else "d"
+    base = alt.Chart(donnees).encode(
+        x=alt.X(f"{x}:{type_x[0].upper()}", title=None,
+                axis=alt.Axis(format="%b %y" if type_x == "temporal" else "d", labelColor=COULEUR_BLEUE)),
+        y=alt.Y(f"{y}:Q", title=titre_y, stack="zero" if empile else None,
+                axis=alt.Axis(format=format_y, labelColor=COULEUR_BLEUE, titleColor=COULEUR_BLEUE)),
+        color=alt.Color(f"{serie}:N", title=None, legend=alt.Legend(orient="top")),
+        opacity=alt.condition(choix_series, alt.value(1.0), alt.value(0.15)),
+        tooltip=[alt.Tooltip(f"{serie}:N"), alt.Tooltip(f"{x}:{type_x[0].upper()}", format=format_x),
+                 alt.Tooltip(f"{y}:Q", format=format_y)]
+    )
+    marques = base.mark_area(opacity=0.7) if empile else base.mark_line(point=True, strokeWidth=2.5)
+    return (
+        marques.add_params(choix_series)
+        .properties(title=alt.Title(titre, color=COULEUR_BLEUE, fontSize=16), height=380)
+        .interactive()
+        .configure(locale=LOCALE_GRAPHIQUES)
+        .configure_view(stroke=None)
+    )
+
 # === INITIALISATION DU STOCKAGE JSON ===
 def init_storage():
     """Créer le répertoire de stockage des fichiers JSON si nécessaire"""
@@ -89,6 +184,68 @@ def init_storage():
         import traceback
         st.error(traceback.format_exc())
 
+@st.cache_resource
+def demarrer_file_taches():
+    """Marquer, une seule fois par démarrage du serveur, les tâches interrompues par l'arrêt précédent"""
+    marquer_taches_interrompues()
+    return True
+
+def contenu_fichier(chemin):
+    """Lecture différée d'un fichier, au clic sur son bouton de téléchargement"""
+    def lire():
+        with open(chemin, 'rb') as f:
+            return f.read()
+    return lire
+
+def afficher_taches(taches_ids=None, cle="taches"):
+    """Afficher des tâches de fond (toutes, ou celles indiquées) : progression, annulation et fichiers produits
+
+    L'affichage est rafraîchi chaque seconde tant qu'une tâche est en attente ou en cours.
+    """
+    def taches_visibles():
+        return [tache for tache in lister_taches() if taches_ids is None or tache['id'] in taches_ids]
+    
+    actives = any(tache['etat'] not in ETATS_FINAUX for tache in taches_visibles())
+    
+    @st.fragment(run_every=1 if actives else None)
+    def suivi_taches():
+        taches = taches_visibles()
+        if not taches:
+            st.caption("Aucune tâche")
+            return
+        for tache in taches:
+            with st.container(border=True):
+                col_info, col_action = st.columns([4, 1])
+                with col_info:
+                    st.markdown(f"**{tache['libelle']}** — {LIBELLES_ETATS[tache['etat']]} "
+                                f"(lancée le {tache['date_creation']})")
+                    if tache['etat'] not in ETATS_FINAUX:
+                        st.progress(tache['faites'] / tache['total'] if tache['total'] else 0.0,
+                                    text=f"{tache['faites']} / {tache['total']}" if tache['total'] else "En attente")
+                    for erreur in tache['erreurs']:
+                        st.warning(erreur)
+                    for i, chemin in enumerate(tache['fichiers']):
+                        if os.path.exists(chemin):
+                            st.download_button(
+                                label=f"📥 {os.path.basename(chemin)}",
+                                data=contenu_fichier(chemin),
+                                file_name=os.path.basename(chemin),
+                                key=f"{cle}_fichier_{tache['id']}_{i}"
+                            )
+                with col_action:
+                    if tache['etat'] not in ETATS_FINAUX:
+                        if st.button("Annuler", key=f"{cle}_annuler_{tache['id']}"):
+                            annuler_tache(tache['id'])
+                            st.rerun(scope="fragment")
+                    elif st.button("Supprimer", key=f"{cle}_supprimer_{tache['id']}"):
+                        supprimer_tache(tache['id'])
+                        st.rerun(scope="fragment")
+        if actives and all(tache['etat'] in ETATS_FINAUX for tache in taches):
+            # Plus de tâche active : relancer la page pour arrêter le rafraîchissement
+            st.rerun()
+    
+    suivi_taches()
+
 # === PARAMÈTRES INITIAUX ===
 default_params = {
     "nom_fonds": "Nom du Fonds",
@@ -119,12 +276,32 @@ default_params = {
             "variation": 187_500.0,
             "variation_brute": 250_000.0
         }
-    ]
+    ],
+    "evenements_parts": []
 }
 
+# Messages des fonctions exécutées dans les threads d'un traitement en lot, sans contexte Streamlit :
+# collectés pour être affichés par le script (voir `collecter_messages`)
+messages_differes = threading.local()
+
+def signaler(niveau, message):
+    """Afficher un avertissement ou une erreur, ou le collecter si le thread courant collecte ses messages"""
+    collecte = getattr(messages_differes, 'liste', None)
+    if collecte is not None:
+        collecte.append(message)
+    else:
+        getattr(st, niveau)(message)
+
 # Fonctions pour la gestion des simulations en JSON
 def sauvegarder_simulation(params, commentaire=""):
-    """Sauvegarder une simulation dans un fichier JSON"""
+    """Sauvegarder une simulation ; retourne son identifiant et si elle était identique à la dernière version
+
+    Une simulation identique à la dernière version de son scénario n'est pas
+    réécrite : l'identifiant de cette version est retourné. La comparaison se
+    limite à cette version : un contenu identique à une version plus ancienne,
+    ou à un autre scénario ou fonds, est sauvegardé comme nouvelle version, les
+    versions d'un scénario formant son historique.
+    """
     try:
         # S'assurer que les valeurs numériques sont bien des nombres
         try:
@@ -132,7 +309,7 @@ def sauvegarder_simulation(params, commentaire=""):
             parts = float(params['nombre_parts'])
         except (ValueError, KeyError):
             # Si conversion impossible, utiliser des valeurs par défaut
-            st.warning("Problème avec les valeurs numériques, utilisation de valeurs par défaut")
+            signaler("warning", "Problème avec les valeurs numériques, utilisation de valeurs par défaut")
             anr = 10000000.0
             parts = 10000.0
         
@@ -154,31 +331,34 @@ def sauvegarder_simulation(params, commentaire=""):
             "nombre_parts": parts,
             "date_creation": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "commentaire": commentaire,
+            "commentaire_simulation": params.get('commentaire_simulation', ''),
             "impacts": [],
             "impacts_multidates": [],
-            "actifs": []
+            "actifs": [],
+            "evenements_parts": []
         }
         
         # Traiter les impacts récurrents
         impacts = params.get('impacts', [])
         for impact in impacts:
             try:
-                if isinstance(impact, tuple) and len(impact) == 2:
-                    libelle, montant = impact
-                elif isinstance(impact, list) and len(impact) == 2:
-                    libelle, montant = impact
-                elif isinstance(impact, dict) and 'libelle' in impact and 'montant' in impact:
-                    libelle, montant = impact['libelle'], impact['montant']
-                else:
+                impact_normalise = normaliser_impact(impact)
+                if impact_normalise is None:
                     continue  # Ignorer les impacts mal formatés
                 
-                montant_float = float(montant)
-                simulation_data['impacts'].append({
-                    "libelle": libelle,
-                    "montant": montant_float
-                })
+                if impact_normalise['type'] == 'fixe':
+                    impact_data = {
+                        "libelle": impact_normalise['libelle'],
+                        "montant": impact_normalise['montant']
+                    }
+                    if impact_normalise['devise'] != DEVISE_FONDS:
+                        impact_data['devise'] = impact_normalise['devise']
+                    simulation_data['impacts'].append(impact_data)
+                else:
+                    # Impacts proportionnels : conserver le type, le taux et les bornes
+                    simulation_data['impacts'].append(impact_normalise)
             except (ValueError, TypeError) as e:
-                st.warning(f"Problème avec un impact récurrent: {str(e)}")
+                signaler("warning", f"Problème avec un impact récurrent: {str(e)}")
         
         # Traiter les impacts multidates
         impacts_multidates = params.get('impacts_multidates', [])
@@ -188,6 +368,8 @@ def sauvegarder_simulation(params, commentaire=""):
                     "libelle": impact.get('libelle', 'Impact sans nom'),
                     "montants": []
                 }
+                if impact.get('devise', DEVISE_FONDS) != DEVISE_FONDS:
+                    impact_dict['devise'] = impact['devise']
                 
                 # Ajouter les occurrences de cet impact
                 for occurrence in impact.get('montants', []):
@@ -199,138 +381,364 @@ def sauvegarder_simulation(params, commentaire=""):
                             "montant": montant_float
                         })
                     except (ValueError, TypeError) as e:
-                        st.warning(f"Problème avec une occurrence d'impact: {str(e)}")
+                        signaler("warning", f"Problème avec une occurrence d'impact: {str(e)}")
                 
                 simulation_data['impacts_multidates'].append(impact_dict)
             except Exception as e:
-                st.warning(f"Problème avec un impact multidate: {str(e)}")
+                signaler("warning", f"Problème avec un impact multidate: {str(e)}")
         
         # Traiter les actifs
         actifs = params.get('actifs', [])
         for actif in actifs:
             try:
-                pct = float(actif.get('pct_detention', 1.0))
-                val_act = float(actif.get('valeur_actuelle', 1000000.0))
-                val_proj = float(actif.get('valeur_projetee', 1050000.0))
-                is_prov = bool(actif.get('is_a_provisionner', False))
-                
-                # Calculer les valeurs dérivées
-                variation_brute = (val_proj - val_act) * pct
-                
-                # Appliquer la règle de l'IS (75% de l'impact en cas de plus-value)
-                if is_prov and variation_brute > 0:
-                    variation = variation_brute * 0.75  # Réduction de 25% pour l'IS
-                else:
-                    variation = variation_brute
-                
-                simulation_data['actifs'].append({
+                actif_data = {
                     "nom": actif.get('nom', 'Actif sans nom'),
-                    "pct_detention": pct,
-                    "valeur_actuelle": val_act,
-                    "valeur_projetee": val_proj,
-                    "is_a_provisionner": is_prov,
-                    "variation": variation,
-                    "variation_brute": variation_brute
-                })
+                    "pct_detention": float(actif.get('pct_detention', 1.0)),
+                    "valeur_actuelle": float(actif.get('valeur_actuelle', 1000000.0)),
+                    "valeur_projetee": float(actif.get('valeur_projetee', 1050000.0)),
+                    "is_a_provisionner": bool(actif.get('is_a_provisionner', False)),
+                    "regime_fiscal": actif.get('regime_fiscal', 'droit_commun')
+                }
+                if actif.get('type') == 'fonds':
+                    # Fonds détenu en transparence : référence à sa simulation
+                    actif_data['type'] = 'fonds'
+                    actif_data['simulation_id'] = actif.get('simulation_id')
+                elif actif.get('devise', DEVISE_FONDS) != DEVISE_FONDS:
+                    actif_data['devise'] = actif['devise']
+                if actif_data['regime_fiscal'] == 'participation':
+                    actif_data['quote_part_imposable'] = float(actif.get('quote_part_imposable', 0.12))
+                simulation_data['actifs'].append(actif_data)
             except (ValueError, TypeError, KeyError) as e:
-                st.warning(f"Problème avec un actif: {str(e)}")
+                signaler("warning", f"Problème avec un actif: {str(e)}")
         
-        # Sauvegarder les données dans un fichier JSON
-        filename = f"data/simulations/{simulation_id}.json"
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(simulation_data, f, ensure_ascii=False, indent=4)
+        # Chocs de change du scénario, limités aux devises utilisées
+        simulation_data['chocs_fx'] = {devise: float(choc) for devise, choc in (params.get('chocs_fx') or {}).items()
+                                       if devise in devises_utilisees(simulation_data) and choc}
         
-        return simulation_id
+        # Calculer les variations dérivées avec les règles d'IS du fonds
+        simulation_data['fiscalite'] = {**FISCALITE_DEFAUT, **(params.get('fiscalite') or {})}
+        simulation_data['arrondi'] = {**ARRONDI_DEFAUT, **(params.get('arrondi') or {})}
+        try:
+            dates_fiscales = generer_dates_semestres(
+                datetime.strptime(simulation_data['date_vl_connue'], "%d/%m/%Y"),
+                datetime.strptime(simulation_data['date_fin_fonds'], "%d/%m/%Y")
+            )
+        except ValueError:
+            dates_fiscales = [datetime.now()]
+        try:
+            sous_fonds = projeter_sous_fonds(simulation_data, charger_simulation, courbes_fx=courbes_fx)
+        except ValueError as e:
+            signaler("warning", f"Fonds détenus en transparence ignorés: {str(e)}")
+            sous_fonds = {}
+        variations_brutes, variations = variations_s1(simulation_data['actifs'], simulation_data['fiscalite'],
+                                                      dates_fiscales, sous_fonds, courbes_fx,
+                                                      simulation_data['chocs_fx'])
+        for actif_data, variation_brute, variation in zip(simulation_data['actifs'], variations_brutes, variations):
+            actif_data['variation'] = float(variation)
+            actif_data['variation_brute'] = float(variation_brute)
         
-    except Exception as e:
-        st.error(f"Erreur lors de la sauvegarde: {str(e)}")
-        import traceback
-        st.error(traceback.format_exc())
-        return None
-
-def charger_simulation(simulation_id):
-    """Charger une simulation depuis un fichier JSON"""
-    try:
-        # Charger les données depuis le fichier JSON
-        filename = f"data/simulations/{simulation_id}.json"
-        with open(filename, 'r', encoding='utf-8') as f:
-            simulation_data = json.load(f)
+        # Traiter les événements sur les parts
+        for evenement in params.get('evenements_parts', []):
+            try:
+                simulation_data['evenements_parts'].append({
+                    "date": evenement.get('date', '01/01/2024'),
+                    "type": evenement.get('type', 'distribution'),
+                    "parts": float(evenement.get('parts', 0.0) or 0.0),
+                    "montant_par_part": float(evenement.get('montant_par_part', 0.0) or 0.0)
+                })
+            except (ValueError, TypeError) as e:
+                signaler("warning", f"Problème avec un événement sur les parts: {str(e)}")
         
-        # Structure pour stocker les paramètres nécessaires à l'application
-        params = {
-            'nom_fonds': simulation_data.get('nom_fonds', 'Fonds sans nom'),
-            'nom_scenario': simulation_data.get('nom_scenario', 'Base case'),
-            'date_vl_connue': simulation_data.get('date_vl_connue', '31/12/2023'),
-            'date_fin_fonds': simulation_data.get('date_fin_fonds', '31/12/2026'),
-            'anr_derniere_vl': float(simulation_data.get('anr_derniere_vl', 10000000.0)),
-            'nombre_parts': float(simulation_data.get('nombre_parts', 10000.0)),
-            'impacts': [],
-            'impacts_multidates': [],
-            'actifs': []
-        }
+        # Typer la simulation au schéma de stockage
+        simulation_data, erreurs = valider_simulation(simulation_data)
+        if erreurs:
+            signaler("error", "Simulation invalide: " + " ; ".join(erreurs))
+            return None, False
         
-        # Récupérer les impacts récurrents
-        for impact in simulation_data.get('impacts', []):
-            libelle = impact.get('libelle', 'Sans nom')
-            montant = float(impact.get('montant', 0.0))
-            params['impacts'].append((libelle, montant))
+        # Synthèse de la projection, sauvegardée avec la simulation : les listes l'affichent sans recalcul
+        try:
+            resume = resumer_projection(calculer_projection(simulation_data, sous_fonds=sous_fonds,
+                                                            courbes_fx=courbes_fx))
+        except (ValueError, KeyError, IndexError) as e:
+            signaler("warning", f"Synthèse de la projection non calculée: {str(e)}")
+            resume = None
+        
+        # Scénario dérivé : ne conserver que les différences avec la dernière version du parent
+        date_vl_resolue = simulation_data['date_vl_connue']
+        scenario_parent = params.get('scenario_parent')
+        if scenario_parent and scenario_parent != nom_scenario:
+            parent = dernieres_versions().get((nettoyer_nom_fonds(nom_fonds), scenario_parent))
+            if parent is None:
+                signaler("warning", f"Scénario parent '{scenario_parent}' introuvable, simulation sauvegardée en entier")
+            else:
+                surcharges = calculer_surcharges(lire_simulation(parent['id']), simulation_data)
+                simulation_data = {
+                    **{k: simulation_data[k] for k in ["id", "nom_fonds", "nom_scenario", "date_creation", "commentaire",
+                                                       "commentaire_simulation"] if k in simulation_data},
+                    "scenario_parent": scenario_parent,
+                    "surcharges": surcharges
+                }
+        
+        if resume is not None:
+            simulation_data['resume'] = resume
         
-        # Récupérer les impacts multidates
-        params['impacts_multidates'] = simulation_data.get('impacts_multidates', [])
+        # Simulation inchangée depuis la dernière version de son scénario : pas de nouvelle copie
+        derniere_version = dernieres_versions().get((nettoyer_nom_fonds(nom_fonds), nom_scenario))
+        if derniere_version is not None and derniere_version.get('empreinte') == empreinte(simulation_data):
+            return derniere_version['id'], True
         
-        # Récupérer les actifs
-        params['actifs'] = simulation_data.get('actifs', [])
+        # Enregistrer au format compact et référencer la simulation dans l'index
+        return ecrire_enregistrement(simulation_data, {"date_vl_connue": date_vl_resolue}), False
         
-        return params
     except Exception as e:
-        st.error(f"Erreur lors du chargement: {str(e)}")
+        signaler("error", f"Erreur lors de la sauvegarde: {str(e)}")
+        import traceback
+        signaler("error", traceback.format_exc())
+        return None, False
+
+def brouillon_sauvegarde(params):
+    """Les paramètres de la session viennent d'être sauvegardés : son brouillon n'a plus lieu d'être"""
+    supprimer_brouillon(st.session_state.brouillon_id)
+    st.session_state.params_reference = empreinte_brouillon(params)
+
+def charger_simulation(simulation_id, versions=None, resolutions=None):
+    """Charger une simulation depuis un fichier JSON"""
+    try:
+        # Charger les données depuis le fichier JSON, résolues sur le scénario parent le cas échéant
+        return params_depuis_simulation(lire_simulation(simulation_id, versions, resolutions))
+    except Exception as e:
+        signaler("error", f"Erreur lors du chargement: {str(e)}")
         return None
 
+def params_depuis_simulation(simulation_data):
+    """Paramètres de l'application à partir d'une simulation typée (voir `valider_simulation`)"""
+    # Structure pour stocker les paramètres nécessaires à l'application
+    params = {
+        'nom_fonds': simulation_data.get('nom_fonds', 'Fonds sans nom'),
+        'nom_scenario': simulation_data.get('nom_scenario', 'Base case'),
+        'date_vl_connue': simulation_data.get('date_vl_connue', '31/12/2023'),
+        'date_fin_fonds': simulation_data.get('date_fin_fonds', '31/12/2026'),
+        'anr_derniere_vl': float(simulation_data.get('anr_derniere_vl', 10000000.0)),
+        'nombre_parts': float(simulation_data.get('nombre_parts', 10000.0)),
+        'commentaire_simulation': simulation_data.get('commentaire_simulation', ''),
+        'impacts': [],
+        'impacts_multidates': [],
+        'actifs': []
+    }
+    
+    # Récupérer les impacts récurrents : un montant fixe en euros reste un couple (libellé, montant)
+    for impact in simulation_data.get('impacts', []):
+        if impact['type'] == 'fixe' and impact['devise'] == DEVISE_FONDS:
+            params['impacts'].append((impact['libelle'], impact['montant']))
+        else:
+            params['impacts'].append(impact)
+    
+    # Récupérer les impacts multidates
+    params['impacts_multidates'] = simulation_data.get('impacts_multidates', [])
+    
+    # Récupérer les actifs
+    params['actifs'] = simulation_data.get('actifs', [])
+    
+    # Récupérer les événements sur les parts
+    params['evenements_parts'] = simulation_data.get('evenements_parts', [])
+    
+    # Récupérer les règles d'IS du fonds
+    params['fiscalite'] = {**FISCALITE_DEFAUT, **simulation_data.get('fiscalite', {})}
+    
+    # Récupérer le mode de calcul et les règles d'arrondi
+    params['arrondi'] = {**ARRONDI_DEFAUT, **simulation_data.get('arrondi', {})}
+    
+    # Récupérer les chocs de change du scénario
+    params['chocs_fx'] = simulation_data.get('chocs_fx', {})
+    
+    # Scénario parent d'un scénario dérivé
+    if simulation_data.get('scenario_parent'):
+        params['scenario_parent'] = simulation_data['scenario_parent']
+    
+    return params
+
+def projeter_simulation(params, cache=None, charger=charger_simulation):
+    """Projeter des paramètres après avoir projeté les fonds qu'ils détiennent en transparence
+
+    `cache` mémorise les projections des sous-fonds ; le partager entre plusieurs
+    fonds d'un même traitement évite de projeter deux fois un même sous-fonds.
+    """
+    sous_fonds = projeter_sous_fonds(params, charger, cache, courbes_fx)
+    return calculer_projection(params, sous_fonds=sous_fonds, courbes_fx=courbes_fx)
+
+def signature_stockage():
+    """Date de modification et taille de l'index et du répertoire des simulations : changent à chaque écriture"""
+    signature = []
+    for chemin in (FICHIER_INDEX, REPERTOIRE_SIMULATIONS):
+        try:
+            etat = os.stat(chemin)
+            signature.append((etat.st_mtime_ns, etat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _catalogue(signature):
+    """Index des simulations et ce que les écrans en déduisent, pour une signature du stockage donnée"""
+    index = lire_index()
+    simulations, erreurs = [], []
+    for simulation_id, entree in index.items():
+        if 'erreur' in entree:
+            erreurs.append(f"Problème lors de la lecture de la simulation {simulation_id}: {entree['erreur']}")
+            continue
+        simulations.append({
+            'id': simulation_id,
+            # Nom du fonds sans les dates potentielles
+            'nom_fonds': nettoyer_nom_fonds(entree.get('nom_fonds') or 'Fonds sans nom'),
+            'nom_scenario': entree.get('nom_scenario') or 'Base case',
+            'date_vl_connue': entree.get('date_vl_connue') or '31/12/2023',
+            'date_creation': entree.get('date_creation') or '',
+            'commentaire': entree.get('commentaire') or '',
+            'scenario_parent': entree.get('scenario_parent'),
+            'empreinte': entree.get('empreinte'),
+            'resume': entree.get('resume')
+        })
+    # Du plus récent au plus ancien
+    simulations.sort(key=lambda sim: sim['date_creation'], reverse=True)
+    return {
+        "simulations": simulations,
+        "par_id": {sim['id']: sim for sim in simulations},
+        "versions": dernieres_versions(index),
+        "fonds": sorted({sim['nom_fonds'] for sim in simulations}),
+        "sans_synthese": sum(1 for sim in simulations if not sim['resume']),
+        "historiques": sum(1 for entree in os.scandir(REPERTOIRE_SIMULATIONS) if entree.name.endswith('.json'))
+                       if os.path.isdir(REPERTOIRE_SIMULATIONS) else 0,
+        "erreurs": erreurs,
+        "recherches": {}
+    }
+
+def catalogue():
+    """Index des simulations, lu et trié une seule fois tant que le stockage ne change pas
+
+    Partagé entre les sessions et entre la barre latérale, le navigateur et les
+    listes de scénarios : une réexécution du script ne relit pas l'index. Les
+    listes et dictionnaires retournés ne doivent pas être modifiés.
+    """
+    return _catalogue(signature_stockage())
+
+def iterer_simulations():
+    """Parcourir les simulations sauvegardées d'après l'index, sans ouvrir leurs fichiers"""
+    yield from lister_simulations()
+
 def lister_simulations():
-    """Lister toutes les simulations sauvegardées"""
+    """Simulations sauvegardées, de la plus récente à la plus ancienne (liste partagée, à ne pas modifier)"""
     try:
-        simulations = []
-        # Trouver tous les fichiers JSON dans le répertoire des simulations
-        json_files = glob.glob('data/simulations/*.json')
-        
-        for file_path in json_files:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    simulation_data = json.load(f)
-                
-                # Créer un dictionnaire avec les informations importantes
-                sim_dict = {
-                    'id': simulation_data.get('id', os.path.basename(file_path).replace('.json', '')),
-                    'nom_fonds': simulation_data.get('nom_fonds', 'Fonds sans nom'),
-                    'nom_scenario': simulation_data.get('nom_scenario', 'Base case'),
-                    'date_vl_connue': simulation_data.get('date_vl_connue', '31/12/2023'),
-                    'date_creation': simulation_data.get('date_creation', ''),
-                    'commentaire': simulation_data.get('commentaire', '')
-                }
-                
-                # Nettoyer le nom du fonds (enlever les dates potentielles)
-                if sim_dict['nom_fonds'] and '(' in sim_dict['nom_fonds']:
-                    # Si le nom contient une parenthèse (comme une date), prendre juste la partie avant
-                    sim_dict['nom_fonds'] = sim_dict['nom_fonds'].split('(')[0].strip()
-                
-                simulations.append(sim_dict)
-            except Exception as e:
-                st.warning(f"Problème lors de la lecture du fichier {file_path}: {str(e)}")
-        
-        # Trier par date de création (du plus récent au plus ancien)
-        simulations.sort(key=lambda x: x.get('date_creation', ''), reverse=True)
-        
-        return simulations
+        contenu = catalogue()
     except Exception as e:
         st.error(f"Erreur lors de la lecture des simulations: {str(e)}")
         return []
+    for erreur in contenu['erreurs']:
+        signaler("warning", erreur)
+    return contenu['simulations']
+
+TAILLE_PAGE_LATERALE = 10
+TAILLES_PAGE = [10, 25, 50]
+
+# Ordres de tri du navigateur de simulations : libellé → (champ, ordre décroissant)
+TRIS_SIMULATIONS = {
+    "Plus récentes d'abord": ("date_creation", True),
+    "Plus anciennes d'abord": ("date_creation", False),
+    "Fonds (A → Z)": ("nom_fonds", False),
+    "Scénario (A → Z)": ("nom_scenario", False),
+}
+
+def rechercher_simulations(simulations, texte="", dates=(), tri="Plus récentes d'abord"):
+    """Simulations répondant à une recherche, triées
+
+    Tous les mots de `texte` doivent figurer, sans tenir compte de la casse, dans le fonds,
+    le scénario ou le commentaire ; `dates` borne la date de création (bornes incluses).
+    """
+    termes = texte.casefold().split()
+    date_min = dates[0].isoformat() if len(dates) > 0 else ""
+    date_max = dates[-1].isoformat() if len(dates) > 0 else "9999-12-31"
+    resultats = [
+        sim for sim in simulations
+        if date_min <= sim['date_creation'][:10] <= date_max
+        and all(terme in f"{sim['nom_fonds']} {sim['nom_scenario']} {sim['commentaire']}".casefold() for terme in termes)
+    ]
+    champ, decroissant = TRIS_SIMULATIONS[tri]
+    # Tri secondaire par date de création, la plus récente d'abord
+    resultats.sort(key=lambda sim: sim['date_creation'], reverse=True)
+    resultats.sort(key=lambda sim: sim[champ].casefold(), reverse=decroissant)
+    return resultats
+
+NB_RECHERCHES_MEMORISEES = 64
+
+def rechercher_dans_catalogue(texte="", dates=(), tri="Plus récentes d'abord"):
+    """Résultats d'une recherche sur les simulations sauvegardées, mémorisés tant que le stockage ne change pas"""
+    contenu = catalogue()
+    recherches = contenu['recherches']
+    cle = (texte, tuple(dates), tri)
+    if cle not in recherches:
+        if len(recherches) >= NB_RECHERCHES_MEMORISEES:
+            recherches.clear()
+        recherches[cle] = rechercher_simulations(contenu['simulations'], texte, dates, tri)
+    return recherches[cle]
+
+def premiere_page(cle):
+    """Revenir à la première page d'un navigateur quand sa recherche change"""
+    st.session_state[f"{cle}_page"] = 0
+
+def paginer(resultats, taille_page, cle, conteneur=st):
+    """Boutons de page précédente et suivante ; retourne les résultats de la page à afficher"""
+    nb_pages = max(1, -(-len(resultats) // taille_page))
+    page = min(st.session_state.get(f"{cle}_page", 0), nb_pages - 1)
+    col_precedente, col_info, col_suivante = conteneur.columns([1, 2, 1])
+    if col_precedente.button("◀", key=f"{cle}_precedente", disabled=page == 0):
+        page -= 1
+    if col_suivante.button("▶", key=f"{cle}_suivante", disabled=page >= nb_pages - 1):
+        page += 1
+    st.session_state[f"{cle}_page"] = page
+    col_info.caption(f"Page {page + 1} / {nb_pages} — {len(resultats)} simulation(s)")
+    return resultats[page * taille_page:(page + 1) * taille_page]
+
+TAILLE_PAGE_SELECTION = 20
+
+def choisir_simulation(label, cle, defaut=None, conteneur=st):
+    """Choisir une simulation sauvegardée dans une page de résultats de recherche ; retourne son identifiant
+
+    La liste déroulante ne contient que la page affichée et la simulation déjà
+    choisie : sa taille ne dépend pas du nombre de simulations stockées.
+    """
+    recherche = conteneur.text_input(f"Rechercher — {label.lower()}", key=f"{cle}_recherche",
+                                     placeholder="Fonds, scénario, commentaire",
+                                     on_change=premiere_page, args=(cle,))
+    par_id = catalogue()['par_id']
+    ids = [sim['id'] for sim in paginer(rechercher_dans_catalogue(recherche), TAILLE_PAGE_SELECTION, cle, conteneur)]
+    choisie = st.session_state.get(cle, defaut)
+    if choisie in par_id and choisie not in ids:
+        ids.insert(0, choisie)
+    if not ids:
+        return None
+    return conteneur.selectbox(
+        label, options=ids, index=ids.index(choisie) if choisie in ids else 0,
+        format_func=lambda simulation_id: "{nom_fonds} - {nom_scenario} ({date_creation})".format(**par_id[simulation_id]),
+        key=cle
+    )
 
 def supprimer_simulation(simulation_id):
-    """Supprimer une simulation (fichier JSON)"""
+    """Supprimer une simulation (fichier et entrée d'index)
+
+    La dernière version d'un scénario ne peut pas être supprimée tant que des
+    scénarios dérivés en héritent.
+    """
     try:
-        filename = f"data/simulations/{simulation_id}.json"
-        if os.path.exists(filename):
-            os.remove(filename)
+        simulations = list(iterer_simulations())
+        sim = next((s for s in simulations if s['id'] == simulation_id), None)
+        if sim is not None:
+            versions = [s for s in simulations
+                        if (s['nom_fonds'], s['nom_scenario']) == (sim['nom_fonds'], sim['nom_scenario'])]
+            derives = {s['nom_scenario'] for s in simulations
+                       if s['nom_fonds'] == sim['nom_fonds'] and s.get('scenario_parent') == sim['nom_scenario']}
+            if derives and len(versions) == 1:
+                st.error(f"Le scénario '{sim['nom_scenario']}' est le parent de: {', '.join(sorted(derives))}")
+                return False
+        if supprimer_enregistrement(simulation_id):
             return True
         else:
             st.warning(f"Simulation avec ID {simulation_id} introuvable.")
@@ -339,22 +747,362 @@ def supprimer_simulation(simulation_id):
         st.error(f"Erreur lors de la suppression: {str(e)}")
         return False
 
+def chargeur_lot(versions):
+    """Fonction de chargement des simulations d'un traitement en lot, résolues sur l'état `versions` du stockage
+
+    Les scénarios parents résolus sont gardés pour tous leurs dérivés ; les
+    autres simulations ne restent pas en mémoire une fois chargées.
+    """
+    parents = {versions[(fonds_sim, sim['scenario_parent'])]['id'] for (fonds_sim, _), sim in versions.items()
+               if (fonds_sim, sim.get('scenario_parent')) in versions}
+    resolutions = {}
+    
+    def charger(simulation_id):
+        params_sim = charger_simulation(simulation_id, versions, resolutions)
+        for superflue in set(resolutions) - parents:
+            resolutions.pop(superflue, None)
+        return params_sim
+    return charger
+
+def consolider_simulations(nom_scenario="Base case", fonds=None):
+    """Consolider l'ANR et les distributions des fonds sur une grille de dates commune
+
+    Les simulations sont lues en flux : seules les métadonnées sont conservées pour
+    la sélection, puis chaque simulation retenue est chargée, projetée et libérée
+    avant la suivante. Restent en mémoire les séries d'ANR et de distributions,
+    les scénarios parents résolus et les projections des fonds détenus en transparence.
+    """
+    versions = dernieres_versions()
+    charger = chargeur_lot(versions)
+    retenues = {fonds_sim: sim for (fonds_sim, scenario_sim), sim in versions.items() if scenario_sim == nom_scenario}
+    contributions = {}
+    distributions = {}
+    cache_sous_fonds = {}
+    for nom_fonds in sorted(retenues):
+        if fonds and nom_fonds not in fonds:
+            continue
+        params_fonds = charger(retenues[nom_fonds]['id'])
+        if params_fonds is None:
+            continue
+        try:
+            resultat = projeter_simulation(params_fonds, cache_sous_fonds, charger)
+        except ValueError as e:
+            st.warning(f"Projection impossible pour le fonds {nom_fonds}: {str(e)}")
+            continue
+        contributions[nom_fonds] = pd.Series(resultat['anr'], index=pd.DatetimeIndex(resultat['dates']))
+        distributions[nom_fonds] = pd.Series(resultat['distributions'], index=pd.DatetimeIndex(resultat['dates']))
+    return consolider_series(contributions), consolider_series(distributions, prolonger=False)
+
+def ligne_roll_forward(sim, nouvelle_date, anr_reel, statut=""):
+    """Ligne du rapport de roll-forward d'une simulation, à compléter par son report"""
+    return {
+        "Fonds": sim['nom_fonds'],
+        "Scénario": sim['nom_scenario'],
+        "Date VL": nouvelle_date.strftime("%d/%m/%Y"),
+        "ANR prévu (€)": None,
+        "ANR réel (€)": float(anr_reel),
+        "Écart (€)": None,
+        "Écart (%)": None,
+        "VL prévue (€)": None,
+        "VL réelle (€)": None,
+        "Nouvel ID": None,
+        "Statut": statut,
+        "Messages": ""
+    }
+
+def collecter_messages(ligne, traitement):
+    """Exécuter un traitement dans un thread en reprenant ses messages dans la colonne « Messages » de la ligne"""
+    messages_differes.liste = []
+    try:
+        return traitement()
+    except Exception as e:
+        ligne["Statut"] = f"Erreur: {str(e)}"
+    finally:
+        ligne["Messages"] = " ; ".join(filter(None, [ligne["Messages"]] + messages_differes.liste))
+        messages_differes.liste = None
+
+def reporter_simulation(sim, nouvelle_date, anr_reel, occurrences_echues, versions, resolutions):
+    """Comparer la projection d'une simulation à la VL réelle et la rebaser ; retourne la ligne du rapport et les paramètres rebasés
+
+    La simulation et ses fonds détenus sont résolus sur `versions`, l'état du
+    stockage avant tout report : un scénario dérivé est comparé et rebasé depuis
+    son parent d'origine, pas depuis le parent déjà rebasé. Les paramètres
+    rebasés valent None en cas d'échec.
+    """
+    ligne = ligne_roll_forward(sim, nouvelle_date, anr_reel)
+    charger = lambda simulation_id: charger_simulation(simulation_id, versions, resolutions)
+    
+    def reporter():
+        params_sim = charger(sim['id'])
+        if params_sim is None:
+            ligne["Statut"] = "Échec du chargement"
+            return None
+        
+        # Comparer la projection à la VL réelle
+        resultat = projeter_simulation(params_sim, charger=charger)
+        anr_prevu = valeur_a_date(resultat['dates'], resultat['anr'], nouvelle_date)
+        parts = valeur_a_date(resultat['dates'], resultat['parts'], nouvelle_date)
+        ligne["ANR prévu (€)"] = anr_prevu
+        ligne["Écart (€)"] = float(anr_reel) - anr_prevu
+        ligne["Écart (%)"] = (float(anr_reel) / anr_prevu - 1) * 100 if anr_prevu else None
+        ligne["VL prévue (€)"] = round(anr_prevu / parts, 2) if parts else None
+        ligne["VL réelle (€)"] = round(float(anr_reel) / parts, 2) if parts else None
+        return reporter_parametres(params_sim, nouvelle_date, anr_reel, occurrences_echues, courbes_fx)
+    
+    return ligne, collecter_messages(ligne, reporter)
+
+def sauvegarder_report(ligne, params_reportes, nouvelle_date):
+    """Sauvegarder une simulation rebasée comme nouvelle version et compléter sa ligne du rapport"""
+    def sauvegarder():
+        commentaire = f"{ligne['Scénario']} - Roll-forward VL {nouvelle_date.strftime('%d/%m/%Y')}"
+        ligne["Nouvel ID"], doublon = sauvegarder_simulation(params_reportes, commentaire)
+        if not ligne["Nouvel ID"]:
+            ligne["Statut"] = "Échec de la sauvegarde"
+        else:
+            ligne["Statut"] = "Identique à la dernière version" if doublon else "OK"
+    collecter_messages(ligne, sauvegarder)
+    return ligne
+
+def roll_forward_simulations(nouvelle_date, anr_reels, occurrences_echues="supprimer", max_workers=8):
+    """Rebaser en lot la dernière version de chaque scénario des fonds dont l'ANR réel est fourni
+
+    Toutes les simulations sont d'abord chargées, comparées et rebasées en
+    parallèle sur un même état du stockage, puis sauvegardées parents avant
+    dérivés : chaque dérivé ne garde que ses différences avec son parent rebasé.
+    Le rapport liste, pour chacune, l'écart entre l'ANR prévu à la nouvelle date
+    et l'ANR réel, ainsi que les scénarios non reportés.
+    """
+    versions = dernieres_versions()
+    resolutions = {}
+    
+    # Dernière version de chaque couple (fonds, scénario), si elle est antérieure à la nouvelle VL :
+    # un scénario déjà rebasé à cette date ou au-delà n'est pas reporté une seconde fois
+    a_reporter, ignorees = {}, []
+    for (nom_fonds, nom_scenario), sim in sorted(versions.items()):
+        if nom_fonds not in anr_reels:
+            continue
+        sim = {**sim, 'nom_fonds': nom_fonds, 'nom_scenario': nom_scenario}
+        try:
+            date_vl = datetime.strptime(sim.get('date_vl_connue') or '', "%d/%m/%Y")
+        except ValueError:
+            ignorees.append(ligne_roll_forward(sim, nouvelle_date, anr_reels[nom_fonds], "Date de VL inconnue"))
+            continue
+        if date_vl >= nouvelle_date:
+            ignorees.append(ligne_roll_forward(sim, nouvelle_date, anr_reels[nom_fonds],
+                                               f"Déjà à jour (VL du {sim['date_vl_connue']})"))
+            continue
+        a_reporter[(nom_fonds, nom_scenario)] = sim
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        reports = dict(zip(a_reporter, executor.map(
+            lambda sim: reporter_simulation(sim, nouvelle_date, anr_reels[sim['nom_fonds']], occurrences_echues,
+                                            versions, resolutions),
+            a_reporter.values()
+        )))
+    
+    # Rang de chaque scénario dans sa chaîne de parents : les parents sont sauvegardés avant leurs dérivés
+    def rang(cle):
+        vus = set()
+        while cle in versions and versions[cle].get('scenario_parent') and cle not in vus:
+            vus.add(cle)
+            cle = (cle[0], versions[cle]['scenario_parent'])
+        return len(vus)
+    
+    for niveau in sorted({rang(cle) for cle in reports}):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(
+                lambda report: sauvegarder_report(*report, nouvelle_date),
+                [reports[cle] for cle in reports if rang(cle) == niveau and reports[cle][1] is not None]
+            ))
+    return pd.DataFrame([ligne for ligne, _ in reports.values()] + ignorees)
+
+# Fonctions pour l'historique des VL officielles
+def courbes_en_tableau(courbes):
+    """Mettre les courbes de change au format long pour la saisie : spot puis points de chaque devise"""
+    lignes = []
+    for devise, courbe in sorted(courbes.items()):
+        lignes.append({"Devise": devise, "Date (jj/mm/aaaa)": courbe.get('date_spot', ''),
+                       "Cours (€)": float(courbe['spot']), "Points de terme": None})
+        for point in courbe.get('points', []):
+            lignes.append({"Devise": devise, "Date (jj/mm/aaaa)": point.get('date', ''),
+                           "Cours (€)": point.get('cours'), "Points de terme": point.get('points')})
+    return pd.DataFrame(lignes, columns=["Devise", "Date (jj/mm/aaaa)", "Cours (€)", "Points de terme"])
+
+def tableau_en_courbes(tableau):
+    """Reconstruire les courbes depuis la saisie : la première ligne de chaque devise est le spot
+
+    Les lignes suivantes donnent soit un cours projeté, soit des points de terme
+    ajoutés au spot.
+    """
+    courbes = {}
+    for _, ligne in tableau.iterrows():
+        devise = str(ligne["Devise"] or "").strip().upper()
+        date_ligne = str(ligne["Date (jj/mm/aaaa)"] or "").strip()
+        if not devise or devise == DEVISE_FONDS:
+            continue
+        datetime.strptime(date_ligne, "%d/%m/%Y")
+        cours = float(ligne["Cours (€)"]) if pd.notna(ligne["Cours (€)"]) else None
+        points = float(ligne["Points de terme"]) if pd.notna(ligne["Points de terme"]) else None
+        if devise not in courbes:
+            if cours is None:
+                raise ValueError(f"Cours spot manquant pour la devise {devise}")
+            courbes[devise] = {"date_spot": date_ligne, "spot": cours, "points": []}
+        elif cours is not None or points is not None:
+            point = {"date": date_ligne}
+            point.update({"cours": cours} if cours is not None else {"points": points})
+            courbes[devise]['points'].append(point)
+    return courbes
+
+def charger_historique_vl():
+    """Charger l'historique des VL officielles, trié par fonds et par date"""
+    filename = 'data/historique_vl.csv'
+    if not os.path.exists(filename):
+        return pd.DataFrame(columns=["nom_fonds", "date", "vl", "anr"])
+    historique = pd.read_csv(filename, parse_dates=["date"])
+    return historique.sort_values(["nom_fonds", "date"]).reset_index(drop=True)
+
+def importer_historique_vl(fichier):
+    """Intégrer un CSV d'historique (colonnes Fonds, Date, VL et éventuellement ANR) au stockage
+
+    Le fichier peut être séparé par des points-virgules avec des décimales à virgule.
+    Une VL déjà connue pour le même fonds et la même date est remplacée.
+    """
+    nouvelles = pd.read_csv(fichier, sep=None, engine='python', dtype=str)
+    nouvelles.columns = [c.strip().lower() for c in nouvelles.columns]
+    nouvelles = nouvelles.rename(columns={"fonds": "nom_fonds", "nom du fonds": "nom_fonds"})
+    colonnes_manquantes = {"nom_fonds", "date", "vl"} - set(nouvelles.columns)
+    if colonnes_manquantes:
+        raise ValueError(f"Colonnes manquantes: {', '.join(sorted(colonnes_manquantes))}")
+    if "anr" not in nouvelles.columns:
+        nouvelles["anr"] = None
+    
+    nouvelles = nouvelles[["nom_fonds", "date", "vl", "anr"]]
+    nouvelles["nom_fonds"] = nouvelles["nom_fonds"].str.strip()
+    nouvelles["date"] = pd.to_datetime(nouvelles["date"], dayfirst=True)
+    for colonne in ["vl", "anr"]:
+        nouvelles[colonne] = pd.to_numeric(
+            nouvelles[colonne].str.replace(" ", "").str.replace("€", "").str.replace(",", "."),
+            errors='coerce'
+        )
+    
+    historique = pd.concat([charger_historique_vl(), nouvelles.dropna(subset=["vl"])], ignore_index=True)
+    historique = historique.drop_duplicates(subset=["nom_fonds", "date"], keep="last")
+    historique = historique.sort_values(["nom_fonds", "date"]).reset_index(drop=True)
+    historique.to_csv('data/historique_vl.csv', index=False)
+    return len(nouvelles)
+
+def backtester_simulations(historique):
+    """Comparer les projections de toutes les simulations sauvegardées aux VL réelles
+
+    Chaque simulation est projetée une fois et mise au format long ; la comparaison
+    à l'historique se fait ensuite en une seule jointure.
+    """
+    fonds_historises = set(historique["nom_fonds"])
+    previsions = []
+    cache_sous_fonds = {}
+    # Prévisions par empreinte des paramètres : des versions identiques ne sont projetées qu'une fois
+    lignes_par_calcul = {}
+    charger = chargeur_lot(dernieres_versions())
+    for sim in iterer_simulations():
+        if sim['nom_fonds'] not in fonds_historises:
+            continue
+        params_sim = charger(sim['id'])
+        if params_sim is None:
+            continue
+        cle = empreinte_calcul(params_sim)
+        if cle not in lignes_par_calcul:
+            try:
+                lignes_par_calcul[cle] = previsions_en_lignes(projeter_simulation(params_sim, cache_sous_fonds, charger))
+            except ValueError:
+                continue
+        previsions.append(lignes_par_calcul[cle].assign(
+            id=sim['id'], nom_fonds=sim['nom_fonds'], nom_scenario=sim['nom_scenario']
+        ))
+    if not previsions:
+        return None, None
+    return mesurer_precision(pd.concat(previsions, ignore_index=True), historique)
+
 # Initialiser le stockage au démarrage
 try:
     init_storage()
+    demarrer_file_taches()
 except Exception as e:
     st.error(f"Erreur critique lors de l'initialisation: {str(e)}")
 
+# Courbes de change utilisées par toutes les projections
+try:
+    courbes_fx = charger_courbes_fx()
+except (OSError, ValueError) as e:
+    st.error(f"Erreur lors du chargement des courbes de change: {str(e)}")
+    courbes_fx = {}
+devises_disponibles = [DEVISE_FONDS] + sorted(courbes_fx)
+
 # === TITRE ET LAYOUT PRINCIPAL ===
 st.title("Atterrissage VL")
 
+# === BROUILLONS ===
+# Chaque session a son propre brouillon, repris dans l'URL : après un rafraîchissement de la page, le
+# brouillon de l'URL est proposé en premier à la restauration. Il n'est jamais repris d'office, deux
+# onglets ouverts sur la même URL écraseraient sinon le même brouillon.
+if 'brouillon_id' not in st.session_state:
+    try:
+        brouillon_url = str(uuid.UUID(st.query_params.get("brouillon", "")))
+    except ValueError:
+        brouillon_url = None
+    st.session_state.brouillon_id = str(uuid.uuid4())
+    st.query_params["brouillon"] = st.session_state.brouillon_id
+    # Proposés à la restauration une seule fois, à l'ouverture de la session : le sien d'abord
+    brouillons_proposes = lister_brouillons()
+    brouillons_proposes.sort(key=lambda brouillon: brouillon['id'] != brouillon_url)
+    st.session_state.brouillons_proposes = [brouillon['id'] for brouillon in brouillons_proposes]
+
+if st.session_state.brouillons_proposes:
+    brouillons_proposes = [brouillon for brouillon in map(lire_brouillon, st.session_state.brouillons_proposes)
+                           if brouillon is not None]
+    if brouillons_proposes:
+        with st.container(border=True):
+            st.info(f"{len(brouillons_proposes)} brouillon(s) non sauvegardé(s) disponible(s)")
+            brouillon_choisi = st.selectbox(
+                "Brouillon", options=range(len(brouillons_proposes)),
+                format_func=lambda i: (f"{brouillons_proposes[i]['params'].get('nom_fonds', '')} - "
+                                       f"{brouillons_proposes[i]['params'].get('nom_scenario', '')} "
+                                       f"(modifié le {brouillons_proposes[i]['date_modification']})"),
+                key="brouillon_choisi"
+            )
+            col_restaurer, col_supprimer, col_ignorer = st.columns(3)
+            with col_restaurer:
+                if st.button("↩️ Restaurer", key="brouillon_restaurer"):
+                    brouillon = brouillons_proposes[brouillon_choisi]
+                    # La session reprend le brouillon à son compte : il sera mis à jour à la prochaine modification
+                    supprimer_brouillon(st.session_state.brouillon_id)
+                    st.session_state.brouillon_id = brouillon['id']
+                    st.query_params["brouillon"] = brouillon['id']
+                    st.session_state.params = brouillon['params']
+                    st.session_state.brouillons_proposes = []
+                    st.rerun()
+            with col_supprimer:
+                if st.button("🗑️ Supprimer ce brouillon", key="brouillon_supprimer"):
+                    supprimer_brouillon(brouillons_proposes[brouillon_choisi]['id'])
+                    st.session_state.brouillons_proposes.remove(brouillons_proposes[brouillon_choisi]['id'])
+                    st.rerun()
+            with col_ignorer:
+                if st.button("Ignorer", key="brouillon_ignorer"):
+                    st.session_state.brouillons_proposes = []
+                    st.rerun()
+
 # Afficher la barre latérale avec les simulations chargées
 st.sidebar.title("Simulations sauvegardées")
 simulations = lister_simulations()
 if simulations:
     st.sidebar.markdown("### Charger une simulation")
-    for sim in simulations:
-        if st.sidebar.button(f"📂 {sim['nom_fonds']} - {sim['nom_scenario']}", key=f"sidebar_load_{sim['id']}"):
+    # Une page de résultats à la fois : le nombre de boutons ne dépend pas de la taille du stockage
+    recherche_laterale = st.sidebar.text_input("Rechercher", key="sidebar_recherche",
+                                               placeholder="Fonds, scénario, commentaire",
+                                               on_change=premiere_page, args=("sidebar",))
+    for sim in paginer(rechercher_dans_catalogue(recherche_laterale), TAILLE_PAGE_LATERALE,
+                       "sidebar", st.sidebar):
+        if st.sidebar.button(f"📂 {sim['nom_fonds']} - {sim['nom_scenario']}", key=f"sidebar_load_{sim['id']}",
+                             help=libelle_resume(sim['resume'])):
             params_charges = charger_simulation(sim['id'])
             if params_charges:
                 st.session_state.params = params_charges
@@ -366,7 +1114,9 @@ else:
     st.sidebar.markdown("---")
 
 # Interface principale avec onglets
-tab1, tab2, tab3 = st.tabs(["📊 Projection VL", "💾 Gestion des simulations", "ℹ️ Aide"])
+tab1, tab2, tab_consolidation, tab_backtesting, tab3 = st.tabs(
+    ["📊 Projection VL", "💾 Gestion des simulations", "🏦 Consolidation", "🎯 Backtesting", "ℹ️ Aide"]
+)
 
 with tab1:
     # === INITIALISATION DES PARAMÈTRES DE SESSION ===
@@ -374,6 +1124,9 @@ with tab1:
         st.session_state.params = default_params.copy()
     
     params = st.session_state.params
+    # Paramètres remplacés depuis l'exécution précédente (ouverture, chargement, restauration) :
+    # leur état sert de référence, le brouillon n'est écrit qu'après une modification
+    params_remplaces = params is not st.session_state.get('params_edites')
     
     # === CRÉATION DE COLONNES POUR LE LAYOUT ===
     col_param, col_impacts = st.columns([1, 1])
@@ -383,6 +1136,20 @@ with tab1:
         nom_fonds = st.text_input("Nom du fonds", params.get('nom_fonds', default_params['nom_fonds']))
         nom_scenario = st.text_input("Nom du scénario", params.get('nom_scenario', default_params['nom_scenario']))
         
+        # Scénario parent : la simulation n'est alors sauvegardée que par différence avec lui
+        scenarios_parents = sorted({scenario_sim for (fonds_sim, scenario_sim), sim in catalogue()['versions'].items()
+                                    if fonds_sim == nettoyer_nom_fonds(nom_fonds)
+                                    and scenario_sim != nom_scenario and sim.get('scenario_parent') != nom_scenario})
+        parent_defaut = params.get('scenario_parent') or ""
+        if parent_defaut and parent_defaut not in scenarios_parents:
+            scenarios_parents.append(parent_defaut)
+        scenario_parent = st.selectbox(
+            "Dérivé du scénario", options=[""] + scenarios_parents,
+            index=([""] + scenarios_parents).index(parent_defaut),
+            format_func=lambda nom: nom or "Aucun (simulation complète)", key="scenario_parent",
+            help="Seules les différences avec la dernière version du scénario parent sont sauvegardées"
+        )
+        
         col1, col2 = st.columns(2)
         with col1:
             date_vl_connue_str = st.text_input("Date dernière VL connue (jj/mm/aaaa)", 
@@ -428,31 +1195,65 @@ with tab1:
                 st.markdown(f"##### Impact {i+1}")
                 col1, col2 = st.columns([2, 1])
                 
+                impact_defaut = None
                 if i < len(params.get('impacts', [])):
                     try:
-                        if isinstance(params['impacts'][i], tuple) and len(params['impacts'][i]) == 2:
-                            libelle_defaut, montant_defaut = params['impacts'][i]
-                        elif isinstance(params['impacts'][i], list) and len(params['impacts'][i]) == 2:
-                            libelle_defaut, montant_defaut = params['impacts'][i]
-                        elif isinstance(params['impacts'][i], dict) and 'libelle' in params['impacts'][i] and 'montant' in params['impacts'][i]:
-                            libelle_defaut = params['impacts'][i]['libelle']
-                            montant_defaut = params['impacts'][i]['montant']
-                        else:
-                            libelle_defaut = f"Impact {i+1}"
-                            montant_defaut = 0.0
+                        impact_defaut = normaliser_impact(params['impacts'][i])
                     except (IndexError, TypeError, ValueError):
-                        libelle_defaut = f"Impact {i+1}"
-                        montant_defaut = 0.0
-                else:
-                    libelle_defaut = f"Impact {i+1}"
-                    montant_defaut = 0.0
+                        impact_defaut = None
+                if impact_defaut is None:
+                    impact_defaut = {"libelle": f"Impact {i+1}", "type": "fixe", "devise": DEVISE_FONDS, "montant": 0.0,
+                                     "taux": 0.0, "plancher": None, "plafond": None}
                     
                 with col1:
-                    libelle = st.text_input(f"Libellé impact {i+1}", libelle_defaut, key=f"imp_lib_{i}")
+                    libelle = st.text_input(f"Libellé impact {i+1}", impact_defaut['libelle'], key=f"imp_lib_{i}")
                 with col2:
-                    montant = champ_numerique(f"Montant semestriel (€)", montant_defaut, st)
-                    
-                impacts.append((libelle, montant))
+                    type_impact = st.selectbox(
+                        f"Type d'impact {i+1}",
+                        options=list(TYPES_IMPACTS),
+                        index=list(TYPES_IMPACTS).index(impact_defaut['type']),
+                        format_func=TYPES_IMPACTS.get,
+                        key=f"imp_type_{i}"
+                    )
+                
+                if type_impact == 'fixe':
+                    col_montant, col_devise = st.columns([2, 1])
+                    with col_devise:
+                        devise_impact = choisir_devise(f"Devise impact {i+1}", impact_defaut['devise'], f"imp_devise_{i}")
+                    with col_montant:
+                        montant = champ_numerique(f"Montant semestriel ({symbole_devise(devise_impact)})",
+                                                  impact_defaut['montant'], st)
+                    if devise_impact == DEVISE_FONDS:
+                        impacts.append((libelle, montant))
+                    else:
+                        impacts.append({"libelle": libelle, "type": "fixe", "devise": devise_impact, "montant": montant,
+                                        "taux": 0.0, "plancher": None, "plafond": None})
+                else:
+                    col_taux, col_plancher, col_plafond = st.columns(3)
+                    with col_taux:
+                        # Taux semestriel signé, négatif pour des frais
+                        taux_text = st.text_input(f"Taux semestriel (%)", value=f"{impact_defaut['taux'] * 100:.4f}".replace(".", ","),
+                                                  key=f"imp_taux_{i}", help="Négatif pour des frais (ex: -0,75)")
+                        try:
+                            taux = float(taux_text.replace(" ", "").replace(",", ".")) / 100
+                        except ValueError:
+                            st.warning(f"Valeur non numérique pour le taux, utilisation de {impact_defaut['taux'] * 100}%")
+                            taux = impact_defaut['taux']
+                    bornes = []
+                    for conteneur, nom_borne, libelle_borne in [(col_plancher, 'plancher', "Plancher (€, optionnel)"),
+                                                                (col_plafond, 'plafond', "Plafond (€, optionnel)")]:
+                        with conteneur:
+                            valeur_borne = impact_defaut[nom_borne]
+                            borne_text = st.text_input(libelle_borne, value="" if valeur_borne is None else format_fr_euro(valeur_borne),
+                                                       key=f"imp_{nom_borne}_{i}", help="Borne sur la valeur absolue du montant")
+                            try:
+                                borne_text = borne_text.replace(" ", "").replace(",", ".").replace("€", "")
+                                bornes.append(abs(float(borne_text)) if borne_text else None)
+                            except ValueError:
+                                st.warning(f"Valeur non numérique pour {libelle_borne}, borne ignorée")
+                                bornes.append(None)
+                    impacts.append({"libelle": libelle, "type": type_impact, "montant": 0.0,
+                                    "taux": taux, "plancher": bornes[0], "plafond": bornes[1]})
                 st.markdown("---")
     
     # === DATES POUR LA PROJECTION ===
@@ -460,14 +1261,7 @@ with tab1:
         date_vl_connue = datetime.strptime(date_vl_connue_str, "%d/%m/%Y")
         date_fin_fonds = datetime.strptime(date_fin_fonds_str, "%d/%m/%Y")
         
-        dates_semestres = [date_vl_connue]
-        y = date_vl_connue.year
-        while datetime(y, 12, 31) <= date_fin_fonds:
-            if datetime(y, 6, 30) > date_vl_connue:
-                dates_semestres.append(datetime(y, 6, 30))
-            if datetime(y, 12, 31) > date_vl_connue:
-                dates_semestres.append(datetime(y, 12, 31))
-            y += 1
+        dates_semestres = generer_dates_semestres(date_vl_connue, date_fin_fonds)
         
         # Liste des dates formatées pour le selectbox
         dates_semestres_str = [d.strftime("%d/%m/%Y") for d in dates_semestres]
@@ -491,12 +1285,18 @@ with tab1:
                 impact_default = params['impacts_multidates'][i]
                 libelle_defaut = impact_default.get('libelle', f"Impact multidate {i+1}")
                 montants_defaut = impact_default.get('montants', [])
+                devise_defaut = impact_default.get('devise', DEVISE_FONDS)
             else:
                 libelle_defaut = f"Impact multidate {i+1}"
                 montants_defaut = []
+                devise_defaut = DEVISE_FONDS
             
-            # Libellé de l'impact multidate
-            libelle = st.text_input(f"Libellé impact multidate {i+1}", libelle_defaut, key=f"multi_lib_{i}")
+            # Libellé et devise de l'impact multidate
+            col_lib, col_devise = st.columns([2, 1])
+            with col_lib:
+                libelle = st.text_input(f"Libellé impact multidate {i+1}", libelle_defaut, key=f"multi_lib_{i}")
+            with col_devise:
+                devise_multidate = choisir_devise(f"Devise impact multidate {i+1}", devise_defaut, f"multi_devise_{i}")
             
             # Nombre d'occurrences pour cet impact
             nb_occurrences = st.number_input(
@@ -537,24 +1337,83 @@ with tab1:
                 
                 with col2:
                     # Champ pour le montant
-                    montant = champ_numerique(f"Montant (€)", montant_defaut, st)
+                    montant = champ_numerique(f"Montant ({symbole_devise(devise_multidate)})", montant_defaut, st)
                 
                 montants.append({
                     "date": date_str,
                     "montant": montant
                 })
             
-            impacts_multidates.append({
+            impact_multidate = {
                 "libelle": libelle,
                 "montants": montants
-            })
+            }
+            if devise_multidate != DEVISE_FONDS:
+                impact_multidate['devise'] = devise_multidate
+            impacts_multidates.append(impact_multidate)
             
             st.markdown("---")
     
     # Actifs
     st.subheader("Actifs")
+    with st.expander("Règles d'IS du fonds", expanded=False):
+        fiscalite_defaut = {**FISCALITE_DEFAUT, **(params.get('fiscalite') or {})}
+        st.caption("Taux d'IS applicable aux plus-values des actifs avec IS à provisionner, à partir de chaque date")
+        bareme_saisi = st.data_editor(
+            pd.DataFrame({
+                "À partir du (jj/mm/aaaa)": [e.get('date', '') for e in fiscalite_defaut['taux']],
+                "Taux (%)": [float(e.get('taux', 0)) * 100 for e in fiscalite_defaut['taux']]
+            }),
+            num_rows="dynamic",
+            hide_index=True,
+            use_container_width=True,
+            key="fisc_bareme"
+        )
+        col_fisc1, col_fisc2 = st.columns(2)
+        with col_fisc1:
+            compensation = st.checkbox("Compenser plus et moins-values entre actifs", value=fiscalite_defaut['compensation'],
+                                       key="fisc_compensation")
+        with col_fisc2:
+            report_deficits = st.checkbox("Reporter les moins-values sur les semestres suivants",
+                                          value=fiscalite_defaut['report_deficits'], key="fisc_report")
+        
+        bareme = []
+        for _, ligne_bareme in bareme_saisi.iterrows():
+            date_bareme = str(ligne_bareme["À partir du (jj/mm/aaaa)"] or "").strip()
+            if not date_bareme or pd.isna(ligne_bareme["Taux (%)"]):
+                continue
+            try:
+                datetime.strptime(date_bareme, "%d/%m/%Y")
+                bareme.append({"date": date_bareme, "taux": float(ligne_bareme["Taux (%)"]) / 100})
+            except ValueError:
+                st.warning(f"Date invalide dans le barème d'IS: {date_bareme}")
+        fiscalite = {
+            "taux": bareme or FISCALITE_DEFAUT['taux'],
+            "compensation": compensation,
+            "report_deficits": report_deficits
+        }
+    
+    with st.expander("Calcul et arrondis", expanded=False):
+        arrondi_defaut = {**ARRONDI_DEFAUT, **(params.get('arrondi') or {})}
+        st.caption("En centimes entiers, les montants sont arrondis au centime selon la règle choisie, "
+                   "comme dans les VL officielles de l'administrateur du fonds")
+        mode_calcul = st.radio("Mode de calcul", options=list(MODES_CALCUL), format_func=MODES_CALCUL.get,
+                               index=list(MODES_CALCUL).index(arrondi_defaut['mode']), key="arrondi_mode")
+        col_arrondi1, col_arrondi2 = st.columns(2)
+        with col_arrondi1:
+            regle_arrondi = st.selectbox("Règle d'arrondi", options=list(REGLES_ARRONDI), format_func=REGLES_ARRONDI.get,
+                                         index=list(REGLES_ARRONDI).index(arrondi_defaut['regle']),
+                                         disabled=mode_calcul != "centimes", key="arrondi_regle")
+        with col_arrondi2:
+            granularite_arrondi = st.selectbox("Arrondi appliqué à", options=list(GRANULARITES_ARRONDI),
+                                               format_func=GRANULARITES_ARRONDI.get,
+                                               index=list(GRANULARITES_ARRONDI).index(arrondi_defaut['granularite']),
+                                               disabled=mode_calcul != "centimes", key="arrondi_granularite")
+        arrondi = {"mode": mode_calcul, "regle": regle_arrondi, "granularite": granularite_arrondi}
+    
     with st.expander("Gérer les actifs du portefeuille", expanded=True):
         actifs = []
+        emplacements_variations = []
         nb_actifs = st.number_input("Nombre d'actifs", min_value=1, 
                                     value=max(1, len(params.get('actifs', []))), step=1)
         
@@ -568,16 +1427,34 @@ with tab1:
                 val_actuelle = a.get('valeur_actuelle', 1_000_000.0)
                 val_proj = a.get('valeur_projetee', val_actuelle + 50_000)
                 is_prov_defaut = a.get('is_a_provisionner', False)
+                regime_defaut = a.get('regime_fiscal', 'droit_commun')
+                quote_part_defaut = a.get('quote_part_imposable', 0.12) * 100
+                type_actif_defaut = a.get('type', 'direct')
+                simulation_id_defaut = a.get('simulation_id')
+                devise_actif_defaut = a.get('devise', DEVISE_FONDS)
             else:
                 nom_defaut = f"Actif {i+1}"
                 pct_defaut = 100.0
                 val_actuelle = 1_000_000.0
                 val_proj = 1_050_000.0
                 is_prov_defaut = False
+                regime_defaut = 'droit_commun'
+                quote_part_defaut = 12.0
+                type_actif_defaut = 'direct'
+                simulation_id_defaut = None
+                devise_actif_defaut = DEVISE_FONDS
             
             col1, col2 = st.columns([2, 1])
             with col1:
-                nom_actif = st.text_input(f"Nom de l'Actif", nom_defaut, key=f"actif_nom_{i}")
+                col_nom, col_type = st.columns([2, 1])
+                with col_nom:
+                    nom_actif = st.text_input(f"Nom de l'Actif", nom_defaut, key=f"actif_nom_{i}")
+                with col_type:
+                    type_actif = st.selectbox(
+                        "Type d'actif", options=list(TYPES_ACTIFS),
+                        index=list(TYPES_ACTIFS).index(type_actif_defaut) if type_actif_defaut in TYPES_ACTIFS else 0,
+                        format_func=TYPES_ACTIFS.get, key=f"actif_type_{i}"
+                    )
                 
                 col_pct, col_is = st.columns([2, 1])
                 with col_pct:
@@ -592,38 +1469,199 @@ with tab1:
                 with col_is:
                     # Option pour provisionner l'IS
                     is_a_provisionner = st.checkbox(f"IS à provisionner", value=is_prov_defaut, key=f"actif_is_{i}")
+                
+                quote_part_imposable = quote_part_defaut
+                if is_a_provisionner:
+                    col_regime, col_quote_part = st.columns([2, 1])
+                    with col_regime:
+                        regime_fiscal = st.selectbox(
+                            "Régime fiscal", options=list(REGIMES_FISCAUX),
+                            index=list(REGIMES_FISCAUX).index(regime_defaut) if regime_defaut in REGIMES_FISCAUX else 0,
+                            format_func=REGIMES_FISCAUX.get, key=f"actif_regime_{i}"
+                        )
+                    with col_quote_part:
+                        if regime_fiscal == 'participation':
+                            quote_part_text = st.text_input("Quote-part imposable (%)", value=f"{quote_part_defaut:.2f}".replace(".", ","),
+                                                            key=f"actif_qp_{i}")
+                            try:
+                                quote_part_imposable = float(quote_part_text.replace(",", "."))
+                            except ValueError:
+                                st.warning(f"Valeur non numérique pour la quote-part, utilisation de {quote_part_defaut}%")
+                else:
+                    regime_fiscal = regime_defaut
             
             with col2:
-                valeur_actuelle = champ_numerique(f"Valeur actuelle (€)", val_actuelle, st)
-                valeur_projetee = champ_numerique(f"Valeur projetée (€)", val_proj, st)
-            
-            # Calcul de la variation avec prise en compte de l'IS si nécessaire
-            variation_brute = (valeur_projetee - valeur_actuelle) * (pct_detention / 100)
-            
-            # Appliquer la règle de l'IS (75% de l'impact en cas de plus-value)
-            if is_a_provisionner and variation_brute > 0:
-                variation = variation_brute * 0.75  # Réduction de 25% pour l'IS
-            else:
-                variation = variation_brute  # Pas de modification en cas de moins-value ou si IS non provisionné
+                if type_actif == 'fonds':
+                    # La valeur suit la projection de la simulation détenue
+                    simulation_id = choisir_simulation("Simulation détenue", f"actif_sous_fonds_{i}",
+                                                       simulation_id_defaut)
+                    if simulation_id is None:
+                        st.warning("Aucune simulation sauvegardée à détenir")
+                    valeur_actuelle, valeur_projetee = val_actuelle, val_proj
+                    devise_actif = DEVISE_FONDS
+                else:
+                    simulation_id = None
+                    devise_actif = choisir_devise("Devise de l'actif", devise_actif_defaut, f"actif_devise_{i}")
+                    valeur_actuelle = champ_numerique(f"Valeur actuelle ({symbole_devise(devise_actif)})", val_actuelle, st)
+                    valeur_projetee = champ_numerique(f"Valeur projetée ({symbole_devise(devise_actif)})", val_proj, st)
             
-            col_var1, col_var2 = st.columns(2)
-            with col_var1:
-                st.metric("Variation brute", format_fr_euro(variation_brute), delta=None)
-            with col_var2:
-                st.metric("Variation nette d'IS", format_fr_euro(variation), 
-                         delta=f"-{format_fr_euro(variation_brute - variation)}" if variation != variation_brute else None)
+            # Variations affichées une fois l'IS calculé sur l'ensemble des actifs
+            emplacements_variations.append(st.columns(2))
             
-            actifs.append({
+            actif = {
                 "nom": nom_actif,
                 "pct_detention": pct_detention / 100,
                 "valeur_actuelle": valeur_actuelle,
                 "valeur_projetee": valeur_projetee,
-                "variation": variation,
                 "is_a_provisionner": is_a_provisionner,
-                "variation_brute": variation_brute
-            })
+                "regime_fiscal": regime_fiscal,
+                "quote_part_imposable": quote_part_imposable / 100
+            }
+            if type_actif == 'fonds':
+                actif.update({"type": "fonds", "simulation_id": simulation_id})
+            elif devise_actif != DEVISE_FONDS:
+                actif["devise"] = devise_actif
+            actifs.append(actif)
             
             st.markdown("---")
+        
+    # Chocs de change du scénario, sur les devises utilisées par les actifs et les impacts
+    devises_scenario = devises_utilisees({"actifs": actifs, "impacts": impacts, "impacts_multidates": impacts_multidates})
+    chocs_fx = {}
+    if devises_scenario:
+        with st.expander("Chocs de change du scénario", expanded=False):
+            st.caption("Variation relative appliquée aux cours projetés de la courbe (ex: -10 pour une baisse de 10 %)")
+            colonnes_chocs = st.columns(len(devises_scenario))
+            for colonne_choc, devise in zip(colonnes_chocs, devises_scenario):
+                with colonne_choc:
+                    choc_defaut = float((params.get('chocs_fx') or {}).get(devise, 0.0)) * 100
+                    choc_text = st.text_input(f"Choc {devise} (%)", value=f"{choc_defaut:.2f}".replace(".", ","),
+                                              key=f"choc_fx_{devise}")
+                    try:
+                        choc = float(choc_text.replace(" ", "").replace(",", ".")) / 100
+                    except ValueError:
+                        st.warning(f"Valeur non numérique pour le choc {devise}, utilisation de {choc_defaut}%")
+                        choc = choc_defaut / 100
+                    if choc:
+                        chocs_fx[devise] = choc
+                    if devise not in courbes_fx:
+                        st.error(f"Aucune courbe de change pour la devise {devise}")
+    
+    # Projection des fonds détenus en transparence, une seule fois par exécution
+    try:
+        cache_sous_fonds = projeter_sous_fonds({"nom_fonds": nom_fonds, "actifs": actifs}, charger_simulation,
+                                               courbes_fx=courbes_fx)
+    except ValueError as e:
+        st.error(str(e))
+        cache_sous_fonds = {}
+    for actif in actifs:
+        if actif.get('simulation_id') in cache_sous_fonds:
+            # Valeurs du sous-fonds (ANR et distributions reçues) conservées pour information
+            anr_sous_fonds, distributions_cumulees = aligner_sous_fonds(cache_sous_fonds[actif['simulation_id']],
+                                                                       dates_semestres[:2])
+            actif["valeur_actuelle"] = float(anr_sous_fonds[0])
+            actif["valeur_projetee"] = float(anr_sous_fonds[-1] + distributions_cumulees[-1] - distributions_cumulees[0])
+    
+    # Calcul de la variation avec prise en compte de l'IS (compensation et report éventuels)
+    try:
+        variations_brutes, variations = variations_s1(actifs, fiscalite, dates_semestres, cache_sous_fonds,
+                                                      courbes_fx, chocs_fx)
+    except ValueError as e:
+        st.error(str(e))
+        variations_brutes = variations = [0.0] * len(actifs)
+    for actif, (col_var1, col_var2), variation_brute, variation in zip(actifs, emplacements_variations,
+                                                                      variations_brutes, variations):
+        actif["variation"] = float(variation)
+        actif["variation_brute"] = float(variation_brute)
+        with col_var1:
+            st.metric("Variation brute", format_fr_euro(variation_brute), delta=None)
+        with col_var2:
+            st.metric("Variation nette d'IS", format_fr_euro(variation), 
+                     delta=f"-{format_fr_euro(variation_brute - variation)}" if variation != variation_brute else None)
+    
+    # Événements sur les parts
+    st.subheader("Événements sur les parts")
+    with st.expander("Gérer les souscriptions, rachats et distributions", expanded=False):
+        evenements_parts = []
+        nb_evenements = st.number_input("Nombre d'événements", min_value=0,
+                                        value=len(params.get('evenements_parts', [])), step=1, key="evt_nb")
+        
+        for i in range(nb_evenements):
+            st.markdown(f"##### Événement {i+1}")
+            
+            if i < len(params.get('evenements_parts', [])):
+                e = params['evenements_parts'][i]
+                type_defaut = e.get('type', 'distribution')
+                parts_defaut = float(e.get('parts', 0.0) or 0.0)
+                prix_defaut = float(e.get('montant_par_part', 0.0) or 0.0)
+                try:
+                    date_index = dates_semestres_str.index(e.get('date'))
+                except ValueError:
+                    date_index = 0
+            else:
+                type_defaut = 'distribution'
+                parts_defaut = 0.0
+                prix_defaut = 0.0
+                date_index = 0
+            
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                date_evenement = st.selectbox("Date", options=dates_semestres_str, index=date_index, key=f"evt_date_{i}")
+            with col2:
+                type_evenement = st.selectbox(
+                    "Type", options=list(TYPES_EVENEMENTS),
+                    index=list(TYPES_EVENEMENTS).index(type_defaut) if type_defaut in TYPES_EVENEMENTS else 0,
+                    format_func=TYPES_EVENEMENTS.get, key=f"evt_type_{i}"
+                )
+            with col3:
+                if type_evenement == 'distribution':
+                    parts_evenement = 0.0
+                    st.caption("Versée sur toutes les parts en circulation")
+                else:
+                    parts_text = st.text_input("Nombre de parts", value=f"{parts_defaut:,.2f}".replace(",", " ").replace(".", ","),
+                                               key=f"evt_parts_{i}")
+                    try:
+                        parts_evenement = float(parts_text.replace(" ", "").replace(",", "."))
+                    except ValueError:
+                        st.warning(f"Valeur non numérique pour le nombre de parts, utilisation de {parts_defaut}")
+                        parts_evenement = parts_defaut
+            with col4:
+                prix_text = st.text_input(
+                    "Montant par part (€)" if type_evenement == 'distribution' else "Prix par part (€, VL si vide)",
+                    value=format_fr_euro(prix_defaut) if prix_defaut else "", key=f"evt_prix_{i}"
+                )
+                try:
+                    prix_text = prix_text.replace(" ", "").replace(",", ".").replace("€", "")
+                    prix_evenement = float(prix_text) if prix_text else 0.0
+                except ValueError:
+                    st.warning(f"Valeur non numérique pour le montant par part, utilisation de {prix_defaut}")
+                    prix_evenement = prix_defaut
+            
+            evenements_parts.append({
+                "date": date_evenement,
+                "type": type_evenement,
+                "parts": parts_evenement,
+                "montant_par_part": prix_evenement
+            })
+    
+    # Paramètres courants issus de la saisie
+    params_courants = {
+        "nom_fonds": nom_fonds,
+        "nom_scenario": nom_scenario,
+        "date_vl_connue": date_vl_connue_str,
+        "date_fin_fonds": date_fin_fonds_str,
+        "anr_derniere_vl": anr_derniere_vl,
+        "nombre_parts": nombre_parts,
+        "impacts": impacts,
+        "impacts_multidates": impacts_multidates,
+        "actifs": actifs,
+        "fiscalite": fiscalite,
+        "arrondi": arrondi,
+        "evenements_parts": evenements_parts,
+        "chocs_fx": chocs_fx,
+        "scenario_parent": scenario_parent,
+        "commentaire_simulation": commentaire_simulation
+    }
     
     # Boutons rapides pour sauvegarder et charger
     col_save1, col_save2 = st.columns(2)
@@ -633,174 +1671,105 @@ with tab1:
             date_formatee = datetime.now().strftime("%d/%m/%Y")
             # Commentaire
             commentaire = f"{nom_scenario} - {date_formatee}"
-            # Préparer les données à sauvegarder
-            current_params = {
-                "nom_fonds": nom_fonds,
-                "nom_scenario": nom_scenario,
-                "date_vl_connue": date_vl_connue_str,
-                "date_fin_fonds": date_fin_fonds_str,
-                "anr_derniere_vl": anr_derniere_vl,
-                "nombre_parts": nombre_parts,
-                "impacts": impacts,
-                "impacts_multidates": impacts_multidates,
-                "actifs": actifs,
-                "commentaire_simulation": commentaire_simulation
-            }
             # Sauvegarder
-            simulation_id = sauvegarder_simulation(current_params, commentaire)
+            simulation_id, doublon = sauvegarder_simulation(params_courants, commentaire)
             if simulation_id:
+                brouillon_sauvegarde(params_courants)
+            if simulation_id and doublon:
+                st.info(f"Simulation '{nom_scenario}' identique à la dernière version sauvegardée : aucune copie créée")
+            elif simulation_id:
                 st.success(f"Simulation '{nom_scenario}' sauvegardée avec succès")
             
     with col_save2:
         if st.button("🔄 ACTUALISER", key="refresh_calc", help="Recalculer la projection"):
-            st.session_state.params = {
-                "nom_fonds": nom_fonds,
-                "nom_scenario": nom_scenario,
-                "date_vl_connue": date_vl_connue_str,
-                "date_fin_fonds": date_fin_fonds_str,
-                "anr_derniere_vl": anr_derniere_vl,
-                "nombre_parts": nombre_parts,
-                "impacts": impacts,
-                "impacts_multidates": impacts_multidates,
-                "actifs": actifs,
-                "commentaire_simulation": commentaire_simulation
-            }
+            st.session_state.params = dict(params_courants)
             st.rerun()
             
     try:
         # === CALCUL PROJECTION DÉTAILLÉE ===
-        vl_semestres = []
-        anr_courant = anr_derniere_vl
-        projection_rows = []
-        
-        for i, date in enumerate(dates_semestres):
-            row = {"Date": date.strftime('%d/%m/%Y')}
-            date_str = date.strftime('%d/%m/%Y')
-        
-            # Variation par actif (S+1 uniquement)
-            total_var_actifs = 0
-            for a in actifs:
-                var = a.get('variation', 0) if i == 1 else 0
-                
-                # Si IS à provisionner et il s'agit d'une plus-value, afficher uniquement le montant net
-                if i == 1 and a.get('is_a_provisionner', False) and a.get('variation_brute', 0) > 0:
-                    # Afficher seulement le montant net, sans texte supplémentaire
-                    row[f"Actif - {a.get('nom', 'Sans nom')}"] = format_fr_euro(var)
-                else:
-                    row[f"Actif - {a.get('nom', 'Sans nom')}"] = format_fr_euro(var)
-                    
-                total_var_actifs += var
-        
-            # Impacts récurrents
-            total_impacts_recurrents = 0
-            for libelle, montant in impacts:
-                if i > 0:  # Appliquer les impacts récurrents à partir de S+1
-                    row[f"Impact récurrent - {libelle}"] = format_fr_euro(montant)
-                    total_impacts_recurrents += montant
-                else:
-                    row[f"Impact récurrent - {libelle}"] = format_fr_euro(0)
-        
-            # Impacts multidates pour cette date spécifique
-            total_impacts_multidates = 0
-            for impact in impacts_multidates:
-                libelle = impact.get('libelle', 'Sans nom')
-                # Initialiser la valeur à 0 par défaut
-                impact_valeur = 0
-                
-                # Parcourir toutes les occurrences de cet impact
-                for occurrence in impact.get('montants', []):
-                    if occurrence.get('date') == date_str:
-                        impact_valeur += occurrence.get('montant', 0)
-                
-                # Ajouter au total
-                total_impacts_multidates += impact_valeur
-                
-                # Afficher dans le tableau
-                row[f"Impact multidate - {libelle}"] = format_fr_euro(impact_valeur)
-        
-            if i > 0:
-                anr_courant += total_var_actifs + total_impacts_recurrents
-            # Appliquer les impacts multidates
-            anr_courant += total_impacts_multidates
-        
-            vl = anr_courant / nombre_parts if nombre_parts else 0
-            # Arrondir à deux décimales
-            vl = round(vl, 2)
-            vl_semestres.append(vl)
-            row["VL prévisionnelle (€)"] = format_fr_euro(vl)
-            row["ANR (€)"] = format_fr_euro(anr_courant)  # Ajout de l'ANR au tableau
+        # Reprise de la projection précédente jusqu'à la première période modifiée depuis l'exécution précédente
+        precedente = st.session_state.get('projection_precedente')
+        reprise = None
+        if precedente is not None and precedente['dates'] == dates_semestres and precedente['courbes_fx'] == courbes_fx:
+            reprise = (precedente['resultat'],
+                       premiere_periode_modifiee(precedente['params'], params_courants, dates_semestres))
+        resultat = calculer_projection(params_courants, dates_semestres, cache_sous_fonds, courbes_fx, reprise)
+        st.session_state.projection_precedente = {
+            "params": copy.deepcopy(params_courants),
+            "dates": dates_semestres,
+            "courbes_fx": courbes_fx,
+            "resultat": resultat
+        }
+        vl_semestres = [float(vl) for vl in resultat['vl']]
         
-            projection_rows.append(row)
+        # Tableau numérique indexé par date, mis en forme uniquement à l'affichage
+        colonnes = {}
+        # Variation par actif (S+1 uniquement), nette d'IS
+        for nom_actif, serie in resultat['actifs']:
+            colonnes[f"Actif - {nom_actif}"] = serie
+        # Impacts récurrents
+        for libelle, serie in resultat['impacts']:
+            colonnes[f"Impact récurrent - {libelle}"] = serie
+        # Impacts multidates
+        for libelle, serie in resultat['impacts_multidates']:
+            colonnes[f"Impact multidate - {libelle}"] = serie
+        colonnes["VL prévisionnelle (€)"] = resultat['vl']
+        colonnes["ANR (€)"] = resultat['anr']
+        # Parts et montants versés, uniquement si des événements sont saisis
+        if evenements_parts:
+            colonnes["Nombre de parts"] = resultat['parts']
+            colonnes["Distributions (€)"] = resultat['distributions']
+            colonnes["Distribué cumulé par part (€)"] = resultat['distribue_par_part']
+            colonnes["Valeur totale par part (€)"] = resultat['valeur_totale_par_part']
+        projection = pd.DataFrame(colonnes, index=pd.DatetimeIndex(dates_semestres, name="Date"), dtype="float64")
         
         # === AFFICHAGE TABLEAU ===
         st.subheader("VL prévisionnelle")
-        projection = pd.DataFrame(projection_rows)
-        st.dataframe(projection, use_container_width=True)
-        
-        # === GRAPHIQUE BLEU STYLÉ ===
-        st.subheader("Graphique d'évolution de la VL")
-        
-        couleur_bleue = "#0000DC"
-        
-        fig, ax = plt.subplots(figsize=(10, 5))
+        st.dataframe(style_fr(projection, {"Nombre de parts": format_fr_nombre}), use_container_width=True)
         
-        # Courbe
-        ax.plot(
-            dates_semestres,
-            vl_semestres,
-            linewidth=2.5,
-            marker='o',
-            markersize=7,
-            color=couleur_bleue,
-            markerfacecolor=couleur_bleue,  # Points remplis de couleur bleue
-            markeredgewidth=1,
-            markeredgecolor=couleur_bleue
-        )
-        
-        # Annotations de chaque point
-        for i, txt in enumerate(vl_semestres):
-            # S'assurer que chaque valeur est arrondie à 2 décimales
-            txt_arrondi = round(txt, 2)
-            ax.annotate(
-                format_fr_euro(txt_arrondi),
-                (dates_semestres[i], vl_semestres[i]),
-                textcoords="offset points",
-                xytext=(0, 10),
-                ha='center',
-                fontsize=9,
-                color='white',
-                bbox=dict(boxstyle="round,pad=0.3", fc=couleur_bleue, ec=couleur_bleue, alpha=0.9)
-            )
+        # === SENSIBILITÉ AU CHANGE ===
+        if devises_scenario and not set(devises_scenario) - set(courbes_fx):
+            st.subheader("Sensibilité au change")
+            devise_sensibilite = st.selectbox("Devise choquée", options=devises_scenario, key="sensi_fx_devise")
+            sensibilite = sensibilite_fx(params_courants, devise_sensibilite, [-0.2, -0.1, -0.05, 0.0, 0.05, 0.1, 0.2],
+                                         dates_semestres, cache_sous_fonds, courbes_fx)
+            vl_centrale = float(sensibilite.loc[sensibilite['choc'] == 0.0, 'vl_finale'].iloc[0])
+            st.dataframe(style_fr(pd.DataFrame({
+                "Choc sur la courbe (%)": sensibilite['choc'] * 100,
+                "VL finale (€)": sensibilite['vl_finale'],
+                "Écart de VL (€)": sensibilite['vl_finale'] - vl_centrale,
+                "ANR final (€)": sensibilite['anr_final']
+            }), {"Choc sur la courbe (%)": "{:+.0f} %"}), hide_index=True, use_container_width=True)
         
-        # Titres et axes
-        ax.set_title(f"Atterrissage VL - {nom_fonds}", fontsize=16, fontweight='bold', color=couleur_bleue, pad=20)
-        ax.set_ylabel("VL (€)", fontsize=12, color=couleur_bleue)
+        # === GRAPHIQUE INTERACTIF ===
+        st.subheader("Graphique d'évolution de la VL")
         
-        # Ticks
-        ax.set_xticks(dates_semestres)
-        ax.set_xticklabels(
-            [d.strftime('%b-%y').capitalize() for d in dates_semestres],
-            rotation=45,
-            ha='right',
-            fontsize=10,
-            color=couleur_bleue
-        )
-        ax.tick_params(axis='y', labelcolor=couleur_bleue)
+        couleur_bleue = COULEUR_BLEUE
         
-        ax.yaxis.set_major_formatter(
-            ticker.FuncFormatter(lambda x, _: f"{round(x, 2):,.2f} €".replace(",", " ").replace(".", ","))
+        # Autres scénarios sauvegardés du fonds, superposables au scénario en cours
+        versions_fonds = {nom: sim for (fonds_sim, nom), sim in catalogue()['versions'].items()
+                          if fonds_sim == nettoyer_nom_fonds(nom_fonds) and nom != nom_scenario}
+        scenarios_superposes = st.multiselect("Superposer des scénarios sauvegardés", options=sorted(versions_fonds),
+                                              format_func=lambda nom: f"{nom} — {libelle_resume(versions_fonds[nom]['resume'])}",
+                                              key="graphique_scenarios")
+        series_vl = [pd.DataFrame({"Date": dates_semestres, "Scénario": nom_scenario, "VL": vl_semestres})]
+        for nom_superpose in scenarios_superposes:
+            params_superpose = charger_simulation(versions_fonds[nom_superpose]['id'])
+            if params_superpose is None:
+                continue
+            try:
+                resultat_superpose = projeter_simulation(params_superpose)
+            except ValueError as e:
+                st.warning(f"Projection impossible pour le scénario {nom_superpose}: {str(e)}")
+                continue
+            series_vl.append(pd.DataFrame({"Date": resultat_superpose['dates'], "Scénario": nom_superpose,
+                                           "VL": resultat_superpose['vl']}))
+        st.altair_chart(
+            graphique_series(pd.concat(series_vl, ignore_index=True), "Date", "VL", "Scénario",
+                             f"Atterrissage VL - {nom_fonds}", "VL (€)"),
+            use_container_width=True
         )
         
-        # Fond
-        fig.patch.set_facecolor('white')
-        ax.set_facecolor('white')
-        
-        # Supprimer les contours inutiles
-        ax.spines['right'].set_visible(False)
-        ax.spines['top'].set_visible(False)
-        
-        st.pyplot(fig)
-        
         # === EXPORT EXCEL AVEC GRAPHIQUE ===
         try:
             buffer = io.BytesIO()
@@ -832,116 +1801,29 @@ with tab1:
                 col_offset = 1  # Décalage d'une colonne
                 
                 # Appliquer le format d'en-tête (avec décalage)
+                worksheet.write(row_offset, col_offset, projection.index.name, header_format)
                 for col_num, value in enumerate(projection.columns.values):
-                    worksheet.write(row_offset, col_num + col_offset, value, header_format)
+                    worksheet.write(row_offset, col_num + col_offset + 1, value, header_format)
                 
                 # Enlever le quadrillage
                 worksheet.hide_gridlines(2)  # 2 = enlever complètement le quadrillage
                 
-                # Créer des formats pour les nombres et montants
-                number_format = workbook.add_format({
-                    'align': 'right',
-                    'num_format': '#,##0.00',  # Format standard pour les nombres avec décimales
-                })
-                
-                # Format pour les nombres négatifs en rouge
-                negative_number_format = workbook.add_format({
-                    'align': 'right',
-                    'num_format': '#,##0.00',  # Format standard pour les nombres avec décimales
-                    'font_color': 'red',
-                })
+                # Formats des nombres : deux décimales, montants en euros, valeurs négatives en rouge
+                number_format = workbook.add_format({'align': 'right', 'num_format': '#,##0.00;[Red]-#,##0.00'})
+                money_format = workbook.add_format({'align': 'right', 'num_format': '#,##0.00 €;[Red]-#,##0.00 €'})
+                date_format = workbook.add_format({'align': 'right', 'num_format': 'dd/mm/yyyy'})
                 
-                # Créer un format pour les cellules monétaires
-                money_format = workbook.add_format({
-                    'align': 'right',
-                    'num_format': '#,##0.00 €',  # Format monétaire sans zéros superflus
-                })
-                
-                # Format pour les montants négatifs en rouge
-                negative_money_format = workbook.add_format({
-                    'align': 'right',
-                    'num_format': '#,##0.00 €',  # Format monétaire sans zéros superflus
-                    'font_color': 'red',
-                })
+                # Colonne des dates
+                worksheet.set_column(col_offset, col_offset, 12)
+                for row_num, date in enumerate(projection.index):
+                    worksheet.write_datetime(row_num + row_offset + 1, col_offset, date.to_pydatetime(), date_format)
                 
-                # Mettre en forme les colonnes monétaires et ajuster les largeurs (avec décalage)
+                # Colonnes numériques écrites telles quelles, avec leur format d'affichage
                 for idx, col in enumerate(projection.columns):
-                    # Calculer la largeur optimale (plus précise)
-                    col_values = projection[col].astype(str)
-                    max_len = max(
-                        max([len(str(s)) for s in col_values]),
-                        len(col)
-                    ) + 3  # Marge supplémentaire
-                    
-                    # Limiter la largeur maximum
-                    max_len = min(max_len, 40)
-                    
-                    # Appliquer la largeur (avec décalage)
-                    worksheet.set_column(idx + col_offset, idx + col_offset, max_len)
-                    
-                    # Appliquer le format monétaire si la colonne contient "€"
-                    if "€" in col or any(s in col for s in ["Impact", "Actif"]):
-                        # Écrire comme nombres réels avec format monétaire
-                        for row_num in range(len(projection)):
-                            cell_value = projection.iloc[row_num, idx]
-                            
-                            # Extraction de la valeur numérique avec gestion d'erreurs
-                            try:
-                                if isinstance(cell_value, str):
-                                    if "€" in cell_value:
-                                        # Format standard avec euro
-                                        numeric_value = float(cell_value.replace(" ", "").replace("€", "").replace(",", "."))
-                                    else:
-                                        # Autre texte, essayer de convertir directement
-                                        numeric_value = float(cell_value.replace(",", "."))
-                                elif isinstance(cell_value, (int, float)):
-                                    # Déjà un nombre
-                                    numeric_value = float(cell_value)
-                                else:
-                                    # Si c'est un autre type (None, etc.)
-                                    numeric_value = 0
-                            except Exception:
-                                # En cas d'erreur, mettre 0
-                                numeric_value = 0
-                            
-                            # Appliquer le format approprié selon si le nombre est négatif ou positif (avec décalage)
-                            if numeric_value < 0:
-                                worksheet.write_number(row_num + row_offset + 1, idx + col_offset, numeric_value, negative_money_format)
-                            else:
-                                worksheet.write_number(row_num + row_offset + 1, idx + col_offset, numeric_value, money_format)
-                    # Format spécial pour les colonnes VL - nombre à deux décimales
-                    elif "VL" in col:
-                        for row_num in range(len(projection)):
-                            cell_value = projection.iloc[row_num, idx]
-                            
-                            # Extraction de la valeur numérique avec gestion d'erreurs
-                            try:
-                                if isinstance(cell_value, str):
-                                    if "€" in cell_value:
-                                        # Format standard avec euro
-                                        numeric_value = float(cell_value.replace(" ", "").replace("€", "").replace(",", "."))
-                                    else:
-                                        # Autre texte, essayer de convertir directement
-                                        numeric_value = float(cell_value.replace(",", "."))
-                                elif isinstance(cell_value, (int, float)):
-                                    # Déjà un nombre
-                                    numeric_value = float(cell_value)
-                                else:
-                                    # Si c'est un autre type (None, etc.)
-                                    numeric_value = 0
-                            except Exception:
-                                # En cas d'erreur, mettre 0
-                                numeric_value = 0
-                            
-                            # Format nombre à deux décimales pour VL
-                            if numeric_value < 0:
-                                worksheet.write_number(row_num + row_offset + 1, idx + col_offset, numeric_value, negative_number_format)
-                            else:
-                                worksheet.write_number(row_num + row_offset + 1, idx + col_offset, numeric_value, number_format)
-                    else:
-                        # Pour les autres colonnes (non monétaires) - avec décalage
-                        for row_num in range(len(projection)):
-                            worksheet.write(row_num + row_offset + 1, idx + col_offset, projection.iloc[row_num, idx])
+                    colonne = idx + col_offset + 1
+                    format_colonne = money_format if "€" in col or col.startswith(("Impact", "Actif")) else number_format
+                    worksheet.set_column(colonne, colonne, min(max(len(col), 16) + 3, 40))
+                    worksheet.write_column(row_offset + 1, colonne, projection[col].tolist(), format_colonne)
                 
                 # Aussi ajuster la largeur de la première colonne vide
                 worksheet.set_column(0, 0, 3)  # Largeur de 3 pour la colonne vide
@@ -1077,18 +1959,7 @@ with tab1:
                 
             with export_col2:
                 # Export JSON
-                export_data = {
-                    "nom_fonds": nom_fonds,
-                    "nom_scenario": nom_scenario,
-                    "date_vl_connue": date_vl_connue_str,
-                    "date_fin_fonds": date_fin_fonds_str,
-                    "anr_derniere_vl": anr_derniere_vl,
-                    "nombre_parts": nombre_parts,
-                    "impacts": impacts,
-                    "impacts_multidates": impacts_multidates,
-                    "actifs": actifs,
-                    "commentaire_simulation": commentaire_simulation
-                }
+                export_data = params_courants
                 date_aujourd_hui = datetime.now().strftime("%Y%m%d")
                 nom_fichier_json = f"{date_aujourd_hui} - {nom_fonds} - {nom_scenario}.json"
                 json_export = json.dumps(export_data, indent=2).encode('utf-8')
@@ -1105,143 +1976,32 @@ with tab1:
                 # Créer un buffer pour stocker la présentation
                 if st.button("📊 Exporter en PowerPoint"):
                     try:
-                        # Enregistrer temporairement le graphique
-                        temp_img_path = 'data/temp_chart.png'
-                        fig.savefig(temp_img_path, dpi=300, bbox_inches='tight')
-                        
-                        # Créer une présentation PowerPoint simple et propre
-                        prs = Presentation()
-                        # Utiliser un layout avec un titre et du contenu
-                        slide_layout = prs.slide_layouts[1]  # Layout avec titre et contenu
-                        slide = prs.slides.add_slide(slide_layout)
-                        
-                        # Définir la couleur bleue pour les éléments
-                        couleur_bleue_rgb = RGBColor.from_string(couleur_bleue.lstrip('#'))
-                        
-                        # Configurer le titre de la diapositive
-                        title = slide.shapes.title
-                        title.text = f"Atterrissage VL - {nom_fonds}"
-                        title.text_frame.paragraphs[0].font.color.rgb = couleur_bleue_rgb
-                        title.text_frame.paragraphs[0].font.bold = True
-                        
-                        # Zone de contenu principale
-                        content = slide.placeholders[1]
-                        
-                        # Ajouter l'image du graphique
-                        pic_left = Inches(1)
-                        pic_top = Inches(1.5)
-                        pic_width = Inches(8)
-                        slide.shapes.add_picture(temp_img_path, pic_left, pic_top, width=pic_width)
-                        
-                        # Ajouter un rectangle pour les informations clés
-                        info_left = Inches(1)
-                        info_top = Inches(5.5)
-                        info_width = Inches(8)
-                        info_height = Inches(1)
-                        
-                        info_box = slide.shapes.add_shape(
-                            1,  # Rectangle
-                            info_left, info_top, info_width, info_height
-                        )
-                        info_box.fill.solid()
-                        info_box.fill.fore_color.rgb = RGBColor(240, 240, 240)  # Gris très clair
-                        info_box.line.color.rgb = couleur_bleue_rgb
-                        
-                        # Ajouter le texte des informations clés
-                        info_text = slide.shapes.add_textbox(
-                            info_left + Inches(0.2), 
-                            info_top + Inches(0.1),
-                            info_width - Inches(0.4),
-                            info_height - Inches(0.2)
-                        )
-                        
-                        info_frame = info_text.text_frame
-                        info_frame.word_wrap = True
-                        
-                        # Créer un paragraphe pour chaque information clé
-                        p1 = info_frame.add_paragraph()
-                        vl_initiale = anr_derniere_vl/nombre_parts if nombre_parts else 0
-                        p1.text = f"VL {date_vl_connue_str}: {format_fr_euro(vl_initiale)}"
-                        p1.font.bold = True
-                        p1.font.color.rgb = couleur_bleue_rgb
-                        
-                        p2 = info_frame.add_paragraph()
-                        vl_finale = vl_semestres[-1] if vl_semestres else 0
-                        p2.text = f"VL {date_fin_fonds_str}: {format_fr_euro(vl_finale)}"
-                        p2.font.bold = True
-                        p2.font.color.rgb = couleur_bleue_rgb
-                        
-                        # Calcul de la variation
-                        variation_pct = ((vl_finale / vl_initiale) - 1) * 100 if vl_initiale != 0 else 0
-                        
-                        p3 = info_frame.add_paragraph()
-                        
-                        # Formater le texte selon que la variation est positive ou négative
-                        if variation_pct > 0:
-                            p3.text = f"Variation: +{variation_pct:.2f}%"
-                            p3.font.color.rgb = RGBColor(0, 128, 0)  # Vert
-                        elif variation_pct < 0:
-                            p3.text = f"Variation: {variation_pct:.2f}%"
-                            p3.font.color.rgb = RGBColor(192, 0, 0)  # Rouge
-                        else:
-                            p3.text = f"Variation: 0.00%"
-                            p3.font.color.rgb = couleur_bleue_rgb
-                        
-                        p3.font.bold = True
-                        
-                        # Ajouter un pied de page avec la date
-                        footer = slide.shapes.add_textbox(
-                            Inches(0.5), Inches(6.8),
-                            Inches(9), Inches(0.3)
-                        )
-                        
-                        footer_frame = footer.text_frame
-                        footer_p = footer_frame.add_paragraph()
-                        footer_p.text = f"Document généré le {datetime.now().strftime('%d/%m/%Y')} - {nom_scenario}"
-                        footer_p.font.italic = True
-                        footer_p.font.size = Pt(9)
-                        footer_p.alignment = PP_ALIGN.RIGHT
-                        
-                        # Enregistrer dans un buffer
-                        pptx_buffer = io.BytesIO()
-                        prs.save(pptx_buffer)
-                        pptx_buffer.seek(0)
-                        
-                        # Générer un nom de fichier
-                        nom_fichier_pptx = f"{date_aujourd_hui} - Atterrissage VL - {nom_fonds}.pptx"
-                        
-                        # Offrir le téléchargement
-                        st.download_button(
-                            label="📥 Télécharger la présentation PowerPoint",
-                            data=pptx_buffer,
-                            file_name=nom_fichier_pptx,
-                            mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
-                        )
-                        
-                        # Supprimer le fichier temporaire
-                        if os.path.exists(temp_img_path):
-                            os.remove(temp_img_path)
-                            
+                        tache_id = soumettre_tache("presentation", {
+                            "nom_fonds": nom_fonds,
+                            "nom_scenario": nom_scenario,
+                            "dates": [date.strftime("%Y-%m-%d") for date in dates_semestres],
+                            "vl": vl_semestres,
+                            "vl_initiale": anr_derniere_vl / nombre_parts if nombre_parts else 0,
+                            "date_debut": date_vl_connue_str,
+                            "date_fin": date_fin_fonds_str
+                        }, f"Présentation PowerPoint - {nom_fonds} - {nom_scenario}")
+                        st.session_state.setdefault('taches_presentation', []).append(tache_id)
                     except Exception as e:
                         st.error(f"Erreur lors de la génération de la présentation PowerPoint: {str(e)}")
-                        import traceback
-                        st.error(traceback.format_exc())
+                if st.session_state.get('taches_presentation'):
+                    afficher_taches(st.session_state.taches_presentation, cle="taches_presentation")
         except Exception as e:
             st.error(f"Erreur lors de la génération de l'export: {str(e)}")
         
         # Sauvegarder dans la session
-        st.session_state.params = {
-            "nom_fonds": nom_fonds,
-            "nom_scenario": nom_scenario,
-            "date_vl_connue": date_vl_connue_str,
-            "date_fin_fonds": date_fin_fonds_str,
-            "anr_derniere_vl": anr_derniere_vl,
-            "nombre_parts": nombre_parts,
-            "impacts": impacts,
-            "impacts_multidates": impacts_multidates,
-            "actifs": actifs,
-            "commentaire_simulation": commentaire_simulation
-        }
+        st.session_state.params = dict(params_courants)
+        st.session_state.params_edites = st.session_state.params
+        
+        # Brouillon écrit en arrière-plan après quelques secondes sans modification
+        if params_remplaces:
+            st.session_state.params_reference = empreinte_brouillon(params_courants)
+        elif empreinte_brouillon(params_courants) != st.session_state.get('params_reference'):
+            planifier_brouillon(st.session_state.brouillon_id, params_courants)
     
     except Exception as e:
         st.error(f"Erreur lors du calcul de la projection: {str(e)}")
@@ -1257,17 +2017,32 @@ with tab2:
     with col1:
         st.subheader("Importer / Exporter")
         
-        # Import JSON
-        params_json = st.file_uploader("Importer des paramètres JSON", type="json")
-        if params_json is not None:
+        # Import JSON : un ou plusieurs fichiers, ou des archives zip, validés avant tout usage
+        fichiers_importes = st.file_uploader("Importer des paramètres JSON", type=["json", "zip"],
+                                             accept_multiple_files=True, key="import_fichiers")
+        if fichiers_importes:
             try:
-                imported_params = json.load(params_json)
-                st.session_state.params.update(imported_params)
-                st.success("Paramètres importés avec succès")
-                if st.button("⚡ Appliquer les paramètres importés", type="primary"):
-                    st.rerun()
+                simulations_importees, erreurs_import = lire_fichiers_importes(
+                    (fichier.name, fichier.getvalue()) for fichier in fichiers_importes
+                )
             except Exception as e:
-                st.error(f"Erreur lors de l'importation du fichier JSON: {str(e)}")
+                simulations_importees, erreurs_import = [], [f"Erreur lors de la lecture des fichiers: {str(e)}"]
+            if erreurs_import:
+                st.error(f"{len(erreurs_import)} erreur(s) dans les fichiers importés")
+                st.dataframe(pd.DataFrame({"Erreur": erreurs_import}), hide_index=True, use_container_width=True)
+            if simulations_importees:
+                st.success(f"{len(simulations_importees)} simulation(s) valide(s)")
+                if len(simulations_importees) == 1:
+                    if st.button("⚡ Appliquer les paramètres importés", type="primary", key="import_appliquer"):
+                        st.session_state.params = params_depuis_simulation(simulations_importees[0][1])
+                        st.rerun()
+                if st.button(f"📥 Enregistrer {len(simulations_importees)} simulation(s) dans la base", key="import_enregistrer"):
+                    try:
+                        ids_importes = importer_simulations([simulation for _, simulation in simulations_importees],
+                                                            f"Import du {datetime.now().strftime('%d/%m/%Y')}")
+                        st.success(f"{len(ids_importes)} simulation(s) enregistrée(s)")
+                    except (OSError, ValueError) as e:
+                        st.error(f"Erreur lors de l'enregistrement: {str(e)}")
     
     with col2:
         st.subheader("Sauvegarder en base de données")
@@ -1288,32 +2063,25 @@ with tab2:
                 
                 # Sauvegarder dans la BDD avec le commentaire formaté
                 commentaire = f"{params.get('nom_scenario', 'Base case')} - {date_formatee}"
-                simulation_id = sauvegarder_simulation(params, commentaire)
-                
+                simulation_id, doublon = sauvegarder_simulation(params, commentaire)
                 if simulation_id:
+                    brouillon_sauvegarde(params)
+                
+                if simulation_id and doublon:
+                    st.info(f"Simulation '{params.get('nom_scenario', 'Base case')}' identique à la dernière version sauvegardée : aucune copie créée")
+                elif simulation_id:
                     st.success(f"Nouvelle simulation '{params.get('nom_scenario', 'Base case')}' sauvegardée avec succès")
                     st.rerun()  # Actualiser pour montrer la nouvelle simulation
                 else:
                     st.error("Échec de la sauvegarde, veuillez réessayer")
         else:
             # Option pour mettre à jour une sauvegarde existante
-            simulations = lister_simulations()
+            sim_a_mettre_a_jour = (choisir_simulation("Simulation à mettre à jour", "maj_simulation")
+                                   if catalogue()['simulations'] else None)
             
-            if simulations:
-                # Format d'affichage simplifié pour les simulations existantes
-                options = {}
-                for s in simulations:
-                    # Format simplifié: Nom du fonds - Nom du scénario
-                    display_text = f"{s['nom_fonds']} - {s['nom_scenario']}"
-                    options[display_text] = s['id']
-                    
-                sim_a_mettre_a_jour = st.selectbox(
-                    "Choisir la simulation à mettre à jour",
-                    options=list(options.keys())
-                )
-                
+            if sim_a_mettre_a_jour:
                 if st.button("🔄 Mettre à jour la simulation", type="primary"):
-                    simulation_id = options[sim_a_mettre_a_jour]
+                    simulation_id = sim_a_mettre_a_jour
                     
                     # Préparer les données à sauvegarder
                     params = st.session_state.params
@@ -1324,29 +2092,266 @@ with tab2:
                     # Créer une nouvelle avec les mêmes données
                     date_formatee = datetime.now().strftime("%d/%m/%Y")
                     commentaire = f"{params.get('nom_scenario', 'Base case')} - {date_formatee} (Mise à jour)"
-                    new_id = sauvegarder_simulation(params, commentaire)
+                    new_id, _ = sauvegarder_simulation(params, commentaire)
                     
                     if new_id:
+                        brouillon_sauvegarde(params)
                         st.success(f"Simulation '{params.get('nom_scenario', 'Base case')}' mise à jour avec succès")
                         st.rerun()  # Actualiser pour montrer la mise à jour
                     else:
                         st.error("Échec de la mise à jour, veuillez réessayer")
+            elif catalogue()['simulations']:
+                st.info("Aucune simulation ne correspond à la recherche")
             else:
                 st.info("Aucune simulation existante à mettre à jour")
     
+    # Roll-forward de toutes les simulations sur une nouvelle VL publiée
+    st.subheader("Roll-forward sur une nouvelle VL")
+    with st.expander("Rebaser les simulations sur la VL réelle", expanded=False):
+        col_rf1, col_rf2 = st.columns(2)
+        with col_rf1:
+            date_rf_str = st.text_input("Nouvelle date de VL (jj/mm/aaaa)", key="rf_date")
+        with col_rf2:
+            occurrences_echues = st.radio(
+                "Occurrences multidates échues",
+                ["supprimer", "reporter"],
+                format_func=lambda m: "Supprimer" if m == "supprimer" else "Reporter sur le semestre suivant",
+                key="rf_occurrences"
+            )
+        
+        fonds_rf = catalogue()['fonds']
+        saisie_anr = st.data_editor(
+            pd.DataFrame({"Fonds": fonds_rf, "ANR réel (€)": [None] * len(fonds_rf)}, dtype=object),
+            disabled=["Fonds"],
+            hide_index=True,
+            use_container_width=True,
+            key="rf_anr"
+        )
+        
+        if st.button("⏩ Lancer le roll-forward", key="rf_lancer"):
+            try:
+                nouvelle_date = datetime.strptime(date_rf_str, "%d/%m/%Y")
+                anr_reels = {}
+                for _, ligne_anr in saisie_anr.iterrows():
+                    valeur = ligne_anr["ANR réel (€)"]
+                    if pd.notna(valeur) and str(valeur).strip():
+                        anr_reels[ligne_anr["Fonds"]] = float(str(valeur).replace(" ", "").replace(",", ".").replace("€", ""))
+                if not anr_reels:
+                    st.warning("Renseignez l'ANR réel d'au moins un fonds")
+                else:
+                    st.session_state.rapport_roll_forward = roll_forward_simulations(nouvelle_date, anr_reels, occurrences_echues)
+            except ValueError as e:
+                st.error(f"Erreur de saisie: {str(e)}")
+        
+        rapport = st.session_state.get('rapport_roll_forward')
+        if rapport is not None:
+            if rapport.empty:
+                st.info("Aucune simulation pour les fonds renseignés")
+            else:
+                st.success(f"{(rapport['Statut'] == 'OK').sum()} simulation(s) rebasée(s) sur {len(rapport)}")
+                for _, ligne in rapport[rapport['Messages'] != ""].iterrows():
+                    st.warning(f"{ligne['Fonds']} - {ligne['Scénario']} : {ligne['Messages']}")
+                colonnes_euro = ["ANR prévu (€)", "ANR réel (€)", "Écart (€)", "VL prévue (€)", "VL réelle (€)"]
+                st.dataframe(
+                    rapport.style.format({**{c: format_fr_euro for c in colonnes_euro},
+                                          "Écart (%)": lambda v: f"{v:+.2f} %".replace(".", ",") if pd.notna(v) else ""},
+                                         na_rep=""),
+                    use_container_width=True
+                )
+                st.download_button(
+                    label="📥 Télécharger le rapport d'écarts",
+                    data=rapport.to_csv(index=False, sep=";", decimal=",").encode('utf-8-sig'),
+                    file_name=f"{datetime.now().strftime('%Y%m%d')} - Roll-forward VL.csv",
+                    mime="text/csv"
+                )
+    
+    # Courbes de change locales
+    with st.expander("Courbes de change", expanded=False):
+        st.caption(
+            "Cours en euros pour une unité de devise. La première ligne de chaque devise est le spot ; "
+            "les suivantes donnent un cours projeté ou des points de terme ajoutés au spot. "
+            "Le cours est interpolé entre deux dates et constant au-delà."
+        )
+        courbes_saisies = st.data_editor(
+            courbes_en_tableau(courbes_fx),
+            num_rows="dynamic",
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "Cours (€)": st.column_config.NumberColumn(format="%.6f"),
+                "Points de terme": st.column_config.NumberColumn(format="%.6f")
+            },
+            key="fx_courbes"
+        )
+        if st.button("💾 Enregistrer les courbes", key="fx_enregistrer"):
+            try:
+                sauvegarder_courbes_fx(tableau_en_courbes(courbes_saisies))
+                st.success("Courbes de change enregistrées")
+                st.rerun()
+            except ValueError as e:
+                st.error(f"Courbes invalides: {str(e)}")
+    
+    # Simulations encore au format JSON historique, migrées à chaque lecture
+    nb_historiques = catalogue()['historiques']
+    if nb_historiques:
+        st.info(f"{nb_historiques} simulation(s) au format JSON historique, converties à chaque lecture")
+        if st.button("Convertir au format compact", key="migrer_stockage"):
+            try:
+                st.success(f"{migrer_stockage()} simulation(s) converties")
+            except (OSError, ValueError) as e:
+                st.error(f"Erreur lors de la conversion: {str(e)}")
+    
+    # Sauvegarde complète du stockage et restauration sur un autre poste
+    with st.expander("Sauvegarde et restauration du stockage", expanded=False):
+        col_sauvegarde, col_restauration = st.columns(2)
+        with col_sauvegarde:
+            st.caption("Archive zip de toutes les simulations et de l'index, écrite fichier par fichier.")
+            if st.button("🗄️ Créer une sauvegarde", key="sauvegarde_creer"):
+                os.makedirs(REPERTOIRE_SAUVEGARDES, exist_ok=True)
+                chemin_sauvegarde = os.path.join(
+                    REPERTOIRE_SAUVEGARDES, f"sauvegarde_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+                )
+                try:
+                    rapport = exporter_stockage(chemin_sauvegarde)
+                    st.session_state.sauvegarde = chemin_sauvegarde
+                    st.success(
+                        f"{rapport['simulations']} simulation(s) sauvegardée(s) en {rapport['duree']:.2f} s "
+                        f"({rapport['debit']:.0f} simulations/s, {rapport['octets'] / 1e6:.1f} Mo)"
+                    )
+                    if rapport['illisibles']:
+                        st.warning(
+                            f"{len(rapport['illisibles'])} simulation(s) illisible(s), copiée(s) telle(s) quelle(s) "
+                            "dans le dossier « illisibles » de l'archive et non restaurables : "
+                            + " ; ".join(f"{simulation_id} ({erreur})"
+                                         for simulation_id, erreur in rapport['illisibles'].items())
+                        )
+                except OSError as e:
+                    st.error(f"Erreur lors de la sauvegarde: {str(e)}")
+            chemin_sauvegarde = st.session_state.get('sauvegarde')
+            if chemin_sauvegarde and os.path.exists(chemin_sauvegarde):
+                with open(chemin_sauvegarde, 'rb') as f:
+                    st.download_button(
+                        label="📥 Télécharger la sauvegarde",
+                        data=f,
+                        file_name=os.path.basename(chemin_sauvegarde),
+                        mime="application/zip",
+                        key="sauvegarde_telecharger"
+                    )
+        with col_restauration:
+            archive_restauration = st.file_uploader("Restaurer une sauvegarde", type="zip", key="restauration_fichier")
+            mode_conflit = st.radio(
+                "Simulations déjà présentes",
+                options=list(MODES_CONFLIT),
+                format_func=MODES_CONFLIT.get,
+                key="restauration_conflit"
+            )
+            if archive_restauration is not None and st.button("♻️ Restaurer", key="restauration_lancer"):
+                try:
+                    rapport = restaurer_stockage(archive_restauration, mode_conflit)
+                    st.success(
+                        f"{rapport['ecrites']} simulation(s) restaurée(s) sur {rapport['lues']} "
+                        f"en {rapport['duree']:.2f} s ({rapport['debit']:.0f} simulations/s) — "
+                        f"{rapport['ignorees']} ignorée(s), {rapport['remplacees']} remplacée(s), "
+                        f"{rapport['dupliquees']} dupliquée(s)"
+                    )
+                    if rapport['erreurs']:
+                        st.error(f"{len(rapport['erreurs'])} simulation(s) invalide(s) non restaurée(s)")
+                        st.dataframe(pd.DataFrame({"Erreur": rapport['erreurs']}), hide_index=True,
+                                     use_container_width=True)
+                except (OSError, ValueError, zipfile.BadZipFile) as e:
+                    st.error(f"Erreur lors de la restauration: {str(e)}")
+    
+    # Rapports PDF de la dernière version de chaque scénario, générés en tâche de fond
+    with st.expander("Rapports PDF", expanded=False):
+        fonds_sauvegardes = sorted({nom_fonds_sim for nom_fonds_sim, _ in catalogue()['versions']})
+        fonds_rapport = st.multiselect("Fonds (tous si aucun n'est choisi)", options=fonds_sauvegardes,
+                                       key="rapport_fonds")
+        mode_rapport = st.radio("Documents", options=["Un document par fonds", "Document consolidé"],
+                                horizontal=True, key="rapport_mode")
+        if st.button("📄 Générer les rapports", key="rapport_generer", disabled=not fonds_sauvegardes):
+            soumettre_tache("rapports_pdf", {"fonds": fonds_rapport or None,
+                                             "consolide": mode_rapport == "Document consolidé"},
+                            f"Rapports PDF - {', '.join(fonds_rapport) if fonds_rapport else 'tous les fonds'}")
+            st.info("Rapports en cours de génération : voir les tâches en arrière-plan ci-dessous")
+    
+    # Classeur Excel de plusieurs scénarios, généré en tâche de fond
+    with st.expander("Classeur Excel multi-scénarios", expanded=False):
+        versions_export = {f"{nom_fonds_sim} - {nom_scenario_sim}": sim['id']
+                           for (nom_fonds_sim, nom_scenario_sim), sim in sorted(catalogue()['versions'].items())}
+        scenarios_export = st.multiselect("Scénarios (tous si aucun n'est choisi)", options=list(versions_export),
+                                          key="classeur_scenarios")
+        if st.button("📊 Générer le classeur", key="classeur_generer", disabled=not versions_export):
+            soumettre_tache("classeur_excel",
+                            {"simulation_ids": [versions_export[nom] for nom in (scenarios_export or versions_export)]},
+                            f"Classeur Excel - {len(scenarios_export or versions_export)} scénario(s)")
+            st.info("Classeur en cours de génération : voir les tâches en arrière-plan ci-dessous")
+    
+    # Exports et traitements par lots en cours ou terminés, conservés sur disque
+    with st.expander("Tâches en arrière-plan", expanded=any(tache['etat'] not in ETATS_FINAUX
+                                                             for tache in lister_taches())):
+        afficher_taches()
+    
+    # Écritures des brouillons depuis le démarrage du serveur, toutes sessions confondues
+    with st.expander("Sauvegarde automatique des brouillons", expanded=False):
+        compteurs = compteurs_brouillons()
+        st.caption("Le brouillon de la session est écrit quelques secondes après la dernière modification ; "
+                   "des modifications rapprochées ne donnent lieu qu'à une écriture.")
+        col_demandes, col_ecritures, col_ratio = st.columns(3)
+        col_demandes.metric("Modifications", compteurs['demandes'] - compteurs['inchangees'])
+        col_ecritures.metric("Écritures", compteurs['ecritures'], help=f"{compteurs['octets'] / 1e3:.1f} ko écrits")
+        col_ratio.metric("Écritures par modification",
+                         f"{compteurs['ecritures'] / max(compteurs['demandes'] - compteurs['inchangees'], 1):.2f}")
+        st.caption(f"{compteurs['regroupees']} modification(s) regroupée(s) avant écriture, "
+                   f"{compteurs['en_attente']} brouillon(s) en attente, {compteurs['suppressions']} supprimé(s), "
+                   f"{compteurs['erreurs']} erreur(s) d'écriture")
+    
     # Liste des simulations sauvegardées
     st.subheader("Simulations sauvegardées")
     simulations = lister_simulations()
     
     if simulations:
-        # Pour chaque ligne, ajouter des boutons d'actions
-        for sim in simulations:
+        # Recherche et tri sur l'index ; seule la page courante est affichée
+        col_texte, col_dates, col_tri, col_taille = st.columns([3, 2, 2, 1])
+        with col_texte:
+            recherche = st.text_input("Rechercher", key="navigateur_recherche",
+                                      placeholder="Fonds, scénario, commentaire",
+                                      on_change=premiere_page, args=("navigateur",))
+        with col_dates:
+            dates_recherche = st.date_input("Créées entre", value=(), format="DD/MM/YYYY",
+                                            key="navigateur_dates", on_change=premiere_page, args=("navigateur",))
+        with col_tri:
+            tri = st.selectbox("Trier par", options=list(TRIS_SIMULATIONS), key="navigateur_tri",
+                               on_change=premiere_page, args=("navigateur",))
+        with col_taille:
+            taille_page = st.selectbox("Par page", options=TAILLES_PAGE, key="navigateur_taille",
+                                       on_change=premiere_page, args=("navigateur",))
+        resultats = rechercher_dans_catalogue(recherche, dates_recherche, tri)
+        
+        # Simulations importées, restaurées ou antérieures aux synthèses : calcul en tâche de fond
+        sans_synthese = catalogue()['sans_synthese']
+        if sans_synthese:
+            col_manquantes, col_calcul = st.columns([3, 1])
+            col_manquantes.caption(f"{sans_synthese} simulation(s) sans synthèse (VL finale, variation, aperçu)")
+            if col_calcul.button("Calculer les synthèses", key="syntheses_calculer"):
+                soumettre_tache("syntheses", {}, f"Synthèses - {sans_synthese} simulation(s)")
+                st.info("Synthèses en cours de calcul : voir les tâches en arrière-plan")
+        
+        # Pour chaque ligne de la page, ajouter des boutons d'actions
+        for sim in paginer(resultats, taille_page, "navigateur"):
             with st.container(border=True):
                 col1, col2 = st.columns([3, 1])
                 
                 with col1:
                     st.markdown(f"**{sim['nom_fonds']} - {sim['nom_scenario']}**")
                     st.caption(f"Créé le {sim['date_creation'].split(' ')[0] if ' ' in sim['date_creation'] else sim['date_creation']}")
+                    if sim.get('scenario_parent'):
+                        st.caption(f"↳ Dérivé du scénario {sim['scenario_parent']}")
+                    if sim['commentaire']:
+                        st.caption(sim['commentaire'])
+                    if sim['resume']:
+                        st.caption(f"{libelle_resume(sim['resume'])} — VL minimale "
+                                   f"{format_fr_euro(sim['resume']['vl_min'])} au {sim['resume']['date_vl_min']}  "
+                                   f"`{apercu_texte(sim['resume']['apercu'])}`")
                 
                 with col2:
                     col_load, col_del = st.columns(2)
@@ -1371,6 +2376,124 @@ with tab2:
         st.success("Paramètres réinitialisés aux valeurs par défaut")
         st.rerun()
 
+with tab_consolidation:
+    st.header("Consolidation multi-fonds")
+    st.caption("Une simulation par fonds : la plus récente du scénario choisi, d'après sa date de création.")
+    
+    col_conso1, col_conso2 = st.columns([1, 2])
+    with col_conso1:
+        scenario_consolide = st.text_input("Scénario à consolider", "Base case", key="conso_scenario")
+    with col_conso2:
+        simulations_retenues = {fonds_sim: sim for (fonds_sim, scenario_sim), sim in catalogue()['versions'].items()
+                                if scenario_sim == scenario_consolide}
+        fonds_disponibles = sorted(simulations_retenues)
+        fonds_consolides = st.multiselect("Fonds inclus (tous si vide)", fonds_disponibles, key="conso_fonds")
+    
+    # Synthèses sauvegardées avec les simulations retenues : affichées sans recalculer de projection
+    lignes_syntheses = []
+    for nom_fonds_sim in fonds_disponibles:
+        if fonds_consolides and nom_fonds_sim not in fonds_consolides:
+            continue
+        resume = simulations_retenues[nom_fonds_sim]['resume'] or {}
+        lignes_syntheses.append({
+            "Fonds": nom_fonds_sim,
+            "VL initiale (€)": resume.get('vl_initiale'),
+            "VL finale (€)": resume.get('vl_finale'),
+            "Variation (%)": resume['variation'] * 100 if resume.get('variation') is not None else None,
+            "VL minimale (€)": resume.get('vl_min'),
+            "Date VL minimale": resume.get('date_vl_min', ""),
+            "Évolution": apercu_texte(resume.get('apercu', [])),
+            "Sauvegardée le": simulations_retenues[nom_fonds_sim]['date_creation']
+        })
+    if lignes_syntheses:
+        st.dataframe(style_fr(pd.DataFrame(lignes_syntheses).set_index("Fonds"), {
+            "Variation (%)": lambda v: f"{v:+.1f} %".replace(".", ","),
+            "Date VL minimale": str, "Évolution": str, "Sauvegardée le": str
+        }), use_container_width=True)
+    
+    if st.button("🏦 Calculer la consolidation", key="conso_calcul"):
+        st.session_state.consolidation = consolider_simulations(scenario_consolide, fonds_consolides)
+    
+    consolidation, distributions_consolidees = st.session_state.get('consolidation', (None, None))
+    if consolidation is not None and not consolidation.empty:
+        contributions = consolidation.drop(columns="Total")
+        
+        col_total1, col_total2, col_total3 = st.columns(3)
+        with col_total1:
+            st.metric("Nombre de fonds", len(contributions.columns))
+        with col_total2:
+            st.metric("ANR consolidé final", format_fr_euro(consolidation["Total"].iloc[-1]))
+        with col_total3:
+            st.metric("Distributions cumulées", format_fr_euro(distributions_consolidees["Total"].sum()))
+        
+        # Tableaux des contributions par fonds et du total du groupe
+        for titre, tableau in [("ANR (€)", consolidation), ("Distributions (€)", distributions_consolidees)]:
+            st.markdown(f"##### {titre}")
+            st.dataframe(style_fr(tableau), use_container_width=True)
+        
+        # Graphique empilé des contributions
+        contributions_longues = (contributions.fillna(0).rename_axis("Date").reset_index()
+                                 .melt(id_vars="Date", var_name="Fonds", value_name="ANR"))
+        st.altair_chart(
+            graphique_series(contributions_longues, "Date", "ANR", "Fonds", f"ANR consolidé - {scenario_consolide}",
+                             "ANR (€)", format_y="$,.0f", empile=True),
+            use_container_width=True
+        )
+    elif consolidation is not None:
+        st.info(f"Aucune simulation sauvegardée pour le scénario '{scenario_consolide}'")
+
+with tab_backtesting:
+    st.header("Backtesting prévu / réel")
+    
+    col_bt1, col_bt2 = st.columns([1, 2])
+    with col_bt1:
+        st.subheader("Historique des VL")
+        historique_csv = st.file_uploader(
+            "Importer un historique de VL (CSV)", type="csv", key="bt_import",
+            help="Colonnes attendues : Fonds, Date (jj/mm/aaaa), VL et éventuellement ANR"
+        )
+        if historique_csv is not None and st.button("📥 Intégrer l'historique", key="bt_integrer"):
+            try:
+                nb_lignes = importer_historique_vl(historique_csv)
+                st.success(f"{nb_lignes} ligne(s) d'historique intégrée(s)")
+            except Exception as e:
+                st.error(f"Erreur lors de l'import de l'historique: {str(e)}")
+        
+        historique = charger_historique_vl()
+        st.caption(f"{historique['nom_fonds'].nunique()} fonds, {len(historique)} VL historisées")
+    
+    with col_bt2:
+        if st.button("🎯 Comparer les simulations à l'historique", key="bt_calcul"):
+            st.session_state.backtesting = backtester_simulations(historique)
+        
+        jointure, metriques = st.session_state.get('backtesting', (None, None))
+        if metriques is not None and not metriques.empty:
+            affichage = metriques.rename(columns={
+                "nom_fonds": "Fonds", "nom_scenario": "Scénario", "horizon": "Horizon (semestres)",
+                "observations": "Observations", "biais": "Biais VL (€)", "mae": "Erreur moyenne VL (€)",
+                "mape": "Erreur moyenne (%)", "rmse": "RMSE VL (€)"
+            })
+            st.dataframe(
+                affichage.style.format({
+                    "Biais VL (€)": format_fr_euro, "Erreur moyenne VL (€)": format_fr_euro, "RMSE VL (€)": format_fr_euro,
+                    "Erreur moyenne (%)": lambda v: f"{v:.2f} %".replace(".", ",")
+                }, na_rep=""),
+                hide_index=True,
+                use_container_width=True
+            )
+            
+            # Graphique de précision : erreur moyenne en % selon l'horizon, par scénario
+            precision = (jointure.groupby(["nom_scenario", "horizon"])["erreur_pct_abs"].mean()
+                         .rename("Erreur (%)").reset_index().rename(columns={"nom_scenario": "Scénario",
+                                                                              "horizon": "Horizon"}))
+            st.altair_chart(
+                graphique_series(precision, "Horizon", "Erreur (%)", "Scénario", "Précision des prévisions de VL",
+                                 "Erreur absolue moyenne (%)", format_y=",.2f", type_x="quantitative"),
+                use_container_width=True
+            )
+        elif metriques is not None or 'backtesting' in st.session_state:
+            st.info("Aucune date de projection échue ne correspond à l'historique importé")
+
 with tab3:
     st.header("Guide d'utilisation")
     
@@ -1396,21 +2519,56 @@ with tab3:
     Pour chaque actif du portefeuille:
     - **Nom de l'actif** : Identifiant de l'actif
     - **% Détention** : Pourcentage de détention de l'actif (ex: 100% pour détention totale)
-    - **IS à provisionner** : Si coché, l'application appliquera un abattement de 25% sur les plus-values
+    - **IS à provisionner** : Si coché, la plus-value entre dans la base d'IS selon le régime fiscal de l'actif
+      (droit commun, quote-part imposable ou exonéré)
+    - **Règles d'IS du fonds** : Barème de taux par date (25% par défaut), compensation des plus et moins-values
+      entre actifs et report des moins-values sur les semestres suivants
     - **Valeur actuelle** : Valeur de l'actif à la date de dernière VL connue
     - **Valeur projetée** : Valeur estimée de l'actif au semestre suivant (S+1)
+    - **Fonds modélisé (transparence)** : L'actif suit la projection d'une autre simulation sauvegardée
+      (ANR et distributions reçues), au prorata du % de détention
+    - **Devise** : Les valeurs d'un actif en devise sont converties au cours de chaque semestre ; la variation
+      du change entre deux semestres fait varier l'ANR
+    
+    ### Devises et change
+    
+    - **Courbes de change** (onglet Gestion des simulations) : Cours en euros pour une unité de devise, donné par
+      un spot daté puis des cours projetés ou des points de terme ajoutés au spot, interpolés entre deux dates
+    - **Impacts en devise** : Les impacts fixes et multidates peuvent être saisis dans une devise dotée d'une courbe
+    - **Chocs de change du scénario** : Variation relative des cours projetés d'une devise, sauvegardée avec le scénario
+    - **Sensibilité au change** : VL et ANR finaux pour une gamme de chocs sur la courbe de la devise choisie
+    
+    ### Scénarios dérivés
+    
+    - **Dérivé du scénario** : Un scénario de stress peut hériter d'un scénario parent du même fonds ; seules ses
+      différences (actifs, impacts et paramètres modifiés, ajoutés ou supprimés) sont sauvegardées
+    - Au chargement, le scénario est reconstitué à partir de la dernière version du parent : une correction
+      sauvegardée sur le parent est reprise par tous ses dérivés
+    - Une sauvegarde identique à la dernière version de son scénario n'en crée pas de copie
+    
+    ### Événements sur les parts
+    
+    - **Souscription / Rachat** : Variation du nombre de parts à une date, au prix indiqué ou à la VL de la date
+    - **Distribution** : Montant versé par part en circulation
+    - Le tableau affiche alors le nombre de parts, les montants versés et la valeur totale par part initiale
+      (VL de la quote-part encore détenue + distributions cumulées)
     
     ### Impacts récurrents et multidates
     
-    - **Impacts récurrents** : Frais ou autres impacts qui se répètent à chaque semestre
+    - **Impacts récurrents** : Frais ou autres impacts qui se répètent à chaque semestre, en montant fixe,
+      en % de l'ANR du semestre précédent ou en % de la valeur des actifs, avec un plancher et un plafond optionnels
     - **Impacts multidates** : Impacts ponctuels à des dates spécifiques
     
     ### Fonctionnalités principales
     
     - Projection de la VL sur plusieurs semestres
-    - Visualisation graphique de l'évolution de la VL
+    - Graphique interactif de l'évolution de la VL : valeurs au survol, zoom à la molette, scénarios sauvegardés
+      superposables et masquables d'un clic sur la légende
     - Export des résultats en Excel ou JSON
     - Sauvegarde et chargement des simulations en base de données
+    - Consolidation de l'ANR de plusieurs fonds sur une grille de dates commune
+    - Roll-forward des simulations sur une nouvelle VL publiée, avec rapport d'écarts prévu / réel
+    - Backtesting des projections sauvegardées contre l'historique des VL officielles
     """)
     
     st.info("Cette application nécessite que les dates soient au format jj/mm/aaaa et les valeurs monétaires au format X XXX,XX €")
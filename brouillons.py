@@ -0,0 +1,194 @@
+"""Brouillons : sauvegarde automatique des paramètres en cours d'édition
+
+Chaque session écrit son brouillon dans `data/brouillons` quand ses paramètres
+n'ont plus changé depuis DELAI_INACTIVITE secondes. L'écriture est faite par un
+thread dédié, jamais pendant l'exécution du script Streamlit ; des modifications
+rapprochées ne produisent qu'une écriture, celle du dernier état. Les compteurs
+(voir `compteurs_brouillons`) mesurent le nombre d'écritures rapporté au nombre
+de modifications.
+"""
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from moteur import json_canonique
+from stockage import ecrire_atomique
+
+REPERTOIRE_BROUILLONS = 'data/brouillons'
+DELAI_INACTIVITE = 3.0  # secondes sans modification avant l'écriture du brouillon
+DUREE_RETENTION = timedelta(days=7)
+NB_BROUILLONS_PROPOSES = 5
+
+# demandes : modifications reçues ; inchangees : demandes identiques au dernier état connu ;
+# regroupees : états remplacés avant d'avoir été écrits ; ecritures / octets : fichiers effectivement écrits
+compteurs = {"demandes": 0, "inchangees": 0, "regroupees": 0, "ecritures": 0, "octets": 0,
+             "suppressions": 0, "erreurs": 0}
+
+condition = threading.Condition()
+en_attente = {}  # identifiant → (échéance, empreinte, contenu)
+ecrits = {}  # identifiant → empreinte du dernier état écrit
+en_ecriture = None  # brouillon en cours d'écriture par le thread dédié
+a_supprimer = set()  # brouillons abandonnés pendant leur écriture
+ecrivain = None
+
+
+def empreinte_brouillon(params):
+    """Empreinte de paramètres de session, pour reconnaître un état déjà écrit ou sauvegardé"""
+    return hashlib.sha256(json_canonique(params).encode('utf-8')).hexdigest()
+
+
+def _chemin(brouillon_id):
+    # L'identifiant vient de l'URL : il ne doit désigner qu'un fichier du répertoire des brouillons
+    if not brouillon_id or brouillon_id in {'.', '..'} or any(s in brouillon_id for s in ('/', '\\')):
+        raise ValueError(f"Identifiant de brouillon invalide : {brouillon_id!r}")
+    return os.path.join(REPERTOIRE_BROUILLONS, brouillon_id + '.json')
+
+
+# === ÉCRITURE EN ARRIÈRE-PLAN ===
+def _ecrire(brouillon_id, empreinte, contenu):
+    try:
+        os.makedirs(REPERTOIRE_BROUILLONS, exist_ok=True)
+        ecrire_atomique(_chemin(brouillon_id), contenu)
+    except OSError:
+        with condition:
+            compteurs["erreurs"] += 1
+        return
+    with condition:
+        compteurs["ecritures"] += 1
+        compteurs["octets"] += len(contenu)
+        ecrits[brouillon_id] = empreinte
+        if brouillon_id in a_supprimer:
+            a_supprimer.discard(brouillon_id)
+            ecrits.pop(brouillon_id, None)
+            _supprimer_fichier(brouillon_id)
+
+
+def _boucle_ecriture():
+    global en_ecriture
+    while True:
+        with condition:
+            while not en_attente:
+                condition.wait()
+            brouillon_id = min(en_attente, key=lambda cle: en_attente[cle][0])
+            attente = en_attente[brouillon_id][0] - time.monotonic()
+            if attente > 0:
+                # Une nouvelle modification peut repousser l'échéance ou en avancer une autre
+                condition.wait(attente)
+                continue
+            _, empreinte, contenu = en_attente.pop(brouillon_id)
+            en_ecriture = brouillon_id
+        try:
+            _ecrire(brouillon_id, empreinte, contenu)
+        finally:
+            with condition:
+                en_ecriture = None
+
+
+def _demarrer_ecrivain():
+    global ecrivain
+    if ecrivain is None or not ecrivain.is_alive():
+        ecrivain = threading.Thread(target=_boucle_ecriture, name="brouillons", daemon=True)
+        ecrivain.start()
+
+
+def planifier_brouillon(brouillon_id, params):
+    """Demander l'écriture du brouillon d'une session après DELAI_INACTIVITE ; retourne immédiatement
+
+    Une nouvelle demande pour le même brouillon remplace la précédente et repousse l'échéance.
+    """
+    _chemin(brouillon_id)
+    empreinte = empreinte_brouillon(params)
+    # Sérialisé dès maintenant : la session peut modifier ses paramètres avant l'écriture
+    contenu = json.dumps({
+        "id": brouillon_id,
+        "date_modification": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "params": params,
+    }, ensure_ascii=False, default=str).encode('utf-8')
+    with condition:
+        compteurs["demandes"] += 1
+        derniere = en_attente[brouillon_id][1] if brouillon_id in en_attente else ecrits.get(brouillon_id)
+        if derniere == empreinte:
+            compteurs["inchangees"] += 1
+            return
+        if brouillon_id in en_attente:
+            compteurs["regroupees"] += 1
+        en_attente[brouillon_id] = (time.monotonic() + DELAI_INACTIVITE, empreinte, contenu)
+        _demarrer_ecrivain()
+        condition.notify()
+
+
+def _supprimer_fichier(brouillon_id):
+    try:
+        os.remove(_chemin(brouillon_id))
+        compteurs["suppressions"] += 1
+    except FileNotFoundError:
+        pass
+
+
+def supprimer_brouillon(brouillon_id):
+    """Abandonner un brouillon : écriture en attente annulée et fichier supprimé"""
+    _chemin(brouillon_id)
+    with condition:
+        en_attente.pop(brouillon_id, None)
+        ecrits.pop(brouillon_id, None)
+        _supprimer_fichier(brouillon_id)
+        if en_ecriture == brouillon_id:
+            # Le fichier en cours d'écriture sera supprimé dès qu'il aura été renommé
+            a_supprimer.add(brouillon_id)
+
+
+def vider_brouillons():
+    """Écrire sans attendre les brouillons en attente (arrêt du serveur)"""
+    with condition:
+        restants = list(en_attente.items())
+        en_attente.clear()
+    for brouillon_id, (_, empreinte, contenu) in restants:
+        _ecrire(brouillon_id, empreinte, contenu)
+
+
+atexit.register(vider_brouillons)
+
+
+def compteurs_brouillons():
+    """Copie des compteurs d'écriture, avec le nombre de brouillons en attente"""
+    with condition:
+        return {**compteurs, "en_attente": len(en_attente)}
+
+
+# === RESTAURATION ===
+def lire_brouillon(brouillon_id):
+    """Brouillon enregistré (id, date_modification, params), ou None s'il n'existe pas"""
+    try:
+        with open(_chemin(brouillon_id), 'rb') as f:
+            brouillon = json.loads(f.read().decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+    # L'identifiant est celui du fichier, pas celui de son contenu
+    brouillon['id'] = brouillon_id
+    # Les impacts fixes en euros sont des couples (libellé, montant) dans les paramètres de session
+    brouillon['params']['impacts'] = [tuple(impact) if isinstance(impact, list) else impact
+                                      for impact in brouillon['params'].get('impacts', [])]
+    return brouillon
+
+
+def lister_brouillons(nombre=NB_BROUILLONS_PROPOSES):
+    """Brouillons les plus récents, après purge de ceux dont la rétention a expiré"""
+    if not os.path.isdir(REPERTOIRE_BROUILLONS):
+        return []
+    limite = (datetime.now() - DUREE_RETENTION).strftime("%Y-%m-%d %H:%M:%S")
+    brouillons = []
+    for entree in os.scandir(REPERTOIRE_BROUILLONS):
+        if not entree.name.endswith('.json'):
+            continue
+        brouillon = lire_brouillon(entree.name[:-len('.json')])
+        if brouillon is None:
+            continue
+        if brouillon['date_modification'] < limite:
+            supprimer_brouillon(brouillon['id'])
+            continue
+        brouillons.append(brouillon)
+    return sorted(brouillons, key=lambda brouillon: brouillon['date_modification'], reverse=True)[:nombre]
@@ -0,0 +1,191 @@
+"""Test de charge de l'application : plusieurs sessions simultanées sur un même stockage
+
+    python charge_app.py [--sessions 8] [--iterations 5] [--repertoire DOSSIER] [--garder]
+
+Chaque session est un processus qui exécute l'application sans navigateur
+(streamlit.testing AppTest) et enchaîne, à chaque itération, une modification
+des paramètres, une sauvegarde rapide, une recherche, un chargement depuis la
+barre latérale et un export PowerPoint. Toutes les sessions partagent le même
+répertoire `data`, copié dans un dossier de travail : le stockage réel n'est
+jamais touché.
+
+Le rapport donne, par action, les centiles de durée de réexécution du script et
+les erreurs, puis vérifie l'intégrité du stockage : index lisible et conforme
+aux fichiers, simulations valides, aucun fichier temporaire laissé, tâches
+d'export terminées. Le code de sortie est non nul en cas d'erreur.
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+MODULES_APPLICATION = ["app.py", "moteur.py", "stockage.py", "rapports.py", "taches.py", "brouillons.py"]
+DELAI_TACHES = 120  # secondes laissées aux exports en arrière-plan pour se terminer
+DELAI_RERUN = 120
+
+
+def champ_texte(at, libelle):
+    return next(champ for champ in at.text_input if champ.label == libelle)
+
+
+def rechercher(at, texte):
+    # Barre latérale affichée avant la première sauvegarde visible : rien à rechercher
+    if any(champ.key == "sidebar_recherche" for champ in at.text_input):
+        at.text_input(key="sidebar_recherche").set_value(texte)
+
+
+def charger_premiere(at):
+    bouton = next((bouton for bouton in at.sidebar.button if (bouton.key or "").startswith("sidebar_load_")), None)
+    if bouton is not None:
+        bouton.click()
+
+
+def executer_session(numero, iterations, repertoire):
+    """Une session utilisateur ; retourne ses mesures (action, durée, erreur éventuelle)"""
+    os.chdir(repertoire)
+    sys.path.insert(0, repertoire)
+    from streamlit.testing.v1 import AppTest
+    from taches import lister_taches, ETATS_FINAUX
+
+    mesures = []
+
+    def mesurer(action, at, preparer=None):
+        debut = time.perf_counter()
+        erreur = None
+        try:
+            if preparer is not None:
+                preparer(at)
+            at.run(timeout=DELAI_RERUN)
+            if at.exception:
+                erreur = at.exception[0].message
+            elif at.error:
+                erreur = at.error[0].value
+        except Exception as e:
+            erreur = f"{type(e).__name__}: {e}"
+        mesures.append((action, time.perf_counter() - debut, erreur))
+
+    at = AppTest.from_file(os.path.join(repertoire, "app.py"), default_timeout=DELAI_RERUN)
+    mesurer("ouverture", at)
+    for i in range(iterations):
+        # Fonds partagés entre sessions : les sauvegardes se disputent les mêmes scénarios
+        mesurer("edition", at, lambda at: (
+            champ_texte(at, "Nom du fonds").set_value(f"Fonds charge {i % 2}"),
+            champ_texte(at, "Nom du scénario").set_value(f"Scénario {numero % 3}"),
+            champ_texte(at, "ANR dernière VL connue (€)").set_value(f"{10_000_000 + 1000 * numero + i}")
+        ))
+        mesurer("sauvegarde", at, lambda at: at.button(key="quick_save").click())
+        mesurer("recherche", at, lambda at: rechercher(at, f"charge {i % 2}"))
+        mesurer("chargement", at, charger_premiere)
+        mesurer("export", at, lambda at: next(
+            bouton for bouton in at.button if bouton.label == "📊 Exporter en PowerPoint").click())
+
+    # Exports lancés par la session : attendus jusqu'à leur fin
+    fin = time.monotonic() + DELAI_TACHES
+    while any(tache['etat'] not in ETATS_FINAUX for tache in lister_taches()) and time.monotonic() < fin:
+        time.sleep(0.5)
+    return mesures
+
+
+def verifier_stockage(repertoire):
+    """Contrôles d'intégrité du stockage partagé ; retourne la liste des anomalies"""
+    from stockage import _charger_index, ids_stockes, lire_enregistrement, valider_simulation, FICHIER_INDEX
+    from taches import lister_taches
+    anomalies = []
+    os.chdir(repertoire)
+    if not os.path.exists(FICHIER_INDEX):
+        anomalies.append("Index absent")
+    index = _charger_index()
+    presents = ids_stockes()
+    for simulation_id in presents - set(index):
+        anomalies.append(f"Simulation {simulation_id} absente de l'index")
+    for simulation_id in set(index) - presents:
+        anomalies.append(f"Entrée d'index {simulation_id} sans fichier")
+    for simulation_id in presents:
+        try:
+            simulation = lire_enregistrement(simulation_id)
+        except Exception as e:
+            anomalies.append(f"Simulation {simulation_id} illisible : {e}")
+            continue
+        _, erreurs = valider_simulation(simulation)
+        if erreurs:
+            anomalies.append(f"Simulation {simulation_id} invalide : {' ; '.join(erreurs)}")
+    for temporaire in glob.glob(os.path.join("data", "**", "*.tmp"), recursive=True):
+        anomalies.append(f"Fichier temporaire laissé : {temporaire}")
+    for tache in lister_taches():
+        if tache['etat'] != "terminee":
+            anomalies.append(f"Tâche {tache['libelle']} : {tache['etat']} {' ; '.join(tache['erreurs'])}")
+        for chemin in tache['fichiers']:
+            if not os.path.getsize(chemin):
+                anomalies.append(f"Fichier produit vide : {chemin}")
+    return anomalies, len(presents)
+
+
+def preparer_repertoire(repertoire):
+    """Copie de l'application et, s'il existe, du stockage courant, dans le dossier de travail"""
+    source = os.path.dirname(os.path.abspath(__file__))
+    for module in MODULES_APPLICATION:
+        shutil.copy(os.path.join(source, module), repertoire)
+    if os.path.isdir(os.path.join(source, "data", "simulations")):
+        shutil.copytree(os.path.join(source, "data", "simulations"), os.path.join(repertoire, "data", "simulations"))
+    os.makedirs(os.path.join(repertoire, "data", "simulations"), exist_ok=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test de charge de l'application Streamlit")
+    parser.add_argument("--sessions", type=int, default=8, help="sessions simultanées")
+    parser.add_argument("--iterations", type=int, default=5, help="itérations par session")
+    parser.add_argument("--repertoire", default=None, help="dossier de travail (temporaire par défaut)")
+    parser.add_argument("--garder", action="store_true", help="conserver le dossier de travail")
+    arguments = parser.parse_args()
+
+    repertoire = os.path.abspath(arguments.repertoire or tempfile.mkdtemp(prefix="charge_app_"))
+    os.makedirs(repertoire, exist_ok=True)
+    preparer_repertoire(repertoire)
+    print(f"Dossier de travail : {repertoire}")
+
+    debut = time.perf_counter()
+    mesures, echecs = [], []
+    with ProcessPoolExecutor(max_workers=arguments.sessions) as executeur:
+        sessions = [executeur.submit(executer_session, numero, arguments.iterations, repertoire)
+                    for numero in range(arguments.sessions)]
+        for numero, session in enumerate(sessions):
+            try:
+                mesures.extend(session.result())
+            except Exception:
+                echecs.append(f"Session {numero} : {traceback.format_exc()}")
+    duree = time.perf_counter() - debut
+
+    sys.path.insert(0, repertoire)
+    anomalies, nb_simulations = verifier_stockage(repertoire)
+
+    par_action = defaultdict(list)
+    erreurs = defaultdict(list)
+    for action, duree_action, erreur in mesures:
+        par_action[action].append(duree_action * 1000)
+        if erreur:
+            erreurs[action].append(erreur)
+    print(f"{arguments.sessions} session(s) × {arguments.iterations} itération(s) en {duree:.1f} s — "
+          f"{len(mesures)} réexécutions ({len(mesures) / duree:.1f}/s)")
+    print(f"{'Action':<12}{'Nombre':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'Erreurs':>9}")
+    for action, durees in par_action.items():
+        durees = np.array(durees)
+        print(f"{action:<12}{len(durees):>8}{np.percentile(durees, 50):>10.0f}{np.percentile(durees, 95):>10.0f}"
+              f"{np.percentile(durees, 99):>10.0f}{durees.max():>10.0f}{len(erreurs[action]):>9}")
+    for action, messages in erreurs.items():
+        for message in sorted(set(messages))[:5]:
+            print(f"  {action} : {message}")
+    print(f"Stockage : {nb_simulations} simulation(s), {len(anomalies)} anomalie(s)")
+    for anomalie in anomalies[:20] + echecs:
+        print(f"  {anomalie}")
+
+    if not arguments.garder and not arguments.repertoire:
+        shutil.rmtree(repertoire, ignore_errors=True)
+    sys.exit(1 if anomalies or echecs or any(erreurs.values()) else 0)
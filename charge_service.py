@@ -0,0 +1,120 @@
+"""Test de charge du service HTTP de projection (voir service.py)
+
+    python charge_service.py [--lancer] [--requetes 200] [--concurrence 8] [--route projection|lots|simulations]
+
+Envoie des requêtes en parallèle depuis plusieurs connexions et affiche le
+débit et les centiles de latence. Avec --lancer, le service est démarré sur le
+port demandé le temps du test, puis arrêté.
+"""
+import argparse
+import http.client
+import json
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from service import PORT_DEFAUT
+
+# Simulation d'exemple au format des fichiers importés
+SIMULATION_EXEMPLE = {
+    "nom_fonds": "Fonds test de charge",
+    "nom_scenario": "Base case",
+    "date_vl_connue": "31/12/2024",
+    "date_fin_fonds": "31/12/2034",
+    "anr_derniere_vl": 10_000_000.0,
+    "nombre_parts": 10_000.0,
+    "impacts": [{"libelle": "Frais corporate", "montant": -50_000.0}],
+    "impacts_multidates": [{"libelle": "Honoraires", "montants": [{"date": "30/06/2025", "montant": -30_000.0}]}],
+    "actifs": [{"nom": f"Actif {i}", "pct_detention": 1.0, "valeur_actuelle": 1_000_000.0,
+                "valeur_projetee": 1_050_000.0, "is_a_provisionner": True} for i in range(10)],
+    "evenements_parts": []
+}
+
+
+def requete(connexion, methode, chemin, corps=None):
+    """Envoyer une requête sur une connexion persistante ; retourne (statut, durée en secondes)"""
+    debut = time.perf_counter()
+    connexion.request(methode, chemin, body=None if corps is None else json.dumps(corps),
+                      headers={"Content-Type": "application/json"})
+    reponse = connexion.getresponse()
+    reponse.read()
+    return reponse.status, time.perf_counter() - debut
+
+
+def attendre_service(port, delai=30.0):
+    fin = time.monotonic() + delai
+    while time.monotonic() < fin:
+        try:
+            connexion = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            requete(connexion, "GET", "/mesures")
+            connexion.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Service indisponible sur le port {port}")
+
+
+def lancer_charge(port, nb_requetes, concurrence, route, taille_lot):
+    """Répartir les requêtes entre `concurrence` connexions ; retourne les statuts et les durées"""
+    if route == "projection":
+        methode, chemin, corps = "POST", "/projection", SIMULATION_EXEMPLE
+    elif route == "lots":
+        methode, chemin, corps = "POST", "/lots", {"simulations": [SIMULATION_EXEMPLE] * taille_lot}
+    else:
+        methode, chemin, corps = "GET", "/simulations?taille=50", None
+
+    def client(nombre):
+        connexion = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        try:
+            return [requete(connexion, methode, chemin, corps) for _ in range(nombre)]
+        finally:
+            connexion.close()
+
+    parts = [nb_requetes // concurrence + (i < nb_requetes % concurrence) for i in range(concurrence)]
+    debut = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrence) as executeur:
+        resultats = [mesure for part in executeur.map(client, parts) for mesure in part]
+    return resultats, time.perf_counter() - debut
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test de charge du service HTTP de projection")
+    parser.add_argument("--port", type=int, default=PORT_DEFAUT)
+    parser.add_argument("--lancer", action="store_true", help="démarrer le service le temps du test")
+    parser.add_argument("--processus", type=int, default=None, help="processus de calcul du service lancé")
+    parser.add_argument("--requetes", type=int, default=200)
+    parser.add_argument("--concurrence", type=int, default=8)
+    parser.add_argument("--route", choices=["projection", "lots", "simulations"], default="projection")
+    parser.add_argument("--taille-lot", type=int, default=20, help="simulations par requête sur /lots")
+    arguments = parser.parse_args()
+
+    service = None
+    if arguments.lancer:
+        commande = [sys.executable, "service.py", "--port", str(arguments.port)]
+        if arguments.processus:
+            commande += ["--processus", str(arguments.processus)]
+        service = subprocess.Popen(commande)
+    try:
+        attendre_service(arguments.port)
+        # Une requête de chauffe : démarrage des processus de calcul
+        lancer_charge(arguments.port, arguments.concurrence, arguments.concurrence, arguments.route,
+                      arguments.taille_lot)
+        resultats, duree = lancer_charge(arguments.port, arguments.requetes, arguments.concurrence,
+                                         arguments.route, arguments.taille_lot)
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+
+    durees = np.array([d for _, d in resultats]) * 1000
+    erreurs = sum(1 for statut, _ in resultats if statut >= 400)
+    projections = len(resultats) * (arguments.taille_lot if arguments.route == "lots" else 1)
+    print(f"Route : {arguments.route} — {len(resultats)} requêtes, {arguments.concurrence} connexions, "
+          f"{erreurs} erreur(s)")
+    print(f"Durée : {duree:.2f} s — débit : {len(resultats) / duree:.1f} requêtes/s"
+          + (f", {projections / duree:.1f} projections/s" if arguments.route != "simulations" else ""))
+    print(f"Latence : p50 {np.percentile(durees, 50):.1f} ms, p95 {np.percentile(durees, 95):.1f} ms, "
+          f"p99 {np.percentile(durees, 99):.1f} ms, max {durees.max():.1f} ms")
@@ -0,0 +1,962 @@
+"""Moteur de projection de la VL, indépendant de l'interface Streamlit"""
+import copy
+import hashlib
+import json
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+# === DATES DE PROJECTION ===
+def generer_dates_semestres(date_vl_connue, date_fin_fonds):
+    """Générer la grille des dates : dernière VL connue puis chaque 30/06 et 31/12 jusqu'à la fin du fonds"""
+    dates_semestres = [date_vl_connue]
+    y = date_vl_connue.year
+    while datetime(y, 12, 31) <= date_fin_fonds:
+        if datetime(y, 6, 30) > date_vl_connue:
+            dates_semestres.append(datetime(y, 6, 30))
+        if datetime(y, 12, 31) > date_vl_connue:
+            dates_semestres.append(datetime(y, 12, 31))
+        y += 1
+    return dates_semestres
+
+
+def lire_date(date_str):
+    """Convertir une date jj/mm/aaaa, ou None si elle est invalide"""
+    try:
+        return datetime.strptime(date_str, "%d/%m/%Y")
+    except (TypeError, ValueError):
+        return None
+
+
+def lire_impact(impact):
+    """Extraire (libellé, montant) d'un impact récurrent stocké en tuple, liste ou dictionnaire"""
+    if isinstance(impact, (tuple, list)) and len(impact) == 2:
+        return impact[0], float(impact[1])
+    if isinstance(impact, dict) and 'libelle' in impact and 'montant' in impact:
+        return impact['libelle'], float(impact['montant'])
+    return None
+
+
+TYPES_IMPACTS = {
+    "fixe": "Montant fixe",
+    "pct_anr": "% de l'ANR",
+    "pct_actifs": "% de la valeur des actifs"
+}
+
+
+def normaliser_impact(impact):
+    """Ramener un impact récurrent à un dictionnaire complet (type, montant, taux, plancher, plafond)
+
+    Les impacts historiques (libellé, montant) sont des montants fixes en euros. Le taux est
+    semestriel et signé comme le montant (négatif pour des frais) ; le plancher et
+    le plafond bornent la valeur absolue du montant calculé.
+    """
+    if isinstance(impact, dict) and 'libelle' in impact:
+        type_impact = impact.get('type', 'fixe')
+        if type_impact not in TYPES_IMPACTS:
+            return None
+        return {
+            "libelle": impact['libelle'],
+            "type": type_impact,
+            "devise": impact.get('devise') or DEVISE_FONDS,
+            "montant": float(impact.get('montant', 0.0) or 0.0),
+            "taux": float(impact.get('taux', 0.0) or 0.0),
+            "plancher": None if impact.get('plancher') is None else float(impact['plancher']),
+            "plafond": None if impact.get('plafond') is None else float(impact['plafond'])
+        }
+    lu = lire_impact(impact)
+    if lu is None:
+        return None
+    return {"libelle": lu[0], "type": "fixe", "devise": DEVISE_FONDS, "montant": lu[1], "taux": 0.0,
+            "plancher": None, "plafond": None}
+
+
+def borner(montants, plancher, plafond):
+    """Borner la valeur absolue de montants par un plancher et un plafond optionnels, en gardant leur signe"""
+    if plancher is None and plafond is None:
+        return montants
+    return np.sign(montants) * np.clip(np.abs(montants), plancher or 0.0, np.inf if plafond is None else plafond)
+
+
+def evoluer_anr(anr_initial, flux, impacts_anr=(), facteurs_evenements=None, flux_evenements=None,
+                anr_connu=None, debut=0):
+    """Faire évoluer l'ANR : ANR(t) = [ANR(t-1) × (1 + taux(t)) + flux(t)] × facteur(t) + flux_evenement(t)
+
+    `flux` regroupe les montants indépendants de l'ANR ; `impacts_anr` liste les
+    impacts en % de l'ANR précédent sous forme de (taux par période, plancher, plafond).
+    Les événements sur les parts, appliqués en fin de période, sont un facteur sur
+    l'ANR (souscriptions et rachats à la VL) et un flux (distributions, opérations à
+    prix fixé). Sans borne, la récurrence linéaire est résolue par produits et sommes
+    cumulés. Un plancher ou un plafond la rend non linéaire : elle est alors déroulée
+    période par période. Retourne l'ANR et le montant de chaque impact en % de l'ANR.
+
+    `anr_connu` est l'ANR d'un calcul précédent dont les données n'ont pas changé
+    avant la période `debut` : il sert de point de reprise et la récurrence n'est
+    résolue qu'à partir de cette période.
+    """
+    n = len(flux)
+    if facteurs_evenements is None:
+        facteurs_evenements = np.ones(n)
+    if flux_evenements is None:
+        flux_evenements = np.zeros(n)
+    if anr_connu is not None and len(anr_connu) == n and 0 < debut:
+        debut = min(debut, n)
+        anr_suite, _ = evoluer_anr(float(anr_connu[debut - 1]), flux[debut:],
+                                   [(taux_impact[debut:], plancher, plafond) for taux_impact, plancher, plafond in impacts_anr],
+                                   facteurs_evenements[debut:], flux_evenements[debut:])
+        anr = np.concatenate([anr_connu[:debut], anr_suite])
+        return anr, montants_impacts_anr(anr_initial, anr, impacts_anr)
+    taux = np.zeros(n)
+    for taux_impact, _, _ in impacts_anr:
+        taux = taux + taux_impact
+    multiplicateurs = (1 + taux) * facteurs_evenements
+    facteurs = np.cumprod(multiplicateurs)
+    bornes = any(plancher is not None or plafond is not None for _, plancher, plafond in impacts_anr)
+
+    if not bornes and np.all(facteurs != 0):
+        anr = facteurs * (anr_initial + np.cumsum((flux * facteurs_evenements + flux_evenements) / facteurs))
+    else:
+        anr = np.empty(n)
+        precedent = anr_initial
+        for t in range(n):
+            variation = flux[t]
+            for taux_impact, plancher, plafond in impacts_anr:
+                if taux_impact[t]:
+                    variation += borner(taux_impact[t] * precedent, plancher, plafond)
+            anr[t] = (precedent + variation) * facteurs_evenements[t] + flux_evenements[t]
+            precedent = anr[t]
+
+    return anr, montants_impacts_anr(anr_initial, anr, impacts_anr)
+
+
+def montants_impacts_anr(anr_initial, anr, impacts_anr):
+    """Montant de chaque impact en % de l'ANR, calculé sur l'ANR de la période précédente"""
+    anr_precedent = np.concatenate([[anr_initial], anr[:-1]])
+    return [
+        np.where(taux_impact != 0, borner(taux_impact * anr_precedent, plancher, plafond), 0.0)
+        for taux_impact, plancher, plafond in impacts_anr
+    ]
+
+
+# === CALCUL EN CENTIMES ===
+MODES_CALCUL = {
+    "flottant": "Virgule flottante, VL arrondie au centime",
+    "centimes": "Centimes entiers, pour un rapprochement au centime avec les VL officielles",
+}
+REGLES_ARRONDI = {
+    "demi_haut": "Commercial : demi-centime arrondi en s'éloignant de zéro",
+    "bancaire": "Bancaire : demi-centime arrondi au centime pair",
+}
+GRANULARITES_ARRONDI = {
+    "ligne": "Chaque ligne, à chaque période",
+    "periode": "Total de chaque période, les lignes restant au montant exact",
+}
+ARRONDI_DEFAUT = {"mode": "flottant", "regle": "demi_haut", "granularite": "ligne"}
+
+
+def arrondir(valeurs, regle):
+    """Arrondir à l'entier selon la règle d'arrondi ; retourne des int64
+
+    Les valeurs sont d'abord ramenées à 6 décimales, pour qu'un demi exact en
+    décimal (1,005 € = 100,5 centimes) ne soit pas décalé par sa représentation binaire.
+    """
+    valeurs = np.round(np.asarray(valeurs, dtype=float), 6)
+    if regle == "bancaire":
+        return np.rint(valeurs).astype(np.int64)
+    return (np.sign(valeurs) * np.floor(np.abs(valeurs) + 0.5)).astype(np.int64)
+
+
+def en_centimes(montants, regle):
+    """Montants en euros convertis en centimes entiers selon la règle d'arrondi"""
+    return arrondir(np.asarray(montants, dtype=float) * 100, regle)
+
+
+def evoluer_anr_centimes(anr_initial, lignes, impacts_anr=(), facteurs_evenements=None, flux_evenements=None,
+                         arrondi=ARRONDI_DEFAUT, anr_connu=None, debut=0):
+    """Faire évoluer l'ANR en centimes entiers (int64), avec la récurrence de `evoluer_anr`
+
+    `lignes` (une ligne par flux indépendant de l'ANR, en euros) est arrondie au
+    centime ligne par ligne, ou seulement par son total de chaque période, selon
+    `arrondi['granularite']` ; de même pour les impacts en % de l'ANR. L'ANR après
+    les événements sur les parts est arrondi au centime. Sans impact en % de l'ANR
+    ni opération à la VL, l'ANR est une somme cumulée d'entiers ; sinon la
+    récurrence est déroulée période par période. Retourne l'ANR et le montant de
+    chaque impact en % de l'ANR, en centimes : entiers par ligne, non arrondis
+    quand seul le total de la période l'est.
+    """
+    regle = arrondi['regle']
+    par_ligne = arrondi['granularite'] == 'ligne'
+    n = lignes.shape[1]
+    if facteurs_evenements is None:
+        facteurs_evenements = np.ones(n)
+    flux_evenements = en_centimes(np.zeros(n) if flux_evenements is None else flux_evenements, regle)
+    if par_ligne:
+        flux = en_centimes(lignes, regle).sum(axis=0)
+    else:
+        flux = lignes.sum(axis=0)
+
+    anr = np.empty(n, dtype=np.int64)
+    anr_initial = en_centimes(anr_initial, regle)
+    precedent = anr_initial
+    if anr_connu is not None and len(anr_connu) == n and 0 < debut:
+        # Reprise d'un calcul précédent, lui-même au centime
+        debut = min(debut, n)
+        anr[:debut] = en_centimes(anr_connu[:debut], regle)
+        precedent = anr[debut - 1]
+    else:
+        debut = 0
+
+    if not impacts_anr and np.all(facteurs_evenements == 1):
+        variations = flux if par_ligne else en_centimes(flux, regle)
+        anr[debut:] = precedent + np.cumsum(variations[debut:] + flux_evenements[debut:])
+    else:
+        for t in range(debut, n):
+            montants = [borner(taux_impact[t] * precedent / 100, plancher, plafond)
+                        for taux_impact, plancher, plafond in impacts_anr if taux_impact[t]]
+            if par_ligne:
+                variation = flux[t] + en_centimes(montants, regle).sum()
+            else:
+                variation = en_centimes(flux[t] + sum(montants), regle)
+            anr[t] = arrondir((precedent + variation) * facteurs_evenements[t], regle) + flux_evenements[t]
+            precedent = anr[t]
+
+    anr_precedent = np.concatenate([[anr_initial], anr[:-1]])
+    montants_anr = [
+        np.where(taux_impact != 0, borner(taux_impact * anr_precedent / 100, plancher, plafond) * 100, 0.0)
+        for taux_impact, plancher, plafond in impacts_anr
+    ]
+    if par_ligne:
+        montants_anr = [arrondir(montants, regle) for montants in montants_anr]
+    return anr, montants_anr
+
+
+# === ÉVÉNEMENTS SUR LES PARTS ===
+TYPES_EVENEMENTS = {
+    "souscription": "Souscription",
+    "rachat": "Rachat / annulation de parts",
+    "distribution": "Distribution par part"
+}
+
+
+def evenements_en_tableaux(evenements, index_dates, n):
+    """Agréger les événements datés sur les parts en tableaux par période
+
+    Une souscription ou un rachat sans prix par part est exécuté à la VL de la date.
+    Retourne les variations de parts à la VL et à prix fixé, les parts rachetées
+    (au total et à la VL), le flux d'ANR des opérations à prix fixé, le montant
+    versé pour les rachats à prix fixé et la distribution par part.
+    """
+    tableaux = {nom: np.zeros(n) for nom in
+                ["parts_vl", "parts_prix", "parts_rachetees", "rachats_vl", "flux_prix", "rachats_prix",
+                 "distribution_par_part"]}
+    for evenement in evenements or []:
+        i = index_dates.get(evenement.get('date'))
+        if i is None or evenement.get('type') not in TYPES_EVENEMENTS:
+            continue
+        parts = abs(float(evenement.get('parts', 0) or 0))
+        prix = float(evenement.get('montant_par_part', 0) or 0)
+        if evenement['type'] == 'distribution':
+            tableaux["distribution_par_part"][i] += prix
+            continue
+        signe = 1 if evenement['type'] == 'souscription' else -1
+        if signe < 0:
+            tableaux["parts_rachetees"][i] += parts
+        if prix:
+            tableaux["parts_prix"][i] += signe * parts
+            tableaux["flux_prix"][i] += signe * parts * prix
+            if signe < 0:
+                tableaux["rachats_prix"][i] += parts * prix
+        else:
+            tableaux["parts_vl"][i] += signe * parts
+            if signe < 0:
+                tableaux["rachats_vl"][i] += parts
+    return tableaux
+
+
+# === DEVISES ET COURBES DE CHANGE ===
+DEVISE_FONDS = "EUR"
+
+
+def cours_par_date(courbe, dates, choc=0.0):
+    """Cours d'une devise (en euros pour une unité) à chaque date, d'après sa courbe stockée
+
+    La courbe contient un spot daté et des points datés, exprimés soit en points de
+    terme ajoutés au spot, soit en cours projeté. Le cours est interpolé linéairement
+    entre deux points et reste constant au-delà. Le choc relatif s'applique aux cours
+    projetés, pas à la date de départ.
+    """
+    spot = float(courbe['spot'])
+    noeuds = [(lire_date(courbe.get('date_spot')) or datetime(1900, 1, 1), spot)]
+    for point in courbe.get('points', []):
+        date_point = lire_date(point.get('date'))
+        if date_point is None:
+            continue
+        if point.get('cours') not in (None, ""):
+            noeuds.append((date_point, float(point['cours'])))
+        else:
+            noeuds.append((date_point, spot + float(point.get('points', 0) or 0)))
+    noeuds.sort(key=lambda noeud: noeud[0])
+    jours_noeuds = np.array([d for d, _ in noeuds], dtype='datetime64[D]').astype(float)
+    jours = np.array(dates, dtype='datetime64[D]').astype(float)
+    cours = np.interp(jours, jours_noeuds, [c for _, c in noeuds])
+    if choc:
+        cours[1:] *= 1 + choc
+    return cours
+
+
+def devises_utilisees(params):
+    """Devises autres que celle du fonds utilisées par les actifs et les impacts"""
+    devises = {a.get('devise', DEVISE_FONDS) for a in params.get('actifs', [])}
+    devises |= {i.get('devise', DEVISE_FONDS) for i in params.get('impacts', []) if isinstance(i, dict)}
+    devises |= {i.get('devise', DEVISE_FONDS) for i in params.get('impacts_multidates', [])}
+    return sorted(devises - {DEVISE_FONDS})
+
+
+def tableaux_cours(params, courbes_fx, dates):
+    """Cours par date de chaque devise utilisée, après les chocs de change du scénario (`chocs_fx`)"""
+    chocs = params.get('chocs_fx') or {}
+    cours = {}
+    for devise in devises_utilisees(params):
+        courbe = (courbes_fx or {}).get(devise)
+        if courbe is None:
+            raise ValueError(f"Aucune courbe de change pour la devise {devise}")
+        cours[devise] = cours_par_date(courbe, dates, float(chocs.get(devise, 0) or 0))
+    return cours
+
+
+def convertir(montants, devise, cours):
+    """Convertir des montants par période dans la devise du fonds"""
+    if not devise or devise == DEVISE_FONDS:
+        return montants
+    return montants * cours[devise]
+
+
+# === FISCALITÉ (IS SUR LES PLUS-VALUES) ===
+REGIMES_FISCAUX = {
+    "droit_commun": "Droit commun",
+    "participation": "Quote-part imposable",
+    "exonere": "Exonéré"
+}
+
+FISCALITE_DEFAUT = {
+    "taux": [{"date": "01/01/2000", "taux": 0.25}],
+    "compensation": False,
+    "report_deficits": False
+}
+
+
+def taux_par_date(bareme, dates):
+    """Taux applicable à chaque date : dernier taux du barème entré en vigueur à cette date"""
+    entrees = sorted(
+        ((lire_date(e.get('date')), float(e.get('taux', 0))) for e in bareme or []),
+        key=lambda e: e[0] or datetime.min
+    )
+    entrees = [(d or datetime.min, taux) for d, taux in entrees]
+    if not entrees:
+        entrees = [(datetime.min, FISCALITE_DEFAUT['taux'][0]['taux'])]
+    debuts = np.array([d for d, _ in entrees], dtype='datetime64[s]')
+    taux = np.array([t for _, t in entrees])
+    i = np.searchsorted(debuts, np.array(dates, dtype='datetime64[s]'), side='right') - 1
+    # Avant la première entrée, le premier taux du barème s'applique
+    return taux[np.maximum(i, 0)]
+
+
+TYPES_ACTIFS = {
+    "direct": "Actif direct",
+    "fonds": "Fonds modélisé (transparence)"
+}
+
+
+def aligner_sous_fonds(resultat, dates):
+    """ANR et distributions cumulées d'un sous-fonds projeté, lus sur la grille de dates du fonds détenteur"""
+    dates_sous_fonds = np.array(resultat['dates'], dtype='datetime64[s]')
+    i = np.searchsorted(dates_sous_fonds, np.array(dates, dtype='datetime64[s]'), side='right') - 1
+    i = np.maximum(i, 0)
+    return resultat['anr'][i], np.cumsum(resultat['distributions'])[i]
+
+
+def chemins_actifs(actifs, dates, sous_fonds=None, cours=None):
+    """Valeur de la quote-part détenue et variation brute de chaque actif (actifs × périodes)
+
+    Un actif direct passe de sa valeur actuelle à sa valeur projetée en S+1 ; s'il
+    est libellé dans une autre devise, sa valeur est convertie au cours de chaque
+    période (`cours`, voir `tableaux_cours`), le change faisant varier l'ANR. Un
+    actif de type "fonds" suit, en transparence, la projection du sous-fonds
+    référencé (ANR et distributions reçues) ; si cette projection n'est pas
+    disponible, ses valeurs saisies sont utilisées comme pour un actif direct.
+    """
+    n = len(dates)
+    valeurs = np.zeros((len(actifs), n))
+    variations = np.zeros((len(actifs), n))
+    for k, a in enumerate(actifs):
+        pct = float(a.get('pct_detention', 1.0))
+        resultat = (sous_fonds or {}).get(a.get('simulation_id')) if a.get('type') == 'fonds' else None
+        if resultat is not None:
+            anr_sous_fonds, distributions_cumulees = aligner_sous_fonds(resultat, dates)
+            valeurs[k] = pct * anr_sous_fonds
+            variations[k, 1:] = pct * (np.diff(anr_sous_fonds) + np.diff(distributions_cumulees))
+        else:
+            valeur_actuelle = float(a.get('valeur_actuelle', 0))
+            valeur_projetee = float(a.get('valeur_projetee', 0))
+            valeurs[k] = convertir(pct * np.where(np.arange(n) > 0, valeur_projetee, valeur_actuelle),
+                                   a.get('devise'), cours)
+            variations[k, 1:] = np.diff(valeurs[k])
+    return valeurs, variations
+
+
+def calculer_impots(actifs, fiscalite, dates, variations_brutes=None):
+    """Calculer l'IS sur les plus-values de tous les actifs et de toutes les périodes
+
+    Les variations brutes (actifs × périodes) sont réduites à leur base imposable
+    selon le régime de chaque actif : droit commun, quote-part imposable (régime
+    des titres de participation) ou exonéré ; seuls les actifs avec IS à provisionner
+    entrent dans la base. Selon les règles du fonds, moins-values et plus-values se
+    compensent entre actifs d'une même période, et les déficits se reportent sur
+    les périodes suivantes. Le report utilise le maximum courant de la base cumulée :
+    l'assiette cumulée est max(0, max des bases cumulées), sans boucle sur les périodes.
+    L'impôt du fonds est réparti entre actifs au prorata de leur base positive.
+    Les variations brutes peuvent être fournies (actifs en transparence).
+    """
+    fiscalite = {**FISCALITE_DEFAUT, **(fiscalite or {})}
+    if variations_brutes is None:
+        variations_brutes = chemins_actifs(actifs, dates)[1]
+    quote_parts = np.zeros(len(actifs))
+    for k, a in enumerate(actifs):
+        if a.get('is_a_provisionner', False):
+            regime = a.get('regime_fiscal', 'droit_commun')
+            if regime == 'participation':
+                quote_parts[k] = float(a.get('quote_part_imposable', 0.12))
+            elif regime != 'exonere':
+                quote_parts[k] = 1.0
+
+    bases = variations_brutes * quote_parts[:, None]
+    taux = taux_par_date(fiscalite['taux'], dates)
+
+    def assiette(base, axe):
+        # Base imposable de chaque période, avec report illimité des déficits si demandé
+        if not fiscalite['report_deficits']:
+            return np.maximum(base, 0.0)
+        cumul = np.maximum(np.maximum.accumulate(np.cumsum(base, axis=axe), axis=axe), 0.0)
+        return np.diff(cumul, axis=axe, prepend=0.0)
+
+    if fiscalite['compensation']:
+        impot_fonds = taux * assiette(bases.sum(axis=0), 0)
+        positives = np.maximum(bases, 0.0)
+        total_positif = positives.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            repartition = np.where(total_positif > 0, positives / total_positif, 0.0)
+        impots = repartition * impot_fonds
+    else:
+        impots = assiette(bases, 1) * taux
+
+    return {
+        "variations_brutes": variations_brutes,
+        "impots": impots,
+        "variations_nettes": variations_brutes - impots,
+        "taux": taux
+    }
+
+
+def variations_s1(actifs, fiscalite, dates, sous_fonds=None, courbes_fx=None, chocs_fx=None):
+    """Variations brute et nette d'IS de chaque actif au semestre S+1, pour l'affichage et la sauvegarde"""
+    dates_s1 = list(dates[:2]) if len(dates) > 1 else [dates[0], dates[0]]
+    cours = tableaux_cours({"actifs": actifs, "chocs_fx": chocs_fx}, courbes_fx, dates_s1)
+    resultat = calculer_impots(actifs, fiscalite, dates_s1, chemins_actifs(actifs, dates_s1, sous_fonds, cours)[1])
+    return resultat['variations_brutes'][:, 1], resultat['variations_nettes'][:, 1]
+
+
+# === CALCUL DE LA PROJECTION ===
+def calculer_projection(params, dates=None, sous_fonds=None, courbes_fx=None, reprise=None):
+    """Calculer la projection semestrielle de l'ANR et de la VL
+
+    Chaque ligne (actif, impact récurrent, impact multidate) est un tableau numpy
+    aligné sur les dates de semestre ; l'ANR est la somme cumulée des flux,
+    capitalisée par les impacts exprimés en % de l'ANR.
+    Si `dates` n'est pas fourni, la grille est déduite des dates du fonds.
+    `sous_fonds` associe l'identifiant d'une simulation à sa projection, pour les
+    actifs détenus en transparence (voir `projeter_sous_fonds`). `courbes_fx`
+    fournit les courbes de change des devises utilisées par les actifs et les impacts.
+    `reprise` = (projection précédente, période) reprend l'ANR de la projection
+    précédente jusqu'à la première période modifiée (voir `premiere_periode_modifiee`),
+    ainsi que ses lignes d'actifs, d'IS et d'impacts récurrents, seuls les impacts
+    multidates, les événements sur les parts et les impacts en % de l'ANR étant recalculés.
+    Avec `params['arrondi']['mode']` = "centimes", les lignes, l'ANR, la VL et les
+    distributions sont calculés en centimes entiers (voir `evoluer_anr_centimes`).
+    """
+    arrondi = {**ARRONDI_DEFAUT, **(params.get('arrondi') or {})}
+    centimes = arrondi['mode'] == 'centimes'
+    if dates is None:
+        dates = generer_dates_semestres(
+            datetime.strptime(params['date_vl_connue'], "%d/%m/%Y"),
+            datetime.strptime(params['date_fin_fonds'], "%d/%m/%Y")
+        )
+    n = len(dates)
+    index_dates = {d.strftime('%d/%m/%Y'): i for i, d in enumerate(dates)}
+
+    # Cours de change par période des devises utilisées
+    cours = tableaux_cours(params, courbes_fx, dates)
+
+    # Reprise : actifs, IS et impacts récurrents ne dépendent que de paramètres inchangés depuis la projection
+    # précédente (voir `premiere_periode_modifiee`) ; leurs lignes sont reprises telles quelles
+    precedente = reprise[0] if reprise is not None and reprise[1] > 0 and len(reprise[0]['anr']) == n else None
+    if precedente is not None:
+        lignes_actifs, impots = precedente['actifs'], precedente['impots']
+    else:
+        # Variation par actif (S+1 pour un actif direct, chaque période en transparence ou en devise), nette d'IS
+        valeurs_actifs, variations_brutes = chemins_actifs(params.get('actifs', []), dates, sous_fonds, cours)
+        fiscalite = calculer_impots(params.get('actifs', []), params.get('fiscalite'), dates, variations_brutes)
+        impots = fiscalite['impots']
+        lignes_actifs = [(a.get('nom', 'Sans nom'), fiscalite['variations_nettes'][k])
+                         for k, a in enumerate(params.get('actifs', []))]
+
+        # Valeur des actifs (quote-part détenue) en début de période
+        valeur_totale = valeurs_actifs.sum(axis=0)
+        base_actifs = np.concatenate([valeur_totale[:1], valeur_totale[:-1]])
+
+    # Impacts récurrents, appliqués à partir de S+1
+    masque_recurrent = np.arange(n) > 0
+    lignes_impacts = []
+    impacts_anr = []
+    impacts = [impact for impact in map(normaliser_impact, params.get('impacts', [])) if impact is not None]
+    for k, impact in enumerate(impacts):
+        if impact['type'] == 'pct_anr':
+            # Montant calculé avec l'ANR, une fois la récurrence résolue
+            impacts_anr.append((np.where(masque_recurrent, impact['taux'], 0.0), impact['plancher'], impact['plafond']))
+            lignes_impacts.append((impact['libelle'], None))
+        elif precedente is not None:
+            lignes_impacts.append(precedente['impacts'][k])
+        elif impact['type'] == 'pct_actifs':
+            montants = borner(impact['taux'] * base_actifs, impact['plancher'], impact['plafond'])
+            lignes_impacts.append((impact['libelle'], np.where(masque_recurrent, montants, 0.0)))
+        else:
+            montants = convertir(np.full(n, impact['montant']), impact['devise'], cours)
+            lignes_impacts.append((impact['libelle'], np.where(masque_recurrent, montants, 0.0)))
+
+    # Impacts multidates à leurs dates spécifiques
+    lignes_multidates = []
+    for impact in params.get('impacts_multidates', []):
+        serie = np.zeros(n)
+        for occurrence in impact.get('montants', []):
+            i = index_dates.get(occurrence.get('date'))
+            if i is not None:
+                serie[i] += float(occurrence.get('montant', 0))
+        lignes_multidates.append((impact.get('libelle', 'Sans nom'), convertir(serie, impact.get('devise'), cours)))
+
+    if centimes and arrondi['granularite'] == 'ligne':
+        # Chaque ligne est arrondie au centime à chaque période, telle qu'elle est comptabilisée
+        arrondie = lambda lignes: [(libelle, None if serie is None else en_centimes(serie, arrondi['regle']) / 100)
+                                   for libelle, serie in lignes]
+        lignes_actifs, lignes_impacts, lignes_multidates = map(arrondie, (lignes_actifs, lignes_impacts, lignes_multidates))
+
+    flux = np.zeros(n)
+    for _, serie in lignes_actifs + lignes_impacts + lignes_multidates:
+        if serie is not None:
+            flux += serie
+
+    # Parts en circulation : avant et après les événements de chaque date
+    evenements = evenements_en_tableaux(params.get('evenements_parts', []), index_dates, n)
+    parts_initiales = float(params.get('nombre_parts', 0))
+    parts = parts_initiales + np.cumsum(evenements["parts_vl"] + evenements["parts_prix"])
+    parts_avant = np.concatenate([[parts_initiales], parts[:-1]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Distribution versée aux porteurs présents, puis opérations à la VL ex-distribution
+        facteurs_evenements = np.where(parts_avant > 0, 1 + evenements["parts_vl"] / parts_avant, 1.0)
+    distributions_versees = evenements["distribution_par_part"] * parts_avant
+    flux_evenements = evenements["flux_prix"] - distributions_versees * facteurs_evenements
+
+    anr_initial = float(params.get('anr_derniere_vl', 0))
+    anr_connu, debut = (reprise[0]['anr'], reprise[1]) if reprise is not None else (None, 0)
+    if centimes:
+        lignes = np.array([serie for _, serie in lignes_actifs + lignes_impacts + lignes_multidates
+                           if serie is not None]).reshape(-1, n)
+        anr, montants_anr = evoluer_anr_centimes(anr_initial, lignes, impacts_anr, facteurs_evenements,
+                                                 flux_evenements, arrondi, anr_connu, debut)
+        anr = anr / 100
+        montants_anr = [montants / 100 for montants in montants_anr]
+    else:
+        anr, montants_anr = evoluer_anr(anr_initial, flux, impacts_anr, facteurs_evenements, flux_evenements,
+                                        anr_connu, debut)
+    lignes_impacts_anr = iter(montants_anr)
+    lignes_impacts = [(libelle, next(lignes_impacts_anr) if serie is None else serie) for libelle, serie in lignes_impacts]
+
+    # Montants versés aux porteurs : distributions et produits des rachats
+    anr_avant_evenements = np.concatenate([[anr_initial], anr[:-1]]) + flux + sum(montants_anr, np.zeros(n))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vl_ex_distribution = np.where(parts_avant > 0, (anr_avant_evenements - distributions_versees) / parts_avant, 0.0)
+        distributions = distributions_versees + evenements["rachats_vl"] * vl_ex_distribution + evenements["rachats_prix"]
+        if centimes:
+            distributions = en_centimes(distributions, arrondi['regle']) / 100
+            vl = np.where(parts > 0, arrondir(anr * 100 / parts, arrondi['regle']) / 100, 0.0)
+        else:
+            vl = np.round(np.where(parts > 0, anr / parts, 0.0), 2)
+        # Part d'une part initiale encore détenue, les rachats étant supposés au prorata des porteurs
+        detention = np.cumprod(np.where(parts_avant > 0, 1 - evenements["parts_rachetees"] / parts_avant, 1.0))
+        detention_avant = np.concatenate([[1.0], detention[:-1]])
+        distribue_par_part = np.cumsum(np.where(parts_avant > 0, distributions / parts_avant, 0.0) * detention_avant)
+
+    return {
+        "dates": dates,
+        "actifs": lignes_actifs,
+        "impots": impots,
+        "impacts": lignes_impacts,
+        "impacts_multidates": lignes_multidates,
+        "anr": anr,
+        "parts": parts,
+        "vl": vl,
+        "distributions": distributions,
+        "distribue_par_part": distribue_par_part,
+        "valeur_totale_par_part": vl * detention + distribue_par_part
+    }
+
+
+NB_POINTS_APERCU = 24
+
+
+def resumer_projection(resultat, nb_points=NB_POINTS_APERCU):
+    """Synthèse d'une projection, conservée avec la simulation et dans l'index
+
+    VL initiale et finale, variation entre les deux (en fraction), date et niveau
+    de la VL minimale, et aperçu de la courbe de VL sur au plus `nb_points` dates
+    régulièrement espacées, la première et la dernière comprises.
+    """
+    vl = np.asarray(resultat['vl'], dtype=float)
+    indices = np.unique(np.linspace(0, len(vl) - 1, min(nb_points, len(vl))).round().astype(int))
+    i_min = int(np.argmin(vl))
+    return {
+        "vl_initiale": float(vl[0]),
+        "vl_finale": float(vl[-1]),
+        "variation": float(vl[-1] / vl[0] - 1) if vl[0] else None,
+        "date_vl_min": resultat['dates'][i_min].strftime('%d/%m/%Y'),
+        "vl_min": float(vl[i_min]),
+        "apercu": [float(v) for v in vl[indices]],
+    }
+
+
+# === FONDS DE FONDS (TRANSPARENCE) ===
+def dependances(params):
+    """Identifiants des simulations détenues en transparence par un jeu de paramètres"""
+    return [a['simulation_id'] for a in params.get('actifs', [])
+            if a.get('type') == 'fonds' and a.get('simulation_id')]
+
+
+def projeter_sous_fonds(params, charger, cache=None, courbes_fx=None):
+    """Projeter tous les sous-fonds dont dépendent des paramètres, chacun une seule fois
+
+    Le graphe des dépendances est parcouru en profondeur à partir des paramètres ;
+    une dépendance circulaire lève une ValueError. Les sous-fonds sont ensuite
+    projetés dans l'ordre topologique (dépendances d'abord) et mémorisés dans
+    `cache` (identifiant → projection), qui peut être partagé entre plusieurs
+    fonds d'un même traitement. `charger` renvoie les paramètres d'une simulation
+    ou None si elle est introuvable.
+    """
+    cache = {} if cache is None else cache
+    etats = {}
+    ordre = []
+    params_par_id = {}
+
+    def visiter(simulation_id, chemin):
+        if simulation_id in cache or etats.get(simulation_id) == "termine":
+            return
+        if etats.get(simulation_id) == "en_cours":
+            raise ValueError(f"Dépendance circulaire entre fonds : {' → '.join(chemin + [simulation_id])}")
+        etats[simulation_id] = "en_cours"
+        params_sous_fonds = charger(simulation_id)
+        if params_sous_fonds is not None:
+            params_par_id[simulation_id] = params_sous_fonds
+            for dependance in dependances(params_sous_fonds):
+                visiter(dependance, chemin + [simulation_id])
+            ordre.append(simulation_id)
+        etats[simulation_id] = "termine"
+
+    for dependance in dependances(params):
+        visiter(dependance, [params.get('nom_fonds', 'Fonds')])
+
+    for simulation_id in ordre:
+        cache[simulation_id] = calculer_projection(params_par_id.pop(simulation_id), sous_fonds=cache,
+                                                   courbes_fx=courbes_fx)
+    return cache
+
+
+# === CONSOLIDATION MULTI-FONDS ===
+def consolider_series(contributions, prolonger=True):
+    """Aligner les séries de plusieurs fonds sur une grille de dates commune
+
+    `contributions` associe le nom du fonds à une série pandas indexée par date.
+    Un stock (ANR) est prolongé entre les propres dates de chaque fonds ; un flux
+    (distributions) ne l'est pas. La colonne "Total" somme les fonds disponibles
+    à chaque date.
+    """
+    if not contributions:
+        return pd.DataFrame(columns=["Total"])
+    consolidation = pd.concat(contributions, axis=1, sort=True)
+    if prolonger:
+        consolidation = consolidation.ffill(limit_area='inside')
+    consolidation["Total"] = consolidation.sum(axis=1, min_count=1)
+    consolidation.index.name = "Date"
+    return consolidation
+
+
+# === ROLL-FORWARD SUR UNE NOUVELLE VL ===
+def valeur_a_date(dates, valeurs, date):
+    """Valeur projetée à une date : dernier point de la grille antérieur ou égal à cette date"""
+    i = np.searchsorted(np.array(dates, dtype='datetime64[s]'), np.datetime64(date, 's'), side='right') - 1
+    return float(valeurs[max(i, 0)])
+
+
+def reporter_parametres(params, nouvelle_date, anr_reel, occurrences_echues="supprimer", courbes_fx=None):
+    """Rebaser des paramètres sur une nouvelle VL connue
+
+    Les occurrences multidates échues (date antérieure ou égale à la nouvelle VL) sont
+    supprimées, ou reportées sur le premier semestre suivant si `occurrences_echues`
+    vaut "reporter". Les événements sur les parts échus sont retirés et intégrés au
+    nombre de parts. Les actifs dont la variation S+1 est échue voient leur valeur
+    projetée devenir leur nouvelle valeur actuelle.
+    """
+    ancienne_date = datetime.strptime(params['date_vl_connue'], "%d/%m/%Y")
+    date_fin = datetime.strptime(params['date_fin_fonds'], "%d/%m/%Y")
+    anciennes_dates = generer_dates_semestres(ancienne_date, date_fin)
+    nouvelles_dates = generer_dates_semestres(nouvelle_date, date_fin)
+
+    nouveaux = copy.deepcopy(params)
+    nouveaux['date_vl_connue'] = nouvelle_date.strftime("%d/%m/%Y")
+    nouveaux['anr_derniere_vl'] = float(anr_reel)
+
+    # Occurrences multidates échues
+    for impact in nouveaux.get('impacts_multidates', []):
+        futures, total_echu = [], 0.0
+        for occurrence in impact.get('montants', []):
+            date_occurrence = lire_date(occurrence.get('date'))
+            if date_occurrence is not None and date_occurrence <= nouvelle_date:
+                total_echu += float(occurrence.get('montant', 0))
+            else:
+                futures.append(occurrence)
+        if occurrences_echues == "reporter" and total_echu and len(nouvelles_dates) > 1:
+            date_report = nouvelles_dates[1].strftime("%d/%m/%Y")
+            for occurrence in futures:
+                if occurrence.get('date') == date_report:
+                    occurrence['montant'] = float(occurrence.get('montant', 0)) + total_echu
+                    break
+            else:
+                futures.insert(0, {"date": date_report, "montant": total_echu})
+        impact['montants'] = futures
+
+    # Événements sur les parts échus : le nombre de parts devient celui projeté à la nouvelle date
+    evenements_futurs = []
+    for evenement in nouveaux.get('evenements_parts', []):
+        date_evenement = lire_date(evenement.get('date'))
+        if date_evenement is None or date_evenement > nouvelle_date:
+            evenements_futurs.append(evenement)
+    if len(evenements_futurs) != len(nouveaux.get('evenements_parts', [])):
+        resultat = calculer_projection(params, anciennes_dates, courbes_fx=courbes_fx)
+        nouveaux['nombre_parts'] = valeur_a_date(anciennes_dates, resultat['parts'], nouvelle_date)
+    nouveaux['evenements_parts'] = evenements_futurs
+
+    # Actifs dont la valorisation S+1 est désormais constatée dans l'ANR réel
+    if len(anciennes_dates) > 1 and anciennes_dates[1] <= nouvelle_date:
+        for actif in nouveaux.get('actifs', []):
+            actif['valeur_actuelle'] = actif.get('valeur_projetee', actif.get('valeur_actuelle', 0.0))
+            actif['variation'] = 0.0
+            actif['variation_brute'] = 0.0
+
+    return nouveaux
+
+
+# === BACKTESTING PRÉVU / RÉEL ===
+def previsions_en_lignes(resultat, **identifiants):
+    """Mettre une projection au format long : une ligne par date future et son horizon en semestres"""
+    n = len(resultat['dates'])
+    previsions = pd.DataFrame({
+        "date": pd.DatetimeIndex(resultat['dates']),
+        "horizon": np.arange(n),
+        "vl_prevue": resultat['vl'],
+        "anr_prevu": resultat['anr']
+    })
+    for nom, valeur in identifiants.items():
+        previsions[nom] = valeur
+    # Le point de départ est une VL connue, pas une prévision
+    return previsions.iloc[1:]
+
+
+def mesurer_precision(previsions, historique):
+    """Joindre les prévisions aux VL réelles et mesurer les erreurs par fonds, scénario et horizon
+
+    `previsions` regroupe les lignes de toutes les simulations, `historique` contient
+    les colonnes nom_fonds, date et vl. La jointure et les agrégats sont calculés en
+    une fois sur l'ensemble des simulations.
+    """
+    jointure = previsions.merge(historique[["nom_fonds", "date", "vl"]], on=["nom_fonds", "date"], how="inner")
+    jointure["erreur"] = jointure["vl_prevue"] - jointure["vl"]
+    jointure["erreur_abs"] = jointure["erreur"].abs()
+    jointure["erreur_carre"] = jointure["erreur"] ** 2
+    jointure["erreur_pct_abs"] = (jointure["erreur_abs"] / jointure["vl"].abs()).where(jointure["vl"] != 0) * 100
+
+    metriques = jointure.groupby(["nom_fonds", "nom_scenario", "horizon"]).agg(
+        observations=("erreur", "size"),
+        biais=("erreur", "mean"),
+        mae=("erreur_abs", "mean"),
+        mape=("erreur_pct_abs", "mean"),
+        mse=("erreur_carre", "mean")
+    )
+    metriques["rmse"] = np.sqrt(metriques.pop("mse"))
+    return jointure, metriques.reset_index()
+
+
+# === SENSIBILITÉ AU CHANGE ===
+def sensibilite_fx(params, devise, chocs, dates=None, sous_fonds=None, courbes_fx=None):
+    """VL et ANR finaux pour une série de chocs relatifs sur le cours projeté d'une devise
+
+    Les actifs et impacts ne sont pas ressaisis : seul le choc de change du
+    scénario (`chocs_fx`) varie d'une projection à l'autre.
+    """
+    lignes = []
+    for choc in chocs:
+        params_choques = {**params, "chocs_fx": {**(params.get('chocs_fx') or {}), devise: choc}}
+        resultat = calculer_projection(params_choques, dates, sous_fonds, courbes_fx)
+        lignes.append({"choc": choc, "vl_finale": resultat['vl'][-1], "anr_final": resultat['anr'][-1]})
+    return pd.DataFrame(lignes)
+
+
+# === SCÉNARIOS DÉRIVÉS (SURCHARGES D'UN SCÉNARIO PARENT) ===
+LISTES_NOMMEES = {"actifs": "nom", "impacts": "libelle", "impacts_multidates": "libelle"}
+CHAMPS_PROPRES = {"id", "nom_fonds", "nom_scenario", "date_creation", "commentaire", "commentaire_simulation",
+                  "scenario_parent", "surcharges", "resume"}
+
+
+def _surcharges_liste(avant, apres, identifiant):
+    """Éléments modifiés (champs changés), ajoutés et supprimés d'une liste identifiée par nom, ou None si ambiguë"""
+    noms_avant = [e.get(identifiant) for e in avant]
+    noms_apres = [e.get(identifiant) for e in apres]
+    if len(set(noms_avant)) != len(noms_avant) or len(set(noms_apres)) != len(noms_apres):
+        return None
+    par_nom = dict(zip(noms_avant, avant))
+    surcharges = {}
+    modifies = {}
+    for element in apres:
+        origine = par_nom.get(element.get(identifiant))
+        if origine is None:
+            surcharges.setdefault('ajoutes', []).append(element)
+            continue
+        # Un champ retiré est noté None
+        changes = {k: v for k, v in element.items() if origine.get(k) != v}
+        changes.update({k: None for k in origine if k not in element})
+        if changes:
+            modifies[element.get(identifiant)] = changes
+    if modifies:
+        surcharges['modifies'] = modifies
+    supprimes = [nom for nom in noms_avant if nom not in set(noms_apres)]
+    if supprimes:
+        surcharges['supprimes'] = supprimes
+    return surcharges
+
+
+def calculer_surcharges(parent, enfant):
+    """Différences d'une simulation sauvegardée par rapport à son scénario parent
+
+    Les champs simples qui diffèrent sont repris tels quels ; les actifs et les
+    impacts sont comparés par nom, seuls leurs champs modifiés étant conservés.
+    Une liste dont les noms ne sont pas uniques est reprise en entier.
+    """
+    surcharges = {}
+    champs = {k: v for k, v in enfant.items()
+              if k not in CHAMPS_PROPRES and k not in LISTES_NOMMEES and parent.get(k) != v}
+    for cle, identifiant in LISTES_NOMMEES.items():
+        surcharges_liste = _surcharges_liste(parent.get(cle, []), enfant.get(cle, []), identifiant)
+        if surcharges_liste is None:
+            champs[cle] = enfant.get(cle, [])
+        elif surcharges_liste:
+            surcharges[cle] = surcharges_liste
+    if champs:
+        surcharges['champs'] = champs
+    return surcharges
+
+
+def appliquer_surcharges(parent, surcharges):
+    """Simulation complète obtenue en appliquant des surcharges à son scénario parent"""
+    enfant = copy.deepcopy({k: v for k, v in parent.items() if k not in CHAMPS_PROPRES})
+    enfant.update(copy.deepcopy(surcharges.get('champs', {})))
+    for cle, identifiant in LISTES_NOMMEES.items():
+        surcharges_liste = surcharges.get(cle)
+        if not surcharges_liste:
+            continue
+        supprimes = set(surcharges_liste.get('supprimes', []))
+        modifies = surcharges_liste.get('modifies', {})
+        elements = []
+        for element in enfant.get(cle, []):
+            nom = element.get(identifiant)
+            if nom in supprimes:
+                continue
+            for champ, valeur in modifies.get(nom, {}).items():
+                if valeur is None:
+                    element.pop(champ, None)
+                else:
+                    element[champ] = copy.deepcopy(valeur)
+            elements.append(element)
+        elements.extend(copy.deepcopy(surcharges_liste.get('ajoutes', [])))
+        enfant[cle] = elements
+    return enfant
+
+
+# === RECALCUL INCRÉMENTAL ===
+CHAMPS_SANS_CALCUL = {"nom_fonds", "nom_scenario", "commentaire_simulation", "scenario_parent"}
+
+
+def _premiere_date_differente(anciennes, nouvelles):
+    """Date la plus ancienne parmi les éléments datés dont le nombre d'occurrences diffère entre les deux listes
+
+    Les listes sont comparées comme des multiensembles : une occurrence déplacée
+    sur la date d'une occurrence identique compte comme une modification.
+    """
+    anciens_comptes = Counter(json_canonique(e) for e in anciennes)
+    nouveaux_comptes = Counter(json_canonique(e) for e in nouvelles)
+    differents = {cle for cle in anciens_comptes | nouveaux_comptes if anciens_comptes[cle] != nouveaux_comptes[cle]}
+    dates = [lire_date(e.get('date')) for e in list(anciennes) + list(nouvelles) if json_canonique(e) in differents]
+    if None in dates:
+        return datetime.min
+    return min(dates) if dates else None
+
+
+def json_canonique(valeur):
+    """Représentation stable d'une valeur JSON, pour comparer des éléments sans tenir compte de l'ordre des clés"""
+    return json.dumps(valeur, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def empreinte_calcul(params):
+    """Empreinte des seuls paramètres utiles au calcul : deux jeux de même empreinte ont la même projection"""
+    contenu = {cle: valeur for cle, valeur in params.items() if cle not in CHAMPS_SANS_CALCUL}
+    return hashlib.sha256(json_canonique(contenu).encode('utf-8')).hexdigest()
+
+
+def premiere_periode_modifiee(anciens, nouveaux, dates):
+    """Première période dont le calcul est affecté par le passage de `anciens` à `nouveaux`
+
+    Les occurrences multidates et les événements sur les parts n'affectent l'ANR
+    qu'à partir de leur date ; toute autre modification (dates, ANR et parts
+    initiaux, actifs, impacts récurrents, fiscalité, change) impose un recalcul
+    complet, de même que la détention d'un fonds en transparence, dont la projection
+    peut changer sans que les paramètres changent. Retourne len(dates) si rien n'a changé.
+    """
+    if anciens is None:
+        return 0
+    if any(a.get('type') == 'fonds' for a in nouveaux.get('actifs', [])):
+        return 0
+    cles = (set(anciens) | set(nouveaux)) - CHAMPS_SANS_CALCUL - {"impacts_multidates", "evenements_parts"}
+    if any(json_canonique(anciens.get(cle)) != json_canonique(nouveaux.get(cle)) for cle in cles):
+        return 0
+
+    premieres_dates = [_premiere_date_differente(anciens.get('evenements_parts', []), nouveaux.get('evenements_parts', []))]
+    anciens_impacts = anciens.get('impacts_multidates', [])
+    nouveaux_impacts = nouveaux.get('impacts_multidates', [])
+    if len(anciens_impacts) != len(nouveaux_impacts):
+        return 0
+    for ancien, nouveau in zip(anciens_impacts, nouveaux_impacts):
+        if ancien.get('devise') != nouveau.get('devise'):
+            return 0
+        premieres_dates.append(_premiere_date_differente(ancien.get('montants', []), nouveau.get('montants', [])))
+
+    premieres_dates = [d for d in premieres_dates if d is not None]
+    if not premieres_dates:
+        return len(dates)
+    return int(np.searchsorted(np.array(dates, dtype='datetime64[s]'), np.datetime64(min(premieres_dates), 's')))
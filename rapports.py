@@ -0,0 +1,617 @@
+"""Rapports PDF des simulations sauvegardées : un document par fonds ou un document consolidé
+
+Utilisable depuis l'interface ou en ligne de commande :
+    python rapports.py [--consolide] [--fonds NOM ...] [--sortie data/rapports]
+"""
+import argparse
+import hashlib
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import matplotlib.ticker as ticker
+import xlsxwriter
+from pptx import Presentation
+from pptx.dml.color import RGBColor
+from pptx.enum.text import PP_ALIGN
+from pptx.util import Inches, Pt
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.platypus import Image, PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from moteur import calculer_projection, projeter_sous_fonds, json_canonique, resumer_projection
+from stockage import (lire_simulation, dernieres_versions, charger_courbes_fx, ecrire_atomique, lire_index,
+                      lire_enregistrement, ecrire_enregistrements)
+from taches import traitement
+
+COULEUR_BLEUE = "#0000DC"
+REPERTOIRE_RAPPORTS = 'data/rapports'
+REPERTOIRE_CACHE_GRAPHIQUES = 'data/cache_graphiques'
+TAILLE_LOT_SYNTHESES = 200
+
+
+def format_fr_euro(valeur):
+    """Formater un nombre en euros format français"""
+    try:
+        valeur_arrondie = round(float(valeur), 2)
+        return f"{valeur_arrondie:,.2f} €".replace(",", " ").replace(".", ",")
+    except (ValueError, TypeError):
+        return "0,00 €"
+
+
+# === GRAPHIQUES ===
+def figure_vl(dates, vl, nom_fonds):
+    """Graphique matplotlib de la VL, réservé aux exports (PowerPoint, PDF)"""
+    couleur_bleue = COULEUR_BLEUE
+
+    fig, ax = plt.subplots(figsize=(10, 5))
+
+    # Courbe
+    ax.plot(
+        dates,
+        vl,
+        linewidth=2.5,
+        marker='o',
+        markersize=7,
+        color=couleur_bleue,
+        markerfacecolor=couleur_bleue,  # Points remplis de couleur bleue
+        markeredgewidth=1,
+        markeredgecolor=couleur_bleue
+    )
+
+    # Annotations de chaque point
+    for i, txt in enumerate(vl):
+        # S'assurer que chaque valeur est arrondie à 2 décimales
+        txt_arrondi = round(txt, 2)
+        ax.annotate(
+            format_fr_euro(txt_arrondi),
+            (dates[i], vl[i]),
+            textcoords="offset points",
+            xytext=(0, 10),
+            ha='center',
+            fontsize=9,
+            color='white',
+            bbox=dict(boxstyle="round,pad=0.3", fc=couleur_bleue, ec=couleur_bleue, alpha=0.9)
+        )
+
+    # Titres et axes
+    ax.set_title(f"Atterrissage VL - {nom_fonds}", fontsize=16, fontweight='bold', color=couleur_bleue, pad=20)
+    ax.set_ylabel("VL (€)", fontsize=12, color=couleur_bleue)
+
+    # Ticks
+    ax.set_xticks(dates)
+    ax.set_xticklabels(
+        [d.strftime('%b-%y').capitalize() for d in dates],
+        rotation=45,
+        ha='right',
+        fontsize=10,
+        color=couleur_bleue
+    )
+    ax.tick_params(axis='y', labelcolor=couleur_bleue)
+
+    ax.yaxis.set_major_formatter(
+        ticker.FuncFormatter(lambda x, _: f"{round(x, 2):,.2f} €".replace(",", " ").replace(".", ","))
+    )
+
+    # Fond
+    fig.patch.set_facecolor('white')
+    ax.set_facecolor('white')
+
+    # Supprimer les contours inutiles
+    ax.spines['right'].set_visible(False)
+    ax.spines['top'].set_visible(False)
+    return fig
+
+
+def graphique_en_cache(dates, vl, nom_fonds):
+    """Chemin de l'image PNG du graphique de VL, rendue une seule fois pour une même série
+
+    L'image est nommée d'après l'empreinte de la série : une simulation inchangée
+    entre deux rapports, ou identique à une autre, réutilise le même fichier.
+    """
+    contenu = json_canonique([nom_fonds, [d.strftime('%Y-%m-%d') for d in dates], [round(float(v), 6) for v in vl]])
+    chemin = os.path.join(REPERTOIRE_CACHE_GRAPHIQUES, hashlib.sha256(contenu.encode('utf-8')).hexdigest() + '.png')
+    if not os.path.exists(chemin):
+        os.makedirs(REPERTOIRE_CACHE_GRAPHIQUES, exist_ok=True)
+        fig = figure_vl(dates, vl, nom_fonds)
+        temporaire = f"{chemin}.{os.getpid()}.png"
+        fig.savefig(temporaire, dpi=150, bbox_inches='tight')
+        plt.close(fig)
+        os.replace(temporaire, chemin)
+    return chemin
+
+
+# === PROJECTION DES SIMULATIONS SAUVEGARDÉES ===
+def projeter_enregistrement(simulation_id, versions, courbes_fx, sous_fonds=None):
+    """Lire une simulation sauvegardée, résolue sur son scénario parent, et la projeter ; retourne (paramètres, projection)
+
+    `sous_fonds` mémorise les projections des fonds détenus en transparence et
+    peut être partagé entre plusieurs simulations d'un même traitement.
+    """
+    resolutions = {}
+
+    def charger(identifiant):
+        try:
+            return lire_simulation(identifiant, versions, resolutions)
+        except (OSError, ValueError):
+            return None
+
+    params = lire_simulation(simulation_id, versions, resolutions)
+    sous_fonds = projeter_sous_fonds(params, charger, sous_fonds, courbes_fx)
+    return params, calculer_projection(params, sous_fonds=sous_fonds, courbes_fx=courbes_fx)
+
+
+# === CONTENU DES RAPPORTS ===
+def preparer_section(simulation_id, versions=None, courbes_fx=None):
+    """Projeter une simulation sauvegardée et rassembler le contenu de sa section de rapport"""
+    versions = dernieres_versions() if versions is None else versions
+    courbes_fx = charger_courbes_fx() if courbes_fx is None else courbes_fx
+    params, resultat = projeter_enregistrement(simulation_id, versions, courbes_fx)
+    return {
+        "nom_fonds": params.get('nom_fonds', 'Fonds sans nom'),
+        "nom_scenario": params.get('nom_scenario', 'Base case'),
+        "date_vl_connue": params.get('date_vl_connue'),
+        "commentaire_simulation": params.get('commentaire_simulation', ''),
+        "anr_initial": float(params.get('anr_derniere_vl', 0.0)),
+        "parts_initiales": float(params.get('nombre_parts', 0.0)),
+        "dates": list(resultat['dates']),
+        "vl": [float(v) for v in resultat['vl']],
+        "anr": [float(v) for v in resultat['anr']],
+        "distributions": [float(v) for v in resultat['distributions']],
+        "actifs": [{
+            "nom": actif.get('nom', 'Sans nom'),
+            "type": actif.get('type', 'direct'),
+            "pct_detention": actif.get('pct_detention', 1.0),
+            "valeur_actuelle": actif.get('valeur_actuelle'),
+            "valeur_projetee": actif.get('valeur_projetee'),
+            "devise": actif.get('devise', 'EUR')
+        } for actif in params.get('actifs', [])],
+        "graphique": graphique_en_cache(resultat['dates'], resultat['vl'], params.get('nom_fonds', 'Fonds sans nom'))
+    }
+
+
+def _tableau(lignes, largeurs):
+    tableau = Table(lignes, colWidths=largeurs, repeatRows=1)
+    tableau.setStyle(TableStyle([
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor(COULEUR_BLEUE)),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#F0F0F0')),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+        ('LINEBELOW', (0, 0), (-1, 0), 0.5, colors.HexColor(COULEUR_BLEUE)),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#F8F8FC')]),
+    ]))
+    return tableau
+
+
+def elements_section(section, styles):
+    """Éléments reportlab d'une section : en-tête, chiffres clés, commentaire, graphique, projection et actifs"""
+    titre = styles['Title'].clone('TitreSection', textColor=colors.HexColor(COULEUR_BLEUE))
+    sous_titre = styles['Heading2'].clone('SousTitreSection', textColor=colors.HexColor(COULEUR_BLEUE))
+    vl_initiale = section['anr_initial'] / section['parts_initiales'] if section['parts_initiales'] else 0.0
+    vl_finale = section['vl'][-1] if section['vl'] else 0.0
+    variation = (vl_finale / vl_initiale - 1) * 100 if vl_initiale else 0.0
+
+    elements = [
+        Paragraph(f"Atterrissage VL - {escape(section['nom_fonds'])}", titre),
+        Paragraph(f"Scénario : {escape(section['nom_scenario'])} — VL connue au {section['date_vl_connue']}",
+                  styles['Normal']),
+        Spacer(1, 0.3 * cm),
+        Paragraph(
+            f"VL initiale : <b>{format_fr_euro(vl_initiale)}</b> — VL finale : <b>{format_fr_euro(vl_finale)}</b> — "
+            f"Variation : <b>{variation:+.2f} %</b>".replace(".", ","),
+            styles['Normal']
+        ),
+    ]
+    if section['commentaire_simulation']:
+        elements += [Spacer(1, 0.3 * cm), Paragraph("Commentaire", sous_titre),
+                     Paragraph(escape(section['commentaire_simulation']).replace("\n", "<br/>"), styles['Normal'])]
+    elements += [Spacer(1, 0.3 * cm), Image(section['graphique'], width=22 * cm, height=11 * cm, kind='proportional')]
+
+    lignes = [["Date", "VL prévisionnelle", "ANR", "Distributions"]]
+    for date, vl, anr, distribution in zip(section['dates'], section['vl'], section['anr'], section['distributions']):
+        lignes.append([date.strftime('%d/%m/%Y'), format_fr_euro(vl), format_fr_euro(anr), format_fr_euro(distribution)])
+    elements += [PageBreak(), Paragraph("Projection", sous_titre), _tableau(lignes, [3 * cm, 5 * cm, 6 * cm, 5 * cm])]
+
+    if section['actifs']:
+        lignes = [["Actif", "Type", "Détention", "Valeur actuelle", "Valeur projetée", "Devise"]]
+        for actif in section['actifs']:
+            lignes.append([
+                actif['nom'], "Fonds en transparence" if actif['type'] == 'fonds' else "Direct",
+                f"{float(actif['pct_detention']) * 100:.2f} %".replace(".", ","),
+                "" if actif['type'] == 'fonds' else format_fr_euro(actif['valeur_actuelle']),
+                "" if actif['type'] == 'fonds' else format_fr_euro(actif['valeur_projetee']),
+                actif['devise']
+            ])
+        elements += [Spacer(1, 0.5 * cm), Paragraph("Actifs", sous_titre),
+                     _tableau(lignes, [6 * cm, 4 * cm, 2.5 * cm, 4 * cm, 4 * cm, 2 * cm])]
+    return elements
+
+
+def ecrire_pdf(sections, destination, titre):
+    """Écrire un document PDF composé d'une section par simulation"""
+    styles = getSampleStyleSheet()
+    document = SimpleDocTemplate(destination, pagesize=landscape(A4), title=titre,
+                                 leftMargin=1.5 * cm, rightMargin=1.5 * cm, topMargin=1.5 * cm, bottomMargin=1.5 * cm)
+    elements = []
+    for section in sections:
+        if elements:
+            elements.append(PageBreak())
+        elements += elements_section(section, styles)
+    document.build(elements)
+    return destination
+
+
+# === GÉNÉRATION PAR LOTS ===
+def _nom_fichier(texte):
+    return "".join(c if c.isalnum() or c in " -_" else "_" for c in texte).strip()
+
+
+def rapport_fonds(nom_fonds, simulation_ids, repertoire, versions, courbes_fx):
+    """Écrire le rapport d'un fonds (une section par scénario) ; exécuté dans un processus de travail"""
+    sections = [preparer_section(simulation_id, versions, courbes_fx) for simulation_id in simulation_ids]
+    destination = os.path.join(
+        repertoire, f"{datetime.now().strftime('%Y%m%d')} - Rapport VL - {_nom_fichier(nom_fonds)}.pdf"
+    )
+    return ecrire_pdf(sections, destination, f"Atterrissage VL - {nom_fonds}")
+
+
+def generer_rapports(fonds=None, consolide=False, repertoire=REPERTOIRE_RAPPORTS, max_workers=None,
+                     progression=None):
+    """Générer les rapports PDF de la dernière version de chaque scénario sauvegardé ; retourne les fichiers écrits
+
+    `fonds` limite les rapports aux fonds indiqués. Les simulations sont projetées
+    et leurs graphiques rendus dans des processus de travail en parallèle ; en
+    mode `consolide`, les sections sont ensuite réunies dans un seul document.
+    `progression(faites, total)` est appelée à chaque document ou section terminé ;
+    une exception qu'elle lève abandonne les travaux restants.
+    """
+    os.makedirs(repertoire, exist_ok=True)
+    versions = dernieres_versions()
+    courbes_fx = charger_courbes_fx()
+    par_fonds = {}
+    for (nom_fonds, nom_scenario), version in sorted(versions.items()):
+        if fonds is None or nom_fonds in fonds:
+            par_fonds.setdefault(nom_fonds, []).append(version['id'])
+    if not par_fonds:
+        return []
+
+    executeur = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        if consolide:
+            ids = [simulation_id for ids_fonds in par_fonds.values() for simulation_id in ids_fonds]
+            travaux = {executeur.submit(preparer_section, simulation_id, versions, courbes_fx): i
+                       for i, simulation_id in enumerate(ids)}
+        else:
+            travaux = {executeur.submit(rapport_fonds, nom_fonds, ids, repertoire, versions, courbes_fx): i
+                       for i, (nom_fonds, ids) in enumerate(par_fonds.items())}
+        resultats = [None] * len(travaux)
+        for faites, travail in enumerate(as_completed(travaux), start=1):
+            resultats[travaux[travail]] = travail.result()
+            if progression:
+                progression(faites, len(travaux))
+    finally:
+        executeur.shutdown(cancel_futures=True)
+    if not consolide:
+        return resultats
+    sections = resultats
+    destination = os.path.join(repertoire, f"{datetime.now().strftime('%Y%m%d')} - Rapport VL consolidé.pdf")
+    return [ecrire_pdf(sections, destination, "Atterrissage VL - Rapport consolidé")]
+
+
+
+# === CLASSEUR EXCEL MULTI-SCÉNARIOS ===
+CARACTERES_INTERDITS_FEUILLE = set('[]:*?/\\')
+SERIES_MAX_GRAPHIQUE = 255  # Limite d'Excel par graphique
+
+
+def nom_feuille(nom_fonds, nom_scenario, utilises):
+    """Nom de feuille Excel unique d'au plus 31 caractères, sans les caractères interdits par Excel"""
+    base = "".join("_" if c in CARACTERES_INTERDITS_FEUILLE else c for c in f"{nom_fonds} - {nom_scenario}")[:31].strip("'")
+    nom, suffixe = base, 2
+    while nom.lower() in utilises:
+        nom = f"{base[:31 - len(str(suffixe)) - 1]}~{suffixe}"
+        suffixe += 1
+    utilises.add(nom.lower())
+    return nom
+
+
+def exporter_classeur(simulation_ids, destination, progression=None):
+    """Écrire un classeur Excel avec une feuille par simulation, une synthèse et un graphique comparatif
+
+    Le classeur est écrit en mode `constant_memory` : chaque ligne est envoyée sur
+    disque dès que la suivante commence, et chaque simulation est projetée puis
+    libérée avant la suivante, si bien que la mémoire ne croît pas avec le nombre
+    de scénarios. `progression(faites, total)` est appelée après chaque simulation.
+    Retourne la liste des erreurs (simulation non exportée et motif).
+    """
+    versions = dernieres_versions()
+    courbes_fx = charger_courbes_fx()
+    erreurs = []
+
+    workbook = xlsxwriter.Workbook(destination, {'constant_memory': True, 'nan_inf_to_errors': True})
+    try:
+        _ecrire_classeur(workbook, simulation_ids, versions, courbes_fx, erreurs, progression)
+    finally:
+        workbook.close()
+    return erreurs
+
+
+def _ecrire_classeur(workbook, simulation_ids, versions, courbes_fx, erreurs, progression):
+    sous_fonds = {}
+    en_tete = workbook.add_format({'bold': True, 'font_color': COULEUR_BLEUE, 'bg_color': '#F0F0F0', 'align': 'center'})
+    titre = workbook.add_format({'bold': True, 'font_size': 16, 'font_color': COULEUR_BLEUE})
+    format_date = workbook.add_format({'num_format': 'dd/mm/yyyy'})
+    format_euro = workbook.add_format({'num_format': '#,##0.00 €;[Red]-#,##0.00 €'})
+    format_nombre = workbook.add_format({'num_format': '#,##0.00;[Red]-#,##0.00'})
+    format_pct = workbook.add_format({'num_format': '+0.00%;[Red]-0.00%'})
+    format_lien = workbook.add_format({'font_color': 'blue', 'underline': 1})
+
+    # La synthèse est créée en premier pour être la première feuille ; ses lignes sont écrites au fil de l'eau
+    synthese = workbook.add_worksheet('Synthèse')
+    synthese.hide_gridlines(2)
+    synthese.write(0, 0, "Atterrissage VL - Synthèse des scénarios", titre)
+    colonnes_synthese = ["Fonds", "Scénario", "Date VL", "VL initiale", "VL finale", "Variation", "ANR final", "Feuille"]
+    for colonne, libelle in enumerate(colonnes_synthese):
+        synthese.write(2, colonne, libelle, en_tete)
+    synthese.set_column(0, 1, 24)
+    synthese.set_column(2, 7, 16)
+
+    graphique = workbook.add_chart({'type': 'scatter', 'subtype': 'straight_with_markers'})
+    nb_series = 0
+    noms_utilises = {'synthèse'}
+    ligne_synthese = 3
+    total = len(simulation_ids)
+    for faites, simulation_id in enumerate(simulation_ids, start=1):
+        try:
+            params, resultat = projeter_enregistrement(simulation_id, versions, courbes_fx, sous_fonds)
+        except (OSError, ValueError, KeyError) as e:
+            erreurs.append(f"{simulation_id} : {str(e)}")
+            if progression:
+                progression(faites, total)
+            continue
+        nom_fonds = params.get('nom_fonds', 'Fonds sans nom')
+        nom_scenario = params.get('nom_scenario', 'Base case')
+        feuille = workbook.add_worksheet(nom_feuille(nom_fonds, nom_scenario, noms_utilises))
+        feuille.hide_gridlines(2)
+
+        colonnes = ([f"Actif - {nom}" for nom, _ in resultat['actifs']]
+                    + [f"Impact récurrent - {libelle}" for libelle, _ in resultat['impacts']]
+                    + [f"Impact multidate - {libelle}" for libelle, _ in resultat['impacts_multidates']]
+                    + ["VL prévisionnelle (€)", "ANR (€)", "Distributions (€)"])
+        series = ([serie for _, serie in resultat['actifs']] + [serie for _, serie in resultat['impacts']]
+                  + [serie for _, serie in resultat['impacts_multidates']]
+                  + [resultat['vl'], resultat['anr'], resultat['distributions']])
+        feuille.write(0, 0, f"Atterrissage VL - {nom_fonds} - {nom_scenario}", titre)
+        feuille.write(2, 0, "Date", en_tete)
+        for colonne, libelle in enumerate(colonnes, start=1):
+            feuille.write(2, colonne, libelle, en_tete)
+        feuille.set_column(0, 0, 12)
+        feuille.set_column(1, len(colonnes), 20)
+        for i, date in enumerate(resultat['dates']):
+            feuille.write_datetime(3 + i, 0, date, format_date)
+            for colonne, serie in enumerate(series, start=1):
+                feuille.write_number(3 + i, colonne, float(serie[i]), format_euro)
+
+        # Série du graphique comparatif : dates et VL lues dans la feuille du scénario
+        derniere = 2 + len(resultat['dates'])
+        colonne_vl = len(colonnes) - 2
+        if nb_series < SERIES_MAX_GRAPHIQUE:
+            nb_series += 1
+            graphique.add_series({
+                'name': f"{nom_fonds} - {nom_scenario}",
+                'categories': [feuille.name, 3, 0, derniere, 0],
+                'values': [feuille.name, 3, colonne_vl, derniere, colonne_vl],
+                'marker': {'type': 'circle', 'size': 5},
+            })
+
+        vl_initiale = float(params['anr_derniere_vl']) / float(params['nombre_parts']) if params.get('nombre_parts') else 0.0
+        vl_finale = float(resultat['vl'][-1])
+        synthese.write(ligne_synthese, 0, nom_fonds)
+        synthese.write(ligne_synthese, 1, nom_scenario)
+        synthese.write(ligne_synthese, 2, params.get('date_vl_connue'))
+        synthese.write_number(ligne_synthese, 3, vl_initiale, format_nombre)
+        synthese.write_number(ligne_synthese, 4, vl_finale, format_nombre)
+        synthese.write_number(ligne_synthese, 5, vl_finale / vl_initiale - 1 if vl_initiale else 0.0, format_pct)
+        synthese.write_number(ligne_synthese, 6, float(resultat['anr'][-1]), format_euro)
+        synthese.write_url(ligne_synthese, 7, f"internal:'{feuille.name}'!A1", format_lien, feuille.name)
+        ligne_synthese += 1
+        if progression:
+            progression(faites, total)
+
+    graphique.set_title({'name': 'Comparaison des VL prévisionnelles',
+                         'name_font': {'size': 14, 'color': COULEUR_BLEUE, 'bold': True}})
+    graphique.set_x_axis({'num_format': 'mmm-yy', 'num_font': {'rotation': 45},
+                          'major_gridlines': {'visible': False}})
+    graphique.set_y_axis({'name': 'VL (€)', 'num_format': '#,##0.00 "€"',
+                          'major_gridlines': {'visible': True, 'line': {'color': '#E0E0E0', 'width': 0.5}}})
+    graphique.set_legend({'position': 'bottom'})
+    graphique.set_size({'width': 900, 'height': 480})
+    synthese.insert_chart(ligne_synthese + 2, 0, graphique)
+
+
+
+# === PRÉSENTATION POWERPOINT ===
+def ecrire_presentation(destination, nom_fonds, nom_scenario, dates, vl, vl_initiale, date_debut, date_fin):
+    """Écrire la diapositive de synthèse d'une projection : graphique de VL et chiffres clés"""
+    repertoire = os.path.dirname(destination) or '.'
+    # Graphique écrit à côté de la présentation, propre à chaque export
+    chemin_graphique = os.path.join(repertoire, f"graphique_{uuid.uuid4().hex}.png")
+    fig = figure_vl(dates, vl, nom_fonds)
+    fig.savefig(chemin_graphique, dpi=300, bbox_inches='tight')
+    plt.close(fig)
+
+    # Créer une présentation PowerPoint simple et propre
+    prs = Presentation()
+    # Utiliser un layout avec un titre et du contenu
+    slide_layout = prs.slide_layouts[1]  # Layout avec titre et contenu
+    slide = prs.slides.add_slide(slide_layout)
+
+    # Définir la couleur bleue pour les éléments
+    couleur_bleue_rgb = RGBColor.from_string(COULEUR_BLEUE.lstrip('#'))
+
+    # Configurer le titre de la diapositive
+    title = slide.shapes.title
+    title.text = f"Atterrissage VL - {nom_fonds}"
+    title.text_frame.paragraphs[0].font.color.rgb = couleur_bleue_rgb
+    title.text_frame.paragraphs[0].font.bold = True
+
+    # Ajouter l'image du graphique
+    slide.shapes.add_picture(chemin_graphique, Inches(1), Inches(1.5), width=Inches(8))
+    os.remove(chemin_graphique)
+
+    # Ajouter un rectangle pour les informations clés
+    info_left = Inches(1)
+    info_top = Inches(5.5)
+    info_width = Inches(8)
+    info_height = Inches(1)
+
+    info_box = slide.shapes.add_shape(
+        1,  # Rectangle
+        info_left, info_top, info_width, info_height
+    )
+    info_box.fill.solid()
+    info_box.fill.fore_color.rgb = RGBColor(240, 240, 240)  # Gris très clair
+    info_box.line.color.rgb = couleur_bleue_rgb
+
+    # Ajouter le texte des informations clés
+    info_text = slide.shapes.add_textbox(
+        info_left + Inches(0.2),
+        info_top + Inches(0.1),
+        info_width - Inches(0.4),
+        info_height - Inches(0.2)
+    )
+
+    info_frame = info_text.text_frame
+    info_frame.word_wrap = True
+
+    # Créer un paragraphe pour chaque information clé
+    p1 = info_frame.add_paragraph()
+    p1.text = f"VL {date_debut}: {format_fr_euro(vl_initiale)}"
+    p1.font.bold = True
+    p1.font.color.rgb = couleur_bleue_rgb
+
+    p2 = info_frame.add_paragraph()
+    vl_finale = vl[-1] if vl else 0
+    p2.text = f"VL {date_fin}: {format_fr_euro(vl_finale)}"
+    p2.font.bold = True
+    p2.font.color.rgb = couleur_bleue_rgb
+
+    # Calcul de la variation
+    variation_pct = ((vl_finale / vl_initiale) - 1) * 100 if vl_initiale != 0 else 0
+
+    p3 = info_frame.add_paragraph()
+
+    # Formater le texte selon que la variation est positive ou négative
+    if variation_pct > 0:
+        p3.text = f"Variation: +{variation_pct:.2f}%"
+        p3.font.color.rgb = RGBColor(0, 128, 0)  # Vert
+    elif variation_pct < 0:
+        p3.text = f"Variation: {variation_pct:.2f}%"
+        p3.font.color.rgb = RGBColor(192, 0, 0)  # Rouge
+    else:
+        p3.text = f"Variation: 0.00%"
+        p3.font.color.rgb = couleur_bleue_rgb
+
+    p3.font.bold = True
+
+    # Ajouter un pied de page avec la date
+    footer = slide.shapes.add_textbox(
+        Inches(0.5), Inches(6.8),
+        Inches(9), Inches(0.3)
+    )
+
+    footer_frame = footer.text_frame
+    footer_p = footer_frame.add_paragraph()
+    footer_p.text = f"Document généré le {datetime.now().strftime('%d/%m/%Y')} - {nom_scenario}"
+    footer_p.font.italic = True
+    footer_p.font.size = Pt(9)
+    footer_p.alignment = PP_ALIGN.RIGHT
+
+    prs.save(destination)
+    return destination
+
+
+# === TRAITEMENTS EN TÂCHE DE FOND ===
+@traitement("presentation")
+def tache_presentation(parametres, repertoire, suivi):
+    """Présentation PowerPoint de la projection en cours (paramètres sérialisés par l'interface)"""
+    dates = [datetime.strptime(date, "%Y-%m-%d") for date in parametres['dates']]
+    destination = os.path.join(
+        repertoire, f"{datetime.now().strftime('%Y%m%d')} - Atterrissage VL - {_nom_fichier(parametres['nom_fonds'])}.pptx"
+    )
+    ecrire_presentation(destination, parametres['nom_fonds'], parametres['nom_scenario'], dates, parametres['vl'],
+                        parametres['vl_initiale'], parametres['date_debut'], parametres['date_fin'])
+    suivi.avancer(1, 1)
+    return {"fichiers": [destination]}
+
+
+@traitement("rapports_pdf")
+def tache_rapports_pdf(parametres, repertoire, suivi):
+    """Rapports PDF des fonds choisis, un par fonds ou consolidé"""
+    return {"fichiers": generer_rapports(parametres.get('fonds'), parametres.get('consolide', False), repertoire,
+                                         progression=suivi.avancer)}
+
+
+# === SYNTHÈSES ===
+def completer_syntheses(progression=None):
+    """Calculer et sauvegarder la synthèse des simulations qui n'en ont pas (importées, restaurées ou antérieures)
+
+    Retourne la liste des erreurs ; l'index n'est réécrit qu'une fois par lot.
+    """
+    index = lire_index()
+    a_completer = [simulation_id for simulation_id, entree in index.items()
+                   if 'erreur' not in entree and not entree.get('resume')]
+    versions = dernieres_versions(index)
+    courbes_fx = charger_courbes_fx()
+    sous_fonds = {}
+    erreurs = []
+    lot = []
+    for i, simulation_id in enumerate(a_completer):
+        try:
+            _, resultat = projeter_enregistrement(simulation_id, versions, courbes_fx, sous_fonds)
+            enregistrement = lire_enregistrement(simulation_id)
+            enregistrement['resume'] = resumer_projection(resultat)
+            lot.append((enregistrement, index[simulation_id]))
+        except (OSError, ValueError, KeyError) as e:
+            erreurs.append(f"{index[simulation_id].get('nom_fonds')} - {index[simulation_id].get('nom_scenario')}: {str(e)}")
+        if len(lot) >= TAILLE_LOT_SYNTHESES:
+            ecrire_enregistrements(lot)
+            lot = []
+        if progression is not None:
+            progression(i + 1, len(a_completer))
+    if lot:
+        ecrire_enregistrements(lot)
+    return erreurs
+
+
+@traitement("syntheses")
+def tache_syntheses(parametres, repertoire, suivi):
+    """Synthèses manquantes des simulations sauvegardées"""
+    return {"fichiers": [], "erreurs": completer_syntheses(progression=suivi.avancer)}
+
+
+@traitement("classeur_excel")
+def tache_classeur_excel(parametres, repertoire, suivi):
+    """Classeur Excel multi-scénarios des simulations choisies"""
+    destination = os.path.join(repertoire, f"{datetime.now().strftime('%Y%m%d')} - Atterrissage VL.xlsx")
+    erreurs = exporter_classeur(parametres['simulation_ids'], destination, progression=suivi.avancer)
+    return {"fichiers": [destination], "erreurs": erreurs}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Générer les rapports PDF des simulations sauvegardées")
+    parser.add_argument("--consolide", action="store_true", help="un seul document pour tous les fonds")
+    parser.add_argument("--fonds", nargs="*", help="fonds à inclure (tous par défaut)")
+    parser.add_argument("--sortie", default=REPERTOIRE_RAPPORTS, help="répertoire des rapports")
+    parser.add_argument("--processus", type=int, default=None, help="nombre de processus de travail")
+    arguments = parser.parse_args()
+    for fichier in generer_rapports(arguments.fonds, arguments.consolide, arguments.sortie, arguments.processus):
+        print(fichier)
@@ -0,0 +1,280 @@
+"""Service HTTP local de projection, pour les outils internes qui ne passent pas par l'interface
+
+    python service.py [--port 8502] [--processus N]
+
+Le service n'écoute que sur 127.0.0.1. Les simulations sont échangées au format
+des fichiers importés (voir `stockage.valider_simulation`) ; les fonds détenus en
+transparence et les scénarios parents sont lus dans le stockage.
+
+- POST /projection : projeter une simulation
+- POST /lots : projeter un lot, {"simulations": [...], "simulation_ids": [...]}
+- GET /simulations : index des simulations, paginé (?texte=&page=&taille=)
+- GET /simulations/{id} : simulation sauvegardée, résolue sur son scénario parent
+- POST /simulations : sauvegarder une simulation ; retourne son identifiant
+- GET /mesures : nombre de requêtes, d'erreurs et latences par route
+
+Les projections, coûteuses en calcul, sont faites dans un pool de processus ;
+la boucle asynchrone ne fait que les lectures et écritures du stockage.
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import numpy as np
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from moteur import calculer_projection, projeter_sous_fonds, resumer_projection
+from stockage import (valider_simulation, resoudre_simulation, lire_simulation, dernieres_versions, lire_index,
+                      charger_courbes_fx, ecrire_enregistrement, empreinte, nettoyer_nom_fonds)
+
+PORT_DEFAUT = 8502
+TAILLE_PAGE_DEFAUT = 50
+TAILLE_PAGE_MAX = 500
+NB_MESURES = 1000  # latences conservées par route pour les centiles
+
+
+class ErreurRequete(Exception):
+    """Requête invalide : retournée au client avec le code HTTP indiqué"""
+
+    def __init__(self, erreurs, statut=400):
+        super().__init__(" ; ".join(erreurs))
+        self.erreurs = erreurs
+        self.statut = statut
+
+
+# === PROJECTIONS (PROCESSUS DU POOL) ===
+def projection_en_json(resultat):
+    """Séries d'une projection, sérialisables en JSON"""
+    return {
+        "dates": [date.strftime('%d/%m/%Y') for date in resultat['dates']],
+        **{serie: np.asarray(resultat[serie], dtype=float).tolist()
+           for serie in ["anr", "parts", "vl", "distributions", "valeur_totale_par_part"]},
+        "resume": resumer_projection(resultat)
+    }
+
+
+def projeter_elements(elements):
+    """Projeter une partie d'un lot : chaque élément est {"simulation": ...} ou {"id": ...}
+
+    Retourne, dans l'ordre, {"projection": ...} ou {"erreurs": [...]} pour chaque élément.
+    L'index, les courbes de change et les sous-fonds sont lus une fois pour toute la partie.
+    """
+    versions = dernieres_versions()
+    courbes_fx = charger_courbes_fx()
+    resolutions, sous_fonds = {}, {}
+
+    def charger(identifiant):
+        try:
+            return lire_simulation(identifiant, versions, resolutions)
+        except (OSError, ValueError):
+            return None
+
+    resultats = []
+    for element in elements:
+        try:
+            if 'id' in element:
+                simulation = lire_simulation(element['id'], versions, resolutions)
+            else:
+                simulation, erreurs = valider_simulation(element['simulation'])
+                if erreurs:
+                    resultats.append({"erreurs": erreurs})
+                    continue
+                simulation = resoudre_simulation(simulation, versions, resolutions)
+            sous = projeter_sous_fonds(simulation, charger, sous_fonds, courbes_fx)
+            resultat = calculer_projection(simulation, sous_fonds=sous, courbes_fx=courbes_fx)
+            resultats.append({"projection": projection_en_json(resultat)})
+        except FileNotFoundError:
+            resultats.append({"erreurs": [f"Simulation {element['id']} introuvable" if 'id' in element
+                                          else "Simulation parente ou détenue introuvable"]})
+        except Exception as e:
+            # Une erreur propre à un élément ne fait pas échouer le reste du lot
+            resultats.append({"erreurs": [f"{type(e).__name__}: {e}"]})
+    return resultats
+
+
+async def projeter_dans_le_pool(app, elements):
+    """Répartir des éléments à projeter entre les processus du pool, en parts de taille égale"""
+    nb_parts = min(len(elements), app.state.nb_processus) or 1
+    taille = -(-len(elements) // nb_parts)
+    boucle = asyncio.get_running_loop()
+    parts = await asyncio.gather(*[
+        boucle.run_in_executor(app.state.pool, projeter_elements, elements[debut:debut + taille])
+        for debut in range(0, len(elements), taille)
+    ])
+    return [resultat for part in parts for resultat in part]
+
+
+# === ROUTES ===
+async def lire_json(requete):
+    try:
+        return await requete.json()
+    except ValueError:
+        raise ErreurRequete(["Corps de requête JSON invalide"])
+
+
+async def route_projection(requete):
+    simulation = await lire_json(requete)
+    resultat, = await projeter_dans_le_pool(requete.app, [{"simulation": simulation}])
+    if 'erreurs' in resultat:
+        raise ErreurRequete(resultat['erreurs'])
+    return JSONResponse(resultat['projection'])
+
+
+async def route_lots(requete):
+    corps = await lire_json(requete)
+    if not isinstance(corps, dict):
+        raise ErreurRequete(["Objet attendu : {\"simulations\": [...], \"simulation_ids\": [...]}"])
+    erreurs = [f"$.{cle} : liste attendue" for cle in ("simulations", "simulation_ids")
+               if not isinstance(corps.get(cle, []), list)]
+    erreurs += [f"$.simulation_ids[{i}] : identifiant texte attendu, reçu {simulation_id!r}"
+                for i, simulation_id in enumerate(corps.get('simulation_ids', []) if not erreurs else [])
+                if not isinstance(simulation_id, str) or not simulation_id
+                or any(separateur in simulation_id for separateur in ('/', '\\'))]
+    if erreurs:
+        raise ErreurRequete(erreurs)
+    elements = ([{"simulation": simulation} for simulation in corps.get('simulations', [])]
+                + [{"id": simulation_id} for simulation_id in corps.get('simulation_ids', [])])
+    if not elements:
+        raise ErreurRequete(["Lot vide"])
+    debut = time.perf_counter()
+    resultats = await projeter_dans_le_pool(requete.app, elements)
+    duree = time.perf_counter() - debut
+    return JSONResponse({"resultats": resultats, "duree": duree, "debit": len(elements) / duree if duree else None})
+
+
+async def route_lister(requete):
+    try:
+        page = int(requete.query_params.get('page', 0))
+        taille = min(int(requete.query_params.get('taille', TAILLE_PAGE_DEFAUT)), TAILLE_PAGE_MAX)
+    except ValueError:
+        raise ErreurRequete(["page et taille doivent être des entiers"])
+    termes = requete.query_params.get('texte', '').casefold().split()
+    index = await asyncio.to_thread(lire_index)
+    simulations = sorted(
+        ({"id": simulation_id, **entree} for simulation_id, entree in index.items()
+         if 'erreur' not in entree and all(
+             terme in f"{entree.get('nom_fonds')} {entree.get('nom_scenario')} {entree.get('commentaire')}".casefold()
+             for terme in termes)),
+        key=lambda simulation: simulation.get('date_creation') or '', reverse=True
+    )
+    return JSONResponse({"total": len(simulations), "page": page, "taille": taille,
+                         "simulations": simulations[page * taille:(page + 1) * taille]})
+
+
+async def route_lire(requete):
+    simulation_id = requete.path_params['simulation_id']
+    try:
+        simulation = await asyncio.to_thread(lire_simulation, simulation_id)
+    except FileNotFoundError:
+        raise ErreurRequete([f"Simulation {simulation_id} introuvable"], 404)
+    except ValueError as e:
+        raise ErreurRequete([str(e)], 422)
+    return JSONResponse(simulation)
+
+
+def enregistrer(simulation, resume):
+    """Sauvegarder une simulation validée, sauf si elle est identique à la dernière version de son scénario"""
+    cle = (nettoyer_nom_fonds(simulation['nom_fonds']), simulation['nom_scenario'])
+    derniere_version = dernieres_versions().get(cle)
+    if derniere_version is not None and derniere_version.get('empreinte') == empreinte(simulation):
+        return derniere_version['id'], True
+    if resume is not None:
+        simulation['resume'] = resume
+    return ecrire_enregistrement(simulation), False
+
+
+async def route_sauvegarder(requete):
+    simulation = await lire_json(requete)
+    if not isinstance(simulation, dict):
+        raise ErreurRequete(["Objet attendu"])
+    simulation = dict(simulation, id=str(uuid.uuid4()), date_creation=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    simulation['commentaire'] = simulation.get('commentaire') or "Service HTTP"
+    simulation, erreurs = valider_simulation(simulation)
+    if erreurs:
+        raise ErreurRequete(erreurs)
+    resultat, = await projeter_dans_le_pool(requete.app, [{"simulation": simulation}])
+    if 'erreurs' in resultat:
+        raise ErreurRequete(resultat['erreurs'])
+    simulation_id, doublon = await asyncio.to_thread(enregistrer, simulation, resultat['projection']['resume'])
+    return JSONResponse({"id": simulation_id, "doublon": doublon}, status_code=200 if doublon else 201)
+
+
+async def route_mesures(requete):
+    mesures = {}
+    for route, durees in requete.app.state.durees.items():
+        valeurs = np.array(durees) * 1000
+        mesures[route] = {
+            "requetes": requete.app.state.requetes[route],
+            "erreurs": requete.app.state.erreurs[route],
+            "p50_ms": float(np.percentile(valeurs, 50)),
+            "p95_ms": float(np.percentile(valeurs, 95)),
+            "max_ms": float(valeurs.max())
+        }
+    return JSONResponse(mesures)
+
+
+# === APPLICATION ===
+def creer_application(nb_processus=None):
+    """Application ASGI du service ; le pool de processus vit le temps du service"""
+    nb_processus = nb_processus or os.cpu_count() or 1
+
+    @asynccontextmanager
+    async def cycle_de_vie(app):
+        app.state.nb_processus = nb_processus
+        app.state.pool = ProcessPoolExecutor(max_workers=nb_processus)
+        app.state.durees = defaultdict(lambda: deque(maxlen=NB_MESURES))
+        app.state.requetes = defaultdict(int)
+        app.state.erreurs = defaultdict(int)
+        try:
+            yield
+        finally:
+            app.state.pool.shutdown(cancel_futures=True)
+
+    async def chronometrer(requete, suivant):
+        """Durée de chaque requête, en en-tête Server-Timing et dans les mesures de sa route"""
+        debut = time.perf_counter()
+        reponse = await suivant(requete)
+        duree = time.perf_counter() - debut
+        route = requete.scope.get('route')
+        cle = f"{requete.method} {route.path if route is not None else requete.url.path}"
+        requete.app.state.requetes[cle] += 1
+        requete.app.state.erreurs[cle] += reponse.status_code >= 400
+        requete.app.state.durees[cle].append(duree)
+        reponse.headers['Server-Timing'] = f"total;dur={duree * 1000:.1f}"
+        return reponse
+
+    async def erreur_requete(requete, erreur):
+        return JSONResponse({"erreurs": erreur.erreurs}, status_code=erreur.statut)
+
+    return Starlette(
+        routes=[
+            Route("/projection", route_projection, methods=["POST"]),
+            Route("/lots", route_lots, methods=["POST"]),
+            Route("/simulations", route_lister, methods=["GET"]),
+            Route("/simulations", route_sauvegarder, methods=["POST"]),
+            Route("/simulations/{simulation_id}", route_lire, methods=["GET"]),
+            Route("/mesures", route_mesures, methods=["GET"]),
+        ],
+        middleware=[Middleware(BaseHTTPMiddleware, dispatch=chronometrer)],
+        exception_handlers={ErreurRequete: erreur_requete},
+        lifespan=cycle_de_vie
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Service HTTP local de projection des simulations")
+    parser.add_argument("--port", type=int, default=PORT_DEFAUT)
+    parser.add_argument("--processus", type=int, default=None, help="processus de calcul (un par cœur par défaut)")
+    arguments = parser.parse_args()
+    uvicorn.run(creer_application(arguments.processus), host="127.0.0.1", port=arguments.port, log_level="warning")
@@ -0,0 +1,827 @@
+"""Stockage des simulations : format compact versionné, migrations, validation et index"""
+import functools
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+from datetime import datetime
+
+from moteur import (normaliser_impact, json_canonique, appliquer_surcharges, dependances, TYPES_IMPACTS, TYPES_EVENEMENTS, REGIMES_FISCAUX,
+                    TYPES_ACTIFS, FISCALITE_DEFAUT, DEVISE_FONDS, ARRONDI_DEFAUT, MODES_CALCUL, REGLES_ARRONDI,
+                    GRANULARITES_ARRONDI)
+
+REPERTOIRE_SIMULATIONS = 'data/simulations'
+FICHIER_INDEX = 'data/index_simulations.json'
+FICHIER_COURBES_FX = 'data/courbes_fx.json'
+EXTENSION = '.json.gz'
+EXTENSION_HISTORIQUE = '.json'
+
+# Version 1 : JSON indenté sans marqueur de version, impacts fixes sans type
+# Version 2 : JSON compact compressé, impacts toujours typés, listes et fiscalité toujours présentes
+VERSION_SCHEMA = 2
+
+# Champs repris dans l'index pour lister les simulations sans ouvrir leurs fichiers
+CHAMPS_INDEX = ["nom_fonds", "nom_scenario", "date_vl_connue", "date_creation", "commentaire", "scenario_parent",
+                "resume"]
+
+# Champs propres à une version, exclus de l'empreinte du contenu (le fonds et le scénario identifient la série de versions)
+CHAMPS_HORS_EMPREINTE = {"id", "date_creation", "commentaire", "version_schema", "nom_fonds", "nom_scenario", "resume"}
+
+verrou_index = threading.Lock()
+
+# Sauvegarde complète du stockage : manifeste, index et fichiers des simulations dans une archive zip
+FORMAT_SAUVEGARDE = "sauvegarde_simulations"
+REPERTOIRE_SAUVEGARDES = 'data/sauvegardes'
+MODES_CONFLIT = {
+    "ignorer": "Ignorer les simulations déjà présentes",
+    "remplacer": "Remplacer les simulations déjà présentes",
+    "dupliquer": "Conserver les deux (nouvel identifiant pour la simulation restaurée)",
+}
+
+
+# === ENCODAGE ===
+def encoder(simulation):
+    """Encoder une simulation : JSON sans espaces, compressé"""
+    texte = json.dumps(simulation, ensure_ascii=False, separators=(',', ':'))
+    return gzip.compress(texte.encode('utf-8'), compresslevel=6)
+
+
+def decoder(contenu):
+    """Décoder le contenu d'un fichier de simulation, compressé ou au format JSON historique"""
+    if contenu[:2] == b'\x1f\x8b':
+        # En-tête gzip décodé directement par zlib, plus rapide que le module gzip
+        contenu = zlib.decompress(contenu, 31)
+    return json.loads(contenu.decode('utf-8'))
+
+
+def ecrire_atomique(chemin, contenu):
+    """Écrire un fichier via un fichier temporaire renommé, pour ne jamais laisser de fichier à moitié écrit"""
+    temporaire = f"{chemin}.{uuid.uuid4().hex}.tmp"
+    with open(temporaire, 'wb') as f:
+        f.write(contenu)
+    os.replace(temporaire, chemin)
+
+
+def chemin_simulation(simulation_id):
+    """Fichier d'une simulation au format compact"""
+    return os.path.join(REPERTOIRE_SIMULATIONS, simulation_id + EXTENSION)
+
+
+# === MIGRATIONS ===
+def _migrer_v1(simulation):
+    """Version 1 → 2 : impacts typés, listes et fiscalité explicites"""
+    simulation = dict(simulation)
+    if not simulation.get('scenario_parent'):
+        simulation['impacts'] = [normaliser_impact(i) for i in simulation.get('impacts', [])
+                                 if normaliser_impact(i) is not None]
+        for cle in ["impacts_multidates", "actifs", "evenements_parts"]:
+            simulation.setdefault(cle, [])
+        simulation['fiscalite'] = {**FISCALITE_DEFAUT, **(simulation.get('fiscalite') or {})}
+        simulation.setdefault('chocs_fx', {})
+    simulation['version_schema'] = 2
+    return simulation
+
+
+MIGRATIONS = {1: _migrer_v1}
+
+
+def migrer(simulation):
+    """Amener une simulation lue sur disque à la version courante du schéma"""
+    version = simulation.get('version_schema', 1)
+    if version > VERSION_SCHEMA:
+        raise ValueError(f"Simulation au format {version}, plus récent que celui de l'application ({VERSION_SCHEMA})")
+    while version < VERSION_SCHEMA:
+        simulation = MIGRATIONS[version](simulation)
+        version = simulation['version_schema']
+    return simulation
+
+
+# === VALIDATION ===
+# Formats de date acceptés à l'import, ramenés à jj/mm/aaaa
+FORMATS_DATE = ["%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y"]
+
+
+def lire_nombre(texte):
+    """Lire un nombre saisi au format français : espaces de milliers, virgule décimale, symbole €"""
+    texte = str(texte).replace('\u202f', '').replace('\xa0', '').replace(' ', '').replace('€', '')
+    if ',' in texte:
+        texte = texte.replace('.', '').replace(',', '.')
+    return float(texte)
+
+
+@functools.lru_cache(maxsize=4096)
+def normaliser_date(texte):
+    """Date au format jj/mm/aaaa, ou None si le texte n'est pas une date reconnue"""
+    for format_date in FORMATS_DATE:
+        try:
+            return datetime.strptime(texte.strip(), format_date).strftime("%d/%m/%Y")
+        except ValueError:
+            continue
+    return None
+
+
+# Le chemin JSON d'un champ n'est construit qu'en cas d'erreur : la validation est faite à chaque lecture
+def _nombre(valeur, chemin, champ, erreurs, optionnel=False):
+    if type(valeur) is float:
+        return valeur
+    if valeur is None or valeur == "":
+        if not optionnel:
+            erreurs.append(f"{chemin}.{champ} : nombre attendu")
+        return None if optionnel else 0.0
+    if isinstance(valeur, bool):
+        erreurs.append(f"{chemin}.{champ} : nombre attendu, reçu {valeur!r}")
+        return 0.0
+    try:
+        return float(valeur) if not isinstance(valeur, str) else lire_nombre(valeur)
+    except (TypeError, ValueError):
+        erreurs.append(f"{chemin}.{champ} : nombre attendu, reçu {valeur!r}")
+        return 0.0
+
+
+def _date(valeur, chemin, champ, erreurs):
+    date_normalisee = normaliser_date(str(valeur))
+    if date_normalisee is None:
+        erreurs.append(f"{chemin}.{champ} : date jj/mm/aaaa attendue, reçu {valeur!r}")
+        return str(valeur)
+    return date_normalisee
+
+
+def _texte(valeur, chemin, champ, erreurs, defaut=""):
+    if type(valeur) is str:
+        return valeur
+    if valeur is None:
+        return defaut
+    if not isinstance(valeur, (int, float)) or isinstance(valeur, bool):
+        erreurs.append(f"{chemin}.{champ} : texte attendu, reçu {valeur!r}")
+        return defaut
+    return str(valeur)
+
+
+def _choix(valeur, options, chemin, champ, erreurs, defaut):
+    if valeur is None:
+        return defaut
+    if valeur not in options:
+        erreurs.append(f"{chemin}.{champ} : valeur parmi {', '.join(options)} attendue, reçu {valeur!r}")
+        return defaut
+    return valeur
+
+
+def _liste(valeur, chemin, champ, erreurs):
+    if valeur is None:
+        return []
+    if not isinstance(valeur, list):
+        erreurs.append(f"{chemin}.{champ} : liste attendue")
+        return []
+    return valeur
+
+
+def _objet(valeur, chemin, erreurs):
+    if not isinstance(valeur, dict):
+        erreurs.append(f"{chemin} : objet attendu")
+        return {}
+    return valeur
+
+
+def _resume(valeur, chemin, erreurs):
+    """Synthèse de la projection (voir `moteur.resumer_projection`), optionnelle"""
+    c = f"{chemin}.resume"
+    resume = _objet(valeur, c, erreurs)
+    return {
+        "vl_initiale": _nombre(resume.get('vl_initiale'), c, "vl_initiale", erreurs),
+        "vl_finale": _nombre(resume.get('vl_finale'), c, "vl_finale", erreurs),
+        "variation": _nombre(resume.get('variation'), c, "variation", erreurs, optionnel=True),
+        "date_vl_min": _date(resume.get('date_vl_min'), c, "date_vl_min", erreurs),
+        "vl_min": _nombre(resume.get('vl_min'), c, "vl_min", erreurs),
+        "apercu": [_nombre(v, c, f"apercu[{i}]", erreurs)
+                   for i, v in enumerate(_liste(resume.get('apercu'), c, "apercu", erreurs))]
+    }
+
+
+def valider_simulation(simulation, chemin="$"):
+    """Valider une simulation au schéma courant et typer ses champs
+
+    Retourne la simulation typée et la liste de toutes les erreurs rencontrées,
+    chacune préfixée du chemin JSON du champ concerné. Un scénario dérivé n'est
+    validé que sur ses champs propres, ses surcharges l'étant après résolution
+    (voir `resoudre_simulation`).
+    """
+    erreurs = []
+    simulation = _objet(simulation, chemin, erreurs)
+    typee = {
+        "version_schema": VERSION_SCHEMA,
+        "id": _texte(simulation.get('id'), chemin, "id", erreurs),
+        "nom_fonds": _texte(simulation.get('nom_fonds'), chemin, "nom_fonds", erreurs, "Fonds sans nom"),
+        "nom_scenario": _texte(simulation.get('nom_scenario'), chemin, "nom_scenario", erreurs, "Base case"),
+        "date_creation": _texte(simulation.get('date_creation'), chemin, "date_creation", erreurs),
+        "commentaire": _texte(simulation.get('commentaire'), chemin, "commentaire", erreurs)
+    }
+    # Commentaire libre du scénario, repris dans les rapports ; absent s'il est vide
+    if simulation.get('commentaire_simulation'):
+        typee['commentaire_simulation'] = _texte(simulation['commentaire_simulation'], chemin,
+                                                 "commentaire_simulation", erreurs)
+    if simulation.get('resume') is not None:
+        typee['resume'] = _resume(simulation['resume'], chemin, erreurs)
+    if simulation.get('scenario_parent'):
+        typee['scenario_parent'] = _texte(simulation['scenario_parent'], chemin, "scenario_parent", erreurs)
+        typee['surcharges'] = _objet(simulation.get('surcharges', {}), f"{chemin}.surcharges", erreurs)
+        return typee, erreurs
+
+    typee.update({
+        "date_vl_connue": _date(simulation.get('date_vl_connue'), chemin, "date_vl_connue", erreurs),
+        "date_fin_fonds": _date(simulation.get('date_fin_fonds'), chemin, "date_fin_fonds", erreurs),
+        "anr_derniere_vl": _nombre(simulation.get('anr_derniere_vl'), chemin, "anr_derniere_vl", erreurs),
+        "nombre_parts": _nombre(simulation.get('nombre_parts'), chemin, "nombre_parts", erreurs),
+        "impacts": [],
+        "impacts_multidates": [],
+        "actifs": [],
+        "evenements_parts": []
+    })
+
+    for i, impact in enumerate(_liste(simulation.get('impacts'), chemin, "impacts", erreurs)):
+        c = f"{chemin}.impacts[{i}]"
+        if isinstance(impact, list) and len(impact) == 2:
+            # Couple (libellé, montant) des exports de paramètres
+            impact = {"libelle": impact[0], "type": "fixe", "montant": impact[1]}
+        impact = _objet(impact, c, erreurs)
+        typee['impacts'].append({
+            "libelle": _texte(impact.get('libelle'), c, "libelle", erreurs, "Sans nom"),
+            "type": _choix(impact.get('type', 'fixe'), list(TYPES_IMPACTS), c, "type", erreurs, 'fixe'),
+            "devise": _texte(impact.get('devise'), c, "devise", erreurs, DEVISE_FONDS),
+            "montant": _nombre(impact.get('montant', 0.0), c, "montant", erreurs),
+            "taux": _nombre(impact.get('taux', 0.0), c, "taux", erreurs),
+            "plancher": _nombre(impact.get('plancher'), c, "plancher", erreurs, optionnel=True),
+            "plafond": _nombre(impact.get('plafond'), c, "plafond", erreurs, optionnel=True)
+        })
+
+    for i, impact in enumerate(_liste(simulation.get('impacts_multidates'), chemin, "impacts_multidates", erreurs)):
+        c = f"{chemin}.impacts_multidates[{i}]"
+        impact = _objet(impact, c, erreurs)
+        impact_type = {
+            "libelle": _texte(impact.get('libelle'), c, "libelle", erreurs, "Impact sans nom"),
+            "montants": []
+        }
+        for j, occurrence in enumerate(_liste(impact.get('montants'), c, "montants", erreurs)):
+            c_occurrence = f"{c}.montants[{j}]"
+            occurrence = _objet(occurrence, c_occurrence, erreurs)
+            impact_type['montants'].append({
+                "date": _date(occurrence.get('date'), c_occurrence, "date", erreurs),
+                "montant": _nombre(occurrence.get('montant'), c_occurrence, "montant", erreurs)
+            })
+        if impact.get('devise', DEVISE_FONDS) != DEVISE_FONDS:
+            impact_type['devise'] = _texte(impact['devise'], c, "devise", erreurs)
+        typee['impacts_multidates'].append(impact_type)
+
+    for i, actif in enumerate(_liste(simulation.get('actifs'), chemin, "actifs", erreurs)):
+        c = f"{chemin}.actifs[{i}]"
+        actif = _objet(actif, c, erreurs)
+        actif_type = {
+            "nom": _texte(actif.get('nom'), c, "nom", erreurs, "Actif sans nom"),
+            "pct_detention": _nombre(actif.get('pct_detention', 1.0), c, "pct_detention", erreurs),
+            "valeur_actuelle": _nombre(actif.get('valeur_actuelle'), c, "valeur_actuelle", erreurs),
+            "valeur_projetee": _nombre(actif.get('valeur_projetee'), c, "valeur_projetee", erreurs),
+            "is_a_provisionner": bool(actif.get('is_a_provisionner', False)),
+            "regime_fiscal": _choix(actif.get('regime_fiscal', 'droit_commun'), list(REGIMES_FISCAUX),
+                                    c, "regime_fiscal", erreurs, 'droit_commun')
+        }
+        for champ in ["quote_part_imposable", "variation", "variation_brute"]:
+            if champ in actif:
+                actif_type[champ] = _nombre(actif[champ], c, champ, erreurs)
+        if actif.get('type', 'direct') != 'direct':
+            actif_type['type'] = _choix(actif['type'], list(TYPES_ACTIFS), c, "type", erreurs, 'direct')
+            actif_type['simulation_id'] = _texte(actif.get('simulation_id'), c, "simulation_id", erreurs)
+        if actif.get('devise', DEVISE_FONDS) != DEVISE_FONDS:
+            actif_type['devise'] = _texte(actif['devise'], c, "devise", erreurs)
+        typee['actifs'].append(actif_type)
+
+    for i, evenement in enumerate(_liste(simulation.get('evenements_parts'), chemin, "evenements_parts", erreurs)):
+        c = f"{chemin}.evenements_parts[{i}]"
+        evenement = _objet(evenement, c, erreurs)
+        typee['evenements_parts'].append({
+            "date": _date(evenement.get('date'), c, "date", erreurs),
+            "type": _choix(evenement.get('type'), list(TYPES_EVENEMENTS), c, "type", erreurs, 'distribution'),
+            "parts": _nombre(evenement.get('parts', 0.0), c, "parts", erreurs),
+            "montant_par_part": _nombre(evenement.get('montant_par_part', 0.0), c, "montant_par_part", erreurs)
+        })
+
+    fiscalite = _objet(simulation.get('fiscalite', FISCALITE_DEFAUT), f"{chemin}.fiscalite", erreurs)
+    typee['fiscalite'] = {
+        "taux": [],
+        "compensation": bool(fiscalite.get('compensation', False)),
+        "report_deficits": bool(fiscalite.get('report_deficits', False))
+    }
+    taux = _liste(fiscalite.get('taux', FISCALITE_DEFAUT['taux']), f"{chemin}.fiscalite", "taux", erreurs)
+    for j, tranche in enumerate(taux):
+        c = f"{chemin}.fiscalite.taux[{j}]"
+        tranche = _objet(tranche, c, erreurs)
+        typee['fiscalite']['taux'].append({
+            "date": _date(tranche.get('date'), c, "date", erreurs),
+            "taux": _nombre(tranche.get('taux'), c, "taux", erreurs)
+        })
+    typee['chocs_fx'] = {
+        str(devise): _nombre(choc, f"{chemin}.chocs_fx", devise, erreurs)
+        for devise, choc in _objet(simulation.get('chocs_fx', {}), f"{chemin}.chocs_fx", erreurs).items()
+    }
+    # Mode de calcul et règles d'arrondi, absents des simulations qui précèdent le calcul en centimes
+    if simulation.get('arrondi') is not None:
+        c = f"{chemin}.arrondi"
+        arrondi = _objet(simulation['arrondi'], c, erreurs)
+        typee['arrondi'] = {
+            "mode": _choix(arrondi.get('mode'), list(MODES_CALCUL), c, "mode", erreurs, ARRONDI_DEFAUT['mode']),
+            "regle": _choix(arrondi.get('regle'), list(REGLES_ARRONDI), c, "regle", erreurs, ARRONDI_DEFAUT['regle']),
+            "granularite": _choix(arrondi.get('granularite'), list(GRANULARITES_ARRONDI), c, "granularite", erreurs,
+                                  ARRONDI_DEFAUT['granularite'])
+        }
+    return typee, erreurs
+
+
+# === LECTURE ET ÉCRITURE ===
+def lire_enregistrement(simulation_id):
+    """Lire une simulation stockée (format compact ou JSON historique), migrée et validée"""
+    chemin = chemin_simulation(simulation_id)
+    if not os.path.exists(chemin):
+        chemin = os.path.join(REPERTOIRE_SIMULATIONS, simulation_id + EXTENSION_HISTORIQUE)
+    with open(chemin, 'rb') as f:
+        simulation = migrer(decoder(f.read()))
+    simulation.setdefault('id', simulation_id)
+    simulation, erreurs = valider_simulation(simulation)
+    if erreurs:
+        raise ValueError(f"Simulation {simulation_id} invalide : " + " ; ".join(erreurs))
+    return simulation
+
+
+def ecrire_enregistrement(simulation, complements_index=None):
+    """Valider et enregistrer une simulation au format compact, puis la référencer dans l'index
+
+    `complements_index` fournit les métadonnées absentes d'un scénario dérivé
+    (date de VL du scénario résolu, par exemple) ; à défaut, la date de VL est
+    lue sur son parent.
+    """
+    return ecrire_enregistrements([(simulation, complements_index)])[0]
+
+
+def ecrire_enregistrements(simulations):
+    """Enregistrer un lot de couples (simulation, compléments d'index), l'index n'étant réécrit qu'une fois
+
+    Toutes les simulations sont validées avant la première écriture : un lot
+    invalide n'est pas enregistré en partie.
+    """
+    typees = []
+    for simulation, complements in simulations:
+        simulation, erreurs = valider_simulation(simulation)
+        if erreurs:
+            raise ValueError(f"Simulation {simulation['id']} invalide : " + " ; ".join(erreurs))
+        typees.append((simulation, complements))
+    os.makedirs(REPERTOIRE_SIMULATIONS, exist_ok=True)
+    for simulation, _ in typees:
+        ecrire_atomique(chemin_simulation(simulation['id']), encoder(simulation))
+        historique = os.path.join(REPERTOIRE_SIMULATIONS, simulation['id'] + EXTENSION_HISTORIQUE)
+        if os.path.exists(historique):
+            os.remove(historique)
+    with verrou_index:
+        index = _charger_index()
+        modifiees = {}
+        for simulation, complements in typees:
+            ancienne = index.get(simulation['id'])
+            index[simulation['id']] = entree_index(simulation, complements)
+            if ancienne is None or ancienne.get('empreinte') != index[simulation['id']]['empreinte']:
+                modifiees[simulation['id']] = index[simulation['id']]
+        _completer_dates_derivees(index, [simulation for simulation, _ in typees])
+        _perimer_syntheses(index, modifiees, {simulation['id'] for simulation, _ in typees})
+        _ecrire_index(index)
+    return [simulation['id'] for simulation, _ in typees]
+
+
+def _completer_dates_derivees(index, simulations):
+    """Indexer la date de VL des scénarios dérivés qui n'en ont pas reçu, d'après leur scénario résolu
+
+    Un parent introuvable ou illisible laisse la date vide, sans bloquer l'écriture.
+    """
+    derivees = [simulation for simulation in simulations
+                if simulation.get('scenario_parent') and index[simulation['id']]['date_vl_connue'] is None]
+    if not derivees:
+        return
+    versions = dernieres_versions(index)
+    for simulation in derivees:
+        try:
+            index[simulation['id']]['date_vl_connue'] = resoudre_simulation(simulation, versions)['date_vl_connue']
+        except (OSError, ValueError, KeyError):
+            pass
+
+
+def supprimer_enregistrement(simulation_id):
+    """Supprimer le fichier d'une simulation et son entrée d'index ; False si elle n'existe pas"""
+    supprime = False
+    for extension in (EXTENSION, EXTENSION_HISTORIQUE):
+        chemin = os.path.join(REPERTOIRE_SIMULATIONS, simulation_id + extension)
+        if os.path.exists(chemin):
+            os.remove(chemin)
+            supprime = True
+    with verrou_index:
+        index = _charger_index()
+        entree = index.pop(simulation_id, None)
+        if entree is not None:
+            _perimer_syntheses(index, {simulation_id: entree})
+            _ecrire_index(index)
+    return supprime
+
+
+# === INDEX ===
+def cle_scenario(entree):
+    """Couple (fonds, scénario) d'une entrée d'index, qui identifie la série de versions d'un scénario"""
+    return nettoyer_nom_fonds(entree.get('nom_fonds') or 'Fonds sans nom'), entree.get('nom_scenario') or 'Base case'
+
+
+def fonds_detenus(simulation):
+    """Identifiants des simulations détenues en transparence, y compris par les surcharges d'un scénario dérivé"""
+    surcharges = simulation.get('surcharges', {})
+    actifs = (simulation.get('actifs', []) + surcharges.get('champs', {}).get('actifs', [])
+              + surcharges.get('actifs', {}).get('ajoutes', []))
+    ids = set(dependances({'actifs': actifs}))
+    ids.update(modification['simulation_id'] for modification in surcharges.get('actifs', {}).get('modifies', {}).values()
+               if modification.get('simulation_id'))
+    return sorted(ids)
+
+
+def _perimer_syntheses(index, modifiees, exclues=()):
+    """Effacer de l'index la synthèse des simulations qui dépendent de simulations modifiées ou supprimées
+
+    Un scénario dérivé dépend de la dernière version de son parent, un fonds de
+    fonds des simulations qu'il détient ; les dépendances sont suivies de proche
+    en proche. `rapports.completer_syntheses` recalcule les synthèses effacées.
+    """
+    ids = set(modifiees)
+    cles = {cle_scenario(entree) for entree in modifiees.values() if 'erreur' not in entree}
+    a_examiner = {simulation_id: entree for simulation_id, entree in index.items()
+                  if simulation_id not in ids and simulation_id not in exclues and 'erreur' not in entree}
+    while True:
+        perimees = [simulation_id for simulation_id, entree in a_examiner.items()
+                    if (entree.get('scenario_parent') and (cle_scenario(entree)[0], entree['scenario_parent']) in cles)
+                    or ids.intersection(entree.get('fonds_detenus') or ())]
+        if not perimees:
+            return
+        for simulation_id in perimees:
+            entree = a_examiner.pop(simulation_id)
+            entree['resume'] = None
+            ids.add(simulation_id)
+            cles.add(cle_scenario(entree))
+
+
+def empreinte(simulation):
+    """Empreinte du contenu d'une simulation typée : identique pour deux versions qui ne diffèrent que par leurs métadonnées"""
+    contenu = {champ: valeur for champ, valeur in simulation.items() if champ not in CHAMPS_HORS_EMPREINTE}
+    return hashlib.sha256(json_canonique(contenu).encode('utf-8')).hexdigest()
+
+
+def entree_index(simulation, complements=None):
+    """Métadonnées d'une simulation conservées dans l'index"""
+    entree = {champ: simulation.get(champ) for champ in CHAMPS_INDEX}
+    for champ, valeur in (complements or {}).items():
+        if champ in entree and entree[champ] is None:
+            entree[champ] = valeur
+    entree['fonds_detenus'] = fonds_detenus(simulation)
+    entree['empreinte'] = empreinte(simulation)
+    return entree
+
+
+def _charger_index():
+    if not os.path.exists(FICHIER_INDEX):
+        return {}
+    try:
+        with open(FICHIER_INDEX, 'rb') as f:
+            contenu = json.loads(f.read().decode('utf-8'))
+    except ValueError:
+        return {}
+    if contenu.get('version_schema') != VERSION_SCHEMA:
+        return {}
+    return contenu.get('simulations', {})
+
+
+def _ecrire_index(index):
+    contenu = {"version_schema": VERSION_SCHEMA, "simulations": index}
+    ecrire_atomique(FICHIER_INDEX, json.dumps(contenu, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def ids_stockes():
+    """Identifiants des simulations présentes sur disque, d'après les seuls noms de fichiers"""
+    if not os.path.isdir(REPERTOIRE_SIMULATIONS):
+        return set()
+    ids = set()
+    for entree in os.scandir(REPERTOIRE_SIMULATIONS):
+        for extension in (EXTENSION, EXTENSION_HISTORIQUE):
+            if entree.name.endswith(extension) and not entree.name.endswith('.tmp'):
+                ids.add(entree.name[:-len(extension)])
+    return ids
+
+
+def lire_index():
+    """Index des simulations (identifiant → métadonnées), réconcilié avec le répertoire
+
+    Seuls les fichiers absents de l'index, ou indexés sans empreinte ni fonds
+    détenus par une version antérieure, sont ouverts ; une simulation illisible y est notée avec
+    son erreur pour ne pas être relue à chaque appel.
+    """
+    with verrou_index:
+        index = _charger_index()
+        presents = ids_stockes()
+        modifie = False
+        for simulation_id in set(index) - presents:
+            del index[simulation_id]
+            modifie = True
+        a_lire = presents - {simulation_id for simulation_id, entree in index.items()
+                             if ('empreinte' in entree and 'fonds_detenus' in entree) or 'erreur' in entree}
+        for simulation_id in a_lire:
+            try:
+                index[simulation_id] = entree_index(lire_enregistrement(simulation_id), index.get(simulation_id))
+            except (OSError, ValueError, KeyError) as e:
+                index[simulation_id] = {"erreur": str(e)}
+            modifie = True
+        if modifie:
+            _ecrire_index(index)
+    return index
+
+
+def migrer_stockage(taille_lot=500):
+    """Réécrire au format compact les simulations encore au format JSON historique ; retourne leur nombre
+
+    Les métadonnées déjà indexées (date de VL résolue d'un scénario dérivé) sont
+    conservées ; une synthèse effacée de l'index car périmée n'est pas reprise du fichier.
+    """
+    index = lire_index()
+    ids = [entree.name[:-len(EXTENSION_HISTORIQUE)] for entree in os.scandir(REPERTOIRE_SIMULATIONS)
+           if entree.name.endswith(EXTENSION_HISTORIQUE)]
+    for debut in range(0, len(ids), taille_lot):
+        lot = []
+        for simulation_id in ids[debut:debut + taille_lot]:
+            simulation = lire_enregistrement(simulation_id)
+            if simulation_id in index and not index[simulation_id].get('resume'):
+                simulation.pop('resume', None)
+            lot.append((simulation, index.get(simulation_id)))
+        ecrire_enregistrements(lot)
+    return len(ids)
+
+
+# === RÉSOLUTION DES SCÉNARIOS ===
+def nettoyer_nom_fonds(nom_fonds):
+    """Nom du fonds sans la date éventuellement ajoutée entre parenthèses"""
+    if nom_fonds and '(' in nom_fonds:
+        return nom_fonds.split('(')[0].strip()
+    return nom_fonds
+
+
+def dernieres_versions(index=None):
+    """Dernière version de chaque scénario d'après l'index, par (fonds, scénario) ; chaque entrée porte son `id`"""
+    versions = {}
+    for simulation_id, entree in (lire_index() if index is None else index).items():
+        if 'erreur' in entree:
+            continue
+        cle = cle_scenario(entree)
+        if cle not in versions or (entree.get('date_creation') or '') > (versions[cle].get('date_creation') or ''):
+            versions[cle] = {**entree, 'id': simulation_id}
+    return versions
+
+
+def lire_simulation(simulation_id, versions=None, resolutions=None, chaine=()):
+    """Lire une simulation sauvegardée, résolue sur son scénario parent s'il s'agit d'un scénario dérivé
+
+    Le parent est la dernière version du scénario `scenario_parent` du même fonds :
+    une correction sauvegardée sur le scénario parent est ainsi reprise par tous
+    ses dérivés. `versions` et `resolutions` (simulations déjà résolues, par
+    identifiant) peuvent être partagés entre plusieurs lectures d'un même traitement.
+    """
+    if resolutions is not None and simulation_id in resolutions:
+        return resolutions[simulation_id]
+    simulation_data = resoudre_simulation(lire_enregistrement(simulation_id), versions, resolutions, chaine)
+    if resolutions is not None:
+        resolutions[simulation_id] = simulation_data
+    return simulation_data
+
+
+def resoudre_simulation(simulation_data, versions=None, resolutions=None, chaine=()):
+    """Simulation complète d'un scénario dérivé, sauvegardé ou non, d'après la dernière version de son parent
+
+    La simulation résolue est validée et typée comme une simulation complète :
+    une surcharge invalide lève une ValueError listant les erreurs.
+    """
+    if not simulation_data.get('scenario_parent'):
+        return simulation_data
+    simulation_id = simulation_data.get('id')
+    nom_fonds = nettoyer_nom_fonds(simulation_data.get('nom_fonds', 'Fonds sans nom'))
+    if simulation_id in chaine:
+        raise ValueError(f"Héritage circulaire entre scénarios du fonds {nom_fonds}")
+    if versions is None:
+        versions = dernieres_versions()
+    parent = versions.get((nom_fonds, simulation_data['scenario_parent']))
+    if parent is None:
+        raise ValueError(f"Scénario parent '{simulation_data['scenario_parent']}' introuvable pour le fonds {nom_fonds}")
+    donnees_parent = lire_simulation(parent['id'], versions, resolutions, chaine + (simulation_id,))
+    resolue, erreurs = valider_simulation({
+        **appliquer_surcharges(donnees_parent, simulation_data.get('surcharges', {})),
+        **{k: v for k, v in simulation_data.items() if k not in ('surcharges', 'scenario_parent')}
+    })
+    if erreurs:
+        raise ValueError(f"Scénario dérivé {simulation_data.get('nom_scenario')} du fonds {nom_fonds} invalide "
+                         "après application de ses surcharges : " + " ; ".join(erreurs))
+    resolue['scenario_parent'] = simulation_data['scenario_parent']
+    return resolue
+
+
+# === COURBES DE CHANGE ===
+def charger_courbes_fx():
+    """Charger les courbes de change locales (cours en euros pour une unité de devise)"""
+    if not os.path.exists(FICHIER_COURBES_FX):
+        return {}
+    with open(FICHIER_COURBES_FX, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def sauvegarder_courbes_fx(courbes):
+    """Enregistrer les courbes de change locales"""
+    with open(FICHIER_COURBES_FX, 'w', encoding='utf-8') as f:
+        json.dump(courbes, f, ensure_ascii=False, indent=4)
+
+
+# === IMPORT DE FICHIERS DE PARAMÈTRES ===
+def deplier_fichiers(fichiers):
+    """Parcourir des fichiers (nom, contenu) en dépliant les archives zip en leurs fichiers JSON"""
+    for nom, contenu in fichiers:
+        if not nom.lower().endswith('.zip'):
+            yield nom, contenu
+            continue
+        with zipfile.ZipFile(io.BytesIO(contenu)) as archive:
+            for membre in archive.infolist():
+                nom_membre = membre.filename
+                if membre.is_dir() or nom_membre.startswith('__MACOSX/'):
+                    continue
+                if nom_membre.lower().endswith(('.json', '.json.gz')):
+                    yield f"{nom}/{nom_membre}", archive.read(membre)
+
+
+def lire_fichiers_importes(fichiers):
+    """Lire, typer et valider en une passe des fichiers de paramètres ou de simulations
+
+    Chaque fichier JSON (éventuellement dans une archive zip) contient une
+    simulation ou une liste de simulations, au format de l'export JSON ou du
+    stockage. Les nombres au format français et les dates usuelles sont convertis.
+    Retourne les simulations valides (nom du fichier, simulation typée) et toutes
+    les erreurs, chacune préfixée du fichier et du chemin JSON concerné.
+    """
+    simulations, erreurs = [], []
+    for nom, contenu in deplier_fichiers(fichiers):
+        try:
+            donnees = decoder(contenu)
+        except (ValueError, OSError, EOFError) as e:
+            erreurs.append(f"{nom} : JSON illisible ({str(e)})")
+            continue
+        elements = donnees if isinstance(donnees, list) else [donnees]
+        for i, element in enumerate(elements):
+            chemin = f"$[{i}]" if isinstance(donnees, list) else "$"
+            if isinstance(element, dict):
+                if element.get('surcharges') is not None:
+                    erreurs.append(f"{nom} {chemin} : scénario dérivé, à importer avec son scénario parent complet")
+                    continue
+                # Un scénario parent exporté n'est pas repris : la simulation importée est complète
+                element = {k: v for k, v in element.items() if k != 'scenario_parent'}
+                if 'version_schema' in element:
+                    try:
+                        element = migrer(element)
+                    except ValueError as e:
+                        erreurs.append(f"{nom} {chemin} : {str(e)}")
+                        continue
+            typee, erreurs_element = valider_simulation(element, chemin)
+            if erreurs_element:
+                erreurs.extend(f"{nom} {erreur}" for erreur in erreurs_element)
+            else:
+                simulations.append((nom, typee))
+    return simulations, erreurs
+
+
+def importer_simulations(simulations, commentaire="Import"):
+    """Enregistrer en un lot des simulations typées, sous de nouveaux identifiants ; retourne ces identifiants"""
+    date_creation = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    a_ecrire = []
+    for simulation in simulations:
+        simulation = dict(simulation, id=str(uuid.uuid4()), date_creation=date_creation)
+        simulation['commentaire'] = simulation.get('commentaire') or commentaire
+        a_ecrire.append((simulation, None))
+    return ecrire_enregistrements(a_ecrire)
+
+
+# === SAUVEGARDE ET RESTAURATION ===
+def _copier_dans_archive(archive, repertoire_archive, simulation_id):
+    """Copier tel quel le fichier d'une simulation dans l'archive ; retourne sa taille, ou None s'il n'existe plus"""
+    for extension in (EXTENSION, EXTENSION_HISTORIQUE):
+        chemin = os.path.join(REPERTOIRE_SIMULATIONS, simulation_id + extension)
+        try:
+            source = open(chemin, 'rb')
+        except FileNotFoundError:
+            continue
+        with source, archive.open(f"{repertoire_archive}/{simulation_id}{extension}", 'w') as membre:
+            shutil.copyfileobj(source, membre)
+            return source.tell()
+    return None
+
+
+def exporter_stockage(destination):
+    """Écrire toutes les simulations et l'index dans une archive zip, fichier par fichier ; retourne un rapport
+
+    Les identifiants exportés sont figés d'après l'index au début de l'export.
+    Chaque fichier étant remplacé atomiquement, l'archive n'en contient que des
+    versions complètes ; une simulation supprimée entre-temps est simplement omise.
+    Les fichiers, déjà compressés, sont copiés tels quels sans être décodés. Les
+    simulations illisibles sont copiées à part, dans `illisibles/`, pour être
+    réparées à la main : la restauration les ignore, le rapport les liste.
+    """
+    debut = time.perf_counter()
+    index = lire_index()
+    exportes, illisibles, octets = {}, {}, 0
+    with zipfile.ZipFile(destination, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for simulation_id, entree in index.items():
+            if 'erreur' in entree:
+                if _copier_dans_archive(archive, "illisibles", simulation_id) is not None:
+                    illisibles[simulation_id] = entree['erreur']
+                continue
+            taille = _copier_dans_archive(archive, "simulations", simulation_id)
+            if taille is not None:
+                octets += taille
+                exportes[simulation_id] = entree
+        manifeste = {"format": FORMAT_SAUVEGARDE, "version_schema": VERSION_SCHEMA,
+                     "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "nombre": len(exportes),
+                     "illisibles": illisibles}
+        archive.writestr("manifeste.json", json.dumps(manifeste, ensure_ascii=False),
+                         compress_type=zipfile.ZIP_DEFLATED)
+        archive.writestr("index.json", json.dumps(exportes, ensure_ascii=False, separators=(',', ':')),
+                         compress_type=zipfile.ZIP_DEFLATED)
+    duree = time.perf_counter() - debut
+    return {"simulations": len(exportes), "illisibles": illisibles, "octets": octets, "duree": duree,
+            "debit": len(exportes) / duree if duree else 0.0}
+
+
+def restaurer_stockage(source, conflit="ignorer", taille_lot=500):
+    """Restaurer une archive produite par `exporter_stockage`, par lots ; retourne un rapport
+
+    `conflit` indique le traitement d'une simulation dont l'identifiant existe
+    déjà (voir MODES_CONFLIT). Chaque simulation est migrée et validée ; une
+    simulation invalide est signalée dans le rapport sans bloquer les autres.
+    """
+    if conflit not in MODES_CONFLIT:
+        raise ValueError(f"Mode de conflit inconnu : {conflit}")
+    debut = time.perf_counter()
+    rapport = {"lues": 0, "ecrites": 0, "ignorees": 0, "remplacees": 0, "dupliquees": 0,
+               "erreurs": [], "octets": 0}
+    with zipfile.ZipFile(source) as archive:
+        try:
+            manifeste = json.loads(archive.read("manifeste.json"))
+            index_archive = json.loads(archive.read("index.json"))
+        except KeyError:
+            raise ValueError("Archive sans manifeste ni index : ce n'est pas une sauvegarde du stockage")
+        if manifeste.get('format') != FORMAT_SAUVEGARDE:
+            raise ValueError("Format d'archive non reconnu")
+        if manifeste.get('version_schema', 0) > VERSION_SCHEMA:
+            raise ValueError("Sauvegarde produite par une version plus récente de l'application")
+        existants = ids_stockes()
+        lot = []
+        for membre in archive.infolist():
+            nom = membre.filename
+            if not nom.startswith("simulations/"):
+                continue
+            simulation_id = os.path.basename(nom)
+            for extension in (EXTENSION, EXTENSION_HISTORIQUE):
+                if simulation_id.endswith(extension):
+                    simulation_id = simulation_id[:-len(extension)]
+                    break
+            rapport["lues"] += 1
+            rapport["octets"] += membre.file_size
+            if simulation_id in existants and conflit == "ignorer":
+                rapport["ignorees"] += 1
+                continue
+            try:
+                simulation = migrer(decoder(archive.read(membre)))
+                simulation['id'] = simulation_id
+                simulation, erreurs = valider_simulation(simulation)
+            except (ValueError, OSError, EOFError) as e:
+                erreurs = [str(e)]
+            if erreurs:
+                rapport["erreurs"].append(f"{simulation_id} : " + " ; ".join(erreurs))
+                continue
+            if simulation_id in existants:
+                if conflit == "dupliquer":
+                    simulation['id'] = str(uuid.uuid4())
+                    rapport["dupliquees"] += 1
+                else:
+                    rapport["remplacees"] += 1
+            lot.append((simulation, index_archive.get(simulation_id)))
+            if len(lot) >= taille_lot:
+                rapport["ecrites"] += len(ecrire_enregistrements(lot))
+                lot = []
+        if lot:
+            rapport["ecrites"] += len(ecrire_enregistrements(lot))
+    rapport["duree"] = time.perf_counter() - debut
+    rapport["debit"] = rapport["lues"] / rapport["duree"] if rapport["duree"] else 0.0
+    return rapport
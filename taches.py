@@ -0,0 +1,211 @@
+"""File de tâches en arrière-plan : exports et traitements par lots, suivis sur disque
+
+Chaque tâche est décrite par un fichier JSON dans `data/taches` ; ses fichiers
+produits sont écrits dans un répertoire à son nom et restent téléchargeables
+pendant DUREE_RETENTION. L'état sur disque survit à un rafraîchissement de la
+page ; une tâche interrompue par un redémarrage du serveur est marquée comme telle
+(voir `marquer_taches_interrompues`).
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from stockage import ecrire_atomique
+
+REPERTOIRE_TACHES = 'data/taches'
+DUREE_RETENTION = timedelta(days=7)
+NB_TACHES_SIMULTANEES = 2
+INTERVALLE_ECRITURE = 0.5  # secondes minimum entre deux écritures de la progression
+
+ETATS_FINAUX = {"terminee", "echouee", "annulee", "interrompue"}
+LIBELLES_ETATS = {
+    "en_attente": "En attente",
+    "en_cours": "En cours",
+    "terminee": "Terminée",
+    "echouee": "Échouée",
+    "annulee": "Annulée",
+    "interrompue": "Interrompue",
+}
+
+# Traitements disponibles : nom → fonction(parametres, repertoire, suivi) retournant les fichiers produits
+TRAITEMENTS = {}
+
+executeur = ThreadPoolExecutor(max_workers=NB_TACHES_SIMULTANEES, thread_name_prefix="tache")
+verrou = threading.Lock()
+annulations = {}
+futures = {}
+
+
+class TacheAnnulee(Exception):
+    """Levée dans un traitement dont l'annulation a été demandée"""
+
+
+def traitement(nom):
+    """Enregistrer une fonction comme traitement exécutable en tâche de fond"""
+    def enregistrer(fonction):
+        TRAITEMENTS[nom] = fonction
+        return fonction
+    return enregistrer
+
+
+# === ÉTAT SUR DISQUE ===
+def _chemin_etat(tache_id):
+    return os.path.join(REPERTOIRE_TACHES, tache_id + '.json')
+
+
+def repertoire_tache(tache_id):
+    """Répertoire des fichiers produits par une tâche"""
+    return os.path.join(REPERTOIRE_TACHES, tache_id)
+
+
+def lire_tache(tache_id):
+    """État d'une tâche, ou None si elle n'existe plus"""
+    try:
+        with open(_chemin_etat(tache_id), 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def _ecrire_tache(tache):
+    ecrire_atomique(_chemin_etat(tache['id']), json.dumps(tache, ensure_ascii=False).encode('utf-8'))
+
+
+def _mettre_a_jour(tache_id, **champs):
+    with verrou:
+        tache = lire_tache(tache_id)
+        if tache is None:
+            return None
+        tache.update(champs)
+        _ecrire_tache(tache)
+        return tache
+
+
+class Suivi:
+    """Progression et annulation d'une tâche, transmis au traitement"""
+
+    def __init__(self, tache_id):
+        self.tache_id = tache_id
+        self.derniere_ecriture = 0.0
+
+    def annulation_demandee(self):
+        return annulations.get(self.tache_id, threading.Event()).is_set()
+
+    def avancer(self, faites, total, message=None):
+        """Enregistrer l'avancement ; lève TacheAnnulee si l'annulation a été demandée"""
+        if self.annulation_demandee():
+            raise TacheAnnulee()
+        maintenant = time.monotonic()
+        if faites >= total or maintenant - self.derniere_ecriture >= INTERVALLE_ECRITURE:
+            self.derniere_ecriture = maintenant
+            champs = {"faites": faites, "total": total}
+            if message is not None:
+                champs["message"] = message
+            _mettre_a_jour(self.tache_id, **champs)
+
+
+# === EXÉCUTION ===
+def _executer(tache_id, nom_traitement, parametres):
+    if annulations[tache_id].is_set():
+        return
+    _mettre_a_jour(tache_id, etat="en_cours", debut=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    repertoire = repertoire_tache(tache_id)
+    os.makedirs(repertoire, exist_ok=True)
+    try:
+        resultat = TRAITEMENTS[nom_traitement](parametres, repertoire, Suivi(tache_id)) or {}
+        champs = {"etat": "terminee", "fichiers": resultat.get("fichiers", []), "erreurs": resultat.get("erreurs", [])}
+    except TacheAnnulee:
+        shutil.rmtree(repertoire, ignore_errors=True)
+        champs = {"etat": "annulee"}
+    except Exception as e:
+        shutil.rmtree(repertoire, ignore_errors=True)
+        champs = {"etat": "echouee", "erreurs": [str(e)]}
+    _mettre_a_jour(tache_id, fin=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **champs)
+    annulations.pop(tache_id, None)
+    futures.pop(tache_id, None)
+
+
+def soumettre_tache(nom_traitement, parametres, libelle):
+    """Mettre un traitement en file d'attente ; retourne l'identifiant de la tâche"""
+    if nom_traitement not in TRAITEMENTS:
+        raise ValueError(f"Traitement inconnu : {nom_traitement}")
+    os.makedirs(REPERTOIRE_TACHES, exist_ok=True)
+    tache = {
+        "id": str(uuid.uuid4()),
+        "traitement": nom_traitement,
+        "libelle": libelle,
+        "parametres": parametres,
+        "etat": "en_attente",
+        "faites": 0,
+        "total": 0,
+        "fichiers": [],
+        "erreurs": [],
+        "date_creation": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    _ecrire_tache(tache)
+    annulations[tache['id']] = threading.Event()
+    futures[tache['id']] = executeur.submit(_executer, tache['id'], nom_traitement, parametres)
+    return tache['id']
+
+
+def annuler_tache(tache_id):
+    """Demander l'annulation d'une tâche : immédiate si elle attend, au prochain avancement si elle tourne"""
+    evenement = annulations.get(tache_id)
+    if evenement is None:
+        return False
+    evenement.set()
+    future = futures.get(tache_id)
+    if future is not None and future.cancel():
+        _mettre_a_jour(tache_id, etat="annulee", fin=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        annulations.pop(tache_id, None)
+        futures.pop(tache_id, None)
+    return True
+
+
+def supprimer_tache(tache_id):
+    """Supprimer une tâche terminée et ses fichiers"""
+    tache = lire_tache(tache_id)
+    if tache is None or tache['etat'] not in ETATS_FINAUX:
+        return False
+    shutil.rmtree(repertoire_tache(tache_id), ignore_errors=True)
+    try:
+        os.remove(_chemin_etat(tache_id))
+    except FileNotFoundError:
+        pass
+    return True
+
+
+def lister_taches():
+    """Tâches connues, de la plus récente à la plus ancienne, après purge de celles dont la rétention a expiré"""
+    if not os.path.isdir(REPERTOIRE_TACHES):
+        return []
+    limite = (datetime.now() - DUREE_RETENTION).strftime("%Y-%m-%d %H:%M:%S")
+    taches = []
+    for entree in os.scandir(REPERTOIRE_TACHES):
+        if not entree.name.endswith('.json'):
+            continue
+        tache = lire_tache(entree.name[:-len('.json')])
+        if tache is None:
+            continue
+        if tache['etat'] in ETATS_FINAUX and (tache.get('fin') or tache['date_creation']) < limite:
+            supprimer_tache(tache['id'])
+            continue
+        taches.append(tache)
+    return sorted(taches, key=lambda tache: tache['date_creation'], reverse=True)
+
+
+def marquer_taches_interrompues():
+    """Marquer les tâches restées en attente ou en cours lors d'un arrêt du serveur ; à appeler une fois au démarrage"""
+    if not os.path.isdir(REPERTOIRE_TACHES):
+        return
+    for entree in os.scandir(REPERTOIRE_TACHES):
+        if entree.name.endswith('.json'):
+            tache = lire_tache(entree.name[:-len('.json')])
+            if tache is not None and tache['etat'] not in ETATS_FINAUX:
+                _mettre_a_jour(tache['id'], etat="interrompue", fin=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
@@ -0,0 +1,100 @@
+"""Tests des traitements en lot de l'application, exécutée sans serveur Streamlit"""
+import os
+from datetime import datetime
+
+import pytest
+
+from moteur import valeur_a_date
+from stockage import REPERTOIRE_SIMULATIONS, ecrire_enregistrement, lire_enregistrement, lire_simulation, dernieres_versions
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    """Le script de l'application, importé une fois dans un répertoire vide"""
+    repertoire = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("import"))
+    try:
+        import app
+    finally:
+        os.chdir(repertoire)
+    return app
+
+
+@pytest.fixture(autouse=True)
+def stockage_vide(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(REPERTOIRE_SIMULATIONS)
+
+
+def simulation(**champs):
+    simulation_data = {
+        "id": "base",
+        "nom_fonds": "Fonds test",
+        "nom_scenario": "Base case",
+        "date_creation": "2026-01-15 10:00:00",
+        "commentaire": "Base case - 15/01/2026",
+        "date_vl_connue": "31/12/2024",
+        "date_fin_fonds": "31/12/2028",
+        "anr_derniere_vl": 10_000_000.0,
+        "nombre_parts": 10_000.0,
+        "impacts": [{"libelle": "Frais corporate", "type": "fixe", "montant": -50_000.0}],
+        "actifs": [{"nom": "Actif", "pct_detention": 1.0, "valeur_actuelle": 5_000_000.0,
+                    "valeur_projetee": 5_200_000.0, "is_a_provisionner": False}]
+    }
+    simulation_data.update(champs)
+    return simulation_data
+
+
+def test_roll_forward_rebase_les_derives_depuis_leur_parent_d_origine(app):
+    ecrire_enregistrement(simulation())
+    ecrire_enregistrement({
+        "id": "upside", "nom_fonds": "Fonds test", "nom_scenario": "Upside",
+        "date_creation": "2026-01-16 10:00:00", "commentaire": "", "scenario_parent": "Base case",
+        "surcharges": {"actifs": {"modifies": {"Actif": {"valeur_projetee": 6_000_000.0}}}}
+    }, {"date_vl_connue": "31/12/2024"})
+    nouvelle_date = datetime(2025, 6, 30)
+    prevus = {}
+    for simulation_id in ("base", "upside"):
+        resultat = app.projeter_simulation(app.charger_simulation(simulation_id))
+        prevus[simulation_id] = valeur_a_date(resultat['dates'], resultat['anr'], nouvelle_date)
+
+    rapport = app.roll_forward_simulations(nouvelle_date, {"Fonds test": 11_000_000.0}).set_index("Scénario")
+    assert list(rapport["Statut"]) == ["OK", "OK"]
+    for scenario, simulation_id in (("Base case", "base"), ("Upside", "upside")):
+        assert rapport.loc[scenario, "Écart (€)"] == pytest.approx(11_000_000.0 - prevus[simulation_id])
+    assert rapport.loc["Upside", "Écart (€)"] != pytest.approx(rapport.loc["Base case", "Écart (€)"])
+
+    versions = dernieres_versions()
+    parent, derive = versions[("Fonds test", "Base case")], versions[("Fonds test", "Upside")]
+    assert derive['date_vl_connue'] == "30/06/2025"
+    stocke = lire_enregistrement(derive['id'])
+    assert stocke['scenario_parent'] == "Base case"
+    assert stocke['surcharges']['actifs']['modifies']['Actif'] == {"valeur_actuelle": 6_000_000.0,
+                                                                  "valeur_projetee": 6_000_000.0}
+    assert lire_simulation(parent['id'])['actifs'][0]['valeur_actuelle'] == 5_200_000.0
+    resolu = lire_simulation(derive['id'])
+    assert resolu['anr_derniere_vl'] == 11_000_000.0
+    assert resolu['actifs'][0]['valeur_actuelle'] == 6_000_000.0
+
+
+def test_roll_forward_signale_les_scenarios_non_reportes(app):
+    ecrire_enregistrement(simulation())
+    ecrire_enregistrement(simulation(id="recent", nom_scenario="Stress", date_vl_connue="30/06/2025"))
+    rapport = app.roll_forward_simulations(datetime(2025, 6, 30), {"Fonds test": 11_000_000.0})
+    statuts = dict(zip(rapport["Scénario"], rapport["Statut"]))
+    assert statuts == {"Base case": "OK", "Stress": "Déjà à jour (VL du 30/06/2025)"}
+
+
+def test_consolidation_des_scenarios_derives(app):
+    ecrire_enregistrement(simulation())
+    ecrire_enregistrement({
+        "id": "upside", "nom_fonds": "Fonds test", "nom_scenario": "Upside",
+        "date_creation": "2026-01-16 10:00:00", "commentaire": "", "scenario_parent": "Base case",
+        "surcharges": {"champs": {"anr_derniere_vl": 12_000_000.0}}
+    })
+    ecrire_enregistrement(simulation(id="autre", nom_fonds="Autre fonds", nom_scenario="Upside",
+                                     anr_derniere_vl=3_000_000.0))
+    anr, distributions = app.consolider_simulations("Upside")
+    assert list(anr.columns) == ["Autre fonds", "Fonds test", "Total"]
+    assert anr.iloc[0].tolist() == [3_000_000.0, 12_000_000.0, 15_000_000.0]
+    assert "Total" in distributions.columns
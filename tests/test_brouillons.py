@@ -0,0 +1,94 @@
+"""Tests des brouillons : regroupement des écritures, suppression et restauration"""
+import json
+import os
+import time
+import uuid
+
+import pytest
+
+import brouillons
+from brouillons import (REPERTOIRE_BROUILLONS, planifier_brouillon, supprimer_brouillon, vider_brouillons,
+                        lire_brouillon, lister_brouillons, compteurs_brouillons)
+
+DELAI = 0.05
+
+
+@pytest.fixture(autouse=True)
+def brouillons_vides(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(brouillons, "DELAI_INACTIVITE", DELAI)
+
+
+@pytest.fixture
+def brouillon_id():
+    # Les compteurs et les états écrits sont globaux au module : un identifiant neuf par test
+    return str(uuid.uuid4())
+
+
+def params(anr=10_000_000.0):
+    return {"nom_fonds": "Fonds test", "anr_derniere_vl": anr, "impacts": [("Frais corporate", -50_000.0)]}
+
+
+def attendre_ecriture(brouillon_id, delai=5.0):
+    limite = time.monotonic() + delai
+    while compteurs_brouillons()["en_attente"] or brouillons.en_ecriture == brouillon_id:
+        assert time.monotonic() < limite
+        time.sleep(DELAI / 5)
+
+
+def ecarts(avant):
+    apres = compteurs_brouillons()
+    return {cle: apres[cle] - avant[cle] for cle in ("demandes", "inchangees", "regroupees", "ecritures")}
+
+
+def test_modifications_rapprochees_regroupees_en_une_ecriture(brouillon_id):
+    avant = compteurs_brouillons()
+    for anr in range(5):
+        planifier_brouillon(brouillon_id, params(float(anr)))
+    attendre_ecriture(brouillon_id)
+    assert ecarts(avant) == {"demandes": 5, "inchangees": 0, "regroupees": 4, "ecritures": 1}
+    brouillon = lire_brouillon(brouillon_id)
+    assert brouillon['id'] == brouillon_id
+    assert brouillon['params'] == params(4.0)
+
+    # Même état que le dernier écrit : aucune nouvelle écriture
+    avant = compteurs_brouillons()
+    planifier_brouillon(brouillon_id, params(4.0))
+    assert ecarts(avant) == {"demandes": 1, "inchangees": 1, "regroupees": 0, "ecritures": 0}
+
+
+def test_suppression_annule_l_ecriture_en_attente(brouillon_id):
+    planifier_brouillon(brouillon_id, params())
+    supprimer_brouillon(brouillon_id)
+    time.sleep(DELAI * 4)
+    attendre_ecriture(brouillon_id)
+    assert lire_brouillon(brouillon_id) is None
+
+
+def test_ecriture_immediate_a_l_arret(brouillon_id, monkeypatch):
+    monkeypatch.setattr(brouillons, "DELAI_INACTIVITE", 60.0)
+    planifier_brouillon(brouillon_id, params())
+    vider_brouillons()
+    assert lire_brouillon(brouillon_id)['params'] == params()
+
+
+@pytest.mark.parametrize("identifiant", ["", ".", "..", "../index_simulations", "a/b", "a\\b"])
+def test_identifiant_hors_du_repertoire_refuse(identifiant):
+    with pytest.raises(ValueError):
+        planifier_brouillon(identifiant, params())
+    with pytest.raises(ValueError):
+        supprimer_brouillon(identifiant)
+    assert lire_brouillon(identifiant) is None
+
+
+def test_brouillons_proposes_du_plus_recent_au_plus_ancien():
+    os.makedirs(REPERTOIRE_BROUILLONS)
+    for brouillon_id, date in (("ancien", "2000-01-01 00:00:00"), ("hier", "2999-01-01 00:00:00"),
+                               ("aujourd_hui", "2999-01-02 00:00:00")):
+        with open(os.path.join(REPERTOIRE_BROUILLONS, brouillon_id + ".json"), 'w', encoding='utf-8') as f:
+            json.dump({"id": "autre", "date_modification": date, "params": params()}, f)
+    proposes = lister_brouillons()
+    assert [brouillon['id'] for brouillon in proposes] == ["aujourd_hui", "hier"]
+    # Couples (libellé, montant) restitués comme dans les paramètres de session
+    assert proposes[0]['params']['impacts'] == [("Frais corporate", -50_000.0)]
+    assert not os.path.exists(os.path.join(REPERTOIRE_BROUILLONS, "ancien.json"))
@@ -0,0 +1,431 @@
+"""Tests du moteur de projection"""
+import copy
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from moteur import (calculer_projection, premiere_periode_modifiee, calculer_surcharges, appliquer_surcharges,
+                    empreinte_calcul, evoluer_anr, evoluer_anr_centimes, arrondir, en_centimes, calculer_impots,
+                    projeter_sous_fonds, cours_par_date, sensibilite_fx, reporter_parametres, consolider_series,
+                    previsions_en_lignes, mesurer_precision, resumer_projection, REGLES_ARRONDI,
+                    GRANULARITES_ARRONDI)
+
+
+def simulation(**champs):
+    params = {
+        "nom_fonds": "Fonds test",
+        "nom_scenario": "Base case",
+        "date_vl_connue": "31/12/2024",
+        "date_fin_fonds": "31/12/2028",
+        "anr_derniere_vl": 10_000_000.0,
+        "nombre_parts": 10_000.0,
+        "impacts": [("Frais corporate", -50_000.0), {"type": "pct_anr", "libelle": "Gestion", "taux": -0.01}],
+        "impacts_multidates": [{"libelle": "Honoraires", "montants": [
+            {"date": "30/06/2025", "montant": -100.0}, {"date": "31/12/2025", "montant": -100.0}]}],
+        "actifs": [{"nom": "Actif", "pct_detention": 1.0, "valeur_actuelle": 5_000_000.0,
+                    "valeur_projetee": 5_200_000.0, "is_a_provisionner": True}],
+        "evenements_parts": [{"type": "souscription", "date": "31/12/2026", "nombre_parts": 500.0}],
+    }
+    params.update(champs)
+    return params
+
+
+def fonds_nu(**champs):
+    """Fonds sans actif, impact ni événement : chaque test n'ajoute que ce qu'il vérifie"""
+    return simulation(**{"impacts": [], "impacts_multidates": [], "actifs": [], "evenements_parts": [], **champs})
+
+
+def recalcul_incremental(anciens, nouveaux):
+    precedente = calculer_projection(anciens)
+    periode = premiere_periode_modifiee(anciens, nouveaux, precedente['dates'])
+    return calculer_projection(nouveaux, precedente['dates'], reprise=(precedente, periode)), periode
+
+
+def modifier_occurrence(params, position, **valeurs):
+    params = copy.deepcopy(params)
+    params['impacts_multidates'][0]['montants'][position].update(valeurs)
+    return params
+
+
+@pytest.mark.parametrize("modification, periode_attendue", [
+    # Occurrence déplacée sur la date d'une occurrence identique (multiensemble)
+    (lambda p: modifier_occurrence(p, 1, date="30/06/2025"), 1),
+    (lambda p: modifier_occurrence(p, 1, montant=-300.0), 2),
+    (lambda p: modifier_occurrence(p, 0, date="31/12/2026"), 1),
+    (lambda p: dict(p, evenements_parts=[{"type": "rachat", "date": "30/06/2027", "nombre_parts": 200.0}]), 4),
+    (lambda p: dict(p, nom_scenario="Autre nom"), 9),
+    (lambda p: dict(p, anr_derniere_vl=9_000_000.0), 0),
+])
+def test_recalcul_incremental_identique_au_recalcul_complet(modification, periode_attendue):
+    anciens = simulation()
+    nouveaux = modification(anciens)
+    incremental, periode = recalcul_incremental(anciens, nouveaux)
+    complet = calculer_projection(nouveaux)
+    assert periode == periode_attendue
+    for serie in ["anr", "parts", "vl", "distributions", "impots"]:
+        np.testing.assert_allclose(incremental[serie], complet[serie], rtol=0, atol=1e-6)
+    for lignes in ["actifs", "impacts", "impacts_multidates"]:
+        for (libelle, serie), (libelle_complet, serie_complete) in zip(incremental[lignes], complet[lignes]):
+            assert libelle == libelle_complet
+            np.testing.assert_allclose(serie, serie_complete, rtol=0, atol=1e-6)
+
+
+def test_occurrence_deplacee_sur_une_date_identique():
+    anciens = simulation(impacts=[], actifs=[], evenements_parts=[])
+    nouveaux = modifier_occurrence(anciens, 1, date="30/06/2025")
+    incremental, _ = recalcul_incremental(anciens, nouveaux)
+    assert incremental['anr'][1] == pytest.approx(9_999_800.0)
+
+
+def test_commentaire_propre_au_scenario_derive():
+    parent = simulation(impacts=[], commentaire_simulation="Scénario central")
+    enfant = simulation(impacts=[], nom_scenario="Stress", commentaire_simulation="Cession décalée",
+                        anr_derniere_vl=9_000_000.0)
+    surcharges = calculer_surcharges(parent, enfant)
+    assert surcharges == {"champs": {"anr_derniere_vl": 9_000_000.0}}
+    assert 'commentaire_simulation' not in appliquer_surcharges(parent, surcharges)
+
+
+# === CALCUL EN CENTIMES ===
+def test_regles_arrondi():
+    valeurs = [0.5, 1.5, 2.5, -0.5, -1.5, 100.5]
+    assert arrondir(valeurs, "bancaire").tolist() == [0, 2, 2, 0, -2, 100]
+    assert arrondir(valeurs, "demi_haut").tolist() == [1, 2, 3, -1, -2, 101]
+    # Demi-centime exact en décimal, malgré sa représentation binaire
+    assert en_centimes([1.005, 2.675], "demi_haut").tolist() == [101, 268]
+
+
+def lignes_et_impacts(n=12):
+    lignes = np.array([
+        np.where(np.arange(n) > 0, -12_345.675, 0.0),
+        np.linspace(0, 33_333.333, n),
+        np.where(np.arange(n) == 5, -0.005, 0.0),
+    ])
+    impacts_anr = [(np.where(np.arange(n) > 0, -0.0037, 0.0), None, None)]
+    return lignes, impacts_anr
+
+
+@pytest.mark.parametrize("regle", list(REGLES_ARRONDI))
+@pytest.mark.parametrize("granularite", list(GRANULARITES_ARRONDI))
+def test_centimes_proches_du_calcul_flottant(regle, granularite):
+    lignes, impacts_anr = lignes_et_impacts()
+    arrondi = {"mode": "centimes", "regle": regle, "granularite": granularite}
+    anr_flottant, montants_flottants = evoluer_anr(10_000_000.0, lignes.sum(axis=0), impacts_anr)
+    anr, montants = evoluer_anr_centimes(10_000_000.0, lignes, impacts_anr, arrondi=arrondi)
+    assert anr.dtype == np.int64
+    # Au plus un demi-centime par ligne et par période, reporté sur les périodes suivantes
+    np.testing.assert_allclose(anr / 100, anr_flottant, rtol=0, atol=0.01 * len(anr) * (len(lignes) + 1))
+    np.testing.assert_allclose(montants[0] / 100, montants_flottants[0], rtol=0, atol=0.01)
+
+
+@pytest.mark.parametrize("regle", list(REGLES_ARRONDI))
+def test_granularite_de_l_arrondi(regle):
+    lignes, impacts_anr = lignes_et_impacts()
+    anr_initial = en_centimes(10_000_000.0, regle)
+
+    anr, montants = evoluer_anr_centimes(10_000_000.0, lignes, impacts_anr,
+                                         arrondi={"mode": "centimes", "regle": regle, "granularite": "ligne"})
+    # Variation de chaque période : somme des lignes arrondies une à une
+    variations = np.diff(anr, prepend=anr_initial)
+    assert (variations == en_centimes(lignes, regle).sum(axis=0) + montants[0]).all()
+
+    anr, montants = evoluer_anr_centimes(10_000_000.0, lignes, impacts_anr,
+                                         arrondi={"mode": "centimes", "regle": regle, "granularite": "periode"})
+    # Variation de chaque période : total exact des lignes et des impacts, arrondi une seule fois
+    variations = np.diff(anr, prepend=anr_initial)
+    assert (variations == arrondir(lignes.sum(axis=0) * 100 + montants[0], regle)).all()
+
+
+@pytest.mark.parametrize("granularite", list(GRANULARITES_ARRONDI))
+def test_projection_en_centimes(granularite):
+    params = simulation(arrondi={"mode": "centimes", "regle": "bancaire", "granularite": granularite})
+    centimes = calculer_projection(params)
+    flottant = calculer_projection(simulation())
+    np.testing.assert_allclose(centimes['anr'] * 100, np.round(centimes['anr'] * 100), rtol=0, atol=1e-6)
+    np.testing.assert_allclose(centimes['vl'], flottant['vl'], rtol=0, atol=0.011)
+
+    # Reprise incrémentale identique au recalcul complet
+    nouveaux = modifier_occurrence(params, 1, montant=-300.0)
+    incremental, periode = recalcul_incremental(params, nouveaux)
+    assert periode == 2
+    np.testing.assert_array_equal(incremental['anr'], calculer_projection(nouveaux)['anr'])
+
+
+# === EMPREINTES ===
+def test_empreinte_calcul_ignore_les_champs_sans_effet_sur_la_projection():
+    params = simulation()
+    reference = empreinte_calcul(params)
+    assert empreinte_calcul(dict(reversed(list(params.items())))) == reference
+    assert empreinte_calcul(dict(params, nom_fonds="Autre fonds", nom_scenario="Copie",
+                                 commentaire_simulation="Note", scenario_parent="Base case")) == reference
+    assert empreinte_calcul(dict(params, anr_derniere_vl=10_000_001.0)) != reference
+    assert empreinte_calcul(modifier_occurrence(params, 1, date="30/06/2025")) != reference
+    assert empreinte_calcul(dict(params, arrondi={"mode": "centimes"})) != reference
+
+
+# === IMPACTS EN POURCENTAGE ===
+def test_impact_en_pourcentage_de_l_anr_capitalise():
+    resultat = calculer_projection(fonds_nu(impacts=[{"type": "pct_anr", "libelle": "Gestion", "taux": -0.01}]))
+    attendu = 10_000_000.0 * 0.99 ** np.arange(len(resultat['dates']))
+    np.testing.assert_allclose(resultat['anr'], attendu)
+    libelle, montants = resultat['impacts'][0]
+    assert libelle == "Gestion"
+    np.testing.assert_allclose(montants, np.diff(attendu, prepend=attendu[0]))
+
+
+def test_impact_en_pourcentage_de_l_anr_plafonne():
+    resultat = calculer_projection(fonds_nu(impacts=[
+        {"type": "pct_anr", "libelle": "Gestion", "taux": -0.01, "plafond": 50_000.0}]))
+    n = len(resultat['dates'])
+    np.testing.assert_allclose(resultat['anr'], 10_000_000.0 - 50_000.0 * np.arange(n))
+    np.testing.assert_allclose(resultat['impacts'][0][1], np.where(np.arange(n) > 0, -50_000.0, 0.0))
+
+
+def test_impact_en_pourcentage_des_actifs_sur_la_valeur_de_debut_de_periode():
+    resultat = calculer_projection(fonds_nu(
+        impacts=[{"type": "pct_actifs", "libelle": "Asset management", "taux": -0.002}],
+        actifs=[{"nom": "Actif", "pct_detention": 1.0, "valeur_actuelle": 5_000_000.0,
+                 "valeur_projetee": 5_200_000.0, "is_a_provisionner": False}]))
+    montants = resultat['impacts'][0][1]
+    # S+1 sur la valeur actuelle, puis sur la valeur projetée atteinte en S+1
+    assert montants[:3].tolist() == pytest.approx([0.0, -10_000.0, -10_400.0])
+    np.testing.assert_allclose(montants[2:], -10_400.0)
+
+
+# === ÉVÉNEMENTS SUR LES PARTS ===
+def test_souscription_distribution_et_rachat_a_prix_fixe():
+    resultat = calculer_projection(fonds_nu(evenements_parts=[
+        {"type": "souscription", "date": "30/06/2025", "parts": 1_000.0},
+        {"type": "distribution", "date": "31/12/2025", "montant_par_part": 10.0},
+        {"type": "rachat", "date": "30/06/2026", "parts": 1_000.0, "montant_par_part": 900.0},
+    ]))
+    assert resultat['parts'][:5].tolist() == [10_000.0, 11_000.0, 11_000.0, 10_000.0, 10_000.0]
+    # Souscription à la VL : la VL est inchangée ; distribution et rachat à prix fixé sortent de l'ANR
+    np.testing.assert_allclose(resultat['anr'][:5], [10_000_000.0, 11_000_000.0, 10_890_000.0, 9_990_000.0,
+                                                     9_990_000.0])
+    np.testing.assert_allclose(resultat['vl'][:5], [1_000.0, 1_000.0, 990.0, 999.0, 999.0])
+    np.testing.assert_allclose(resultat['distributions'][:5], [0.0, 0.0, 110_000.0, 900_000.0, 0.0])
+
+
+def test_rachat_a_la_vl_verse_la_vl_ex_distribution():
+    resultat = calculer_projection(fonds_nu(evenements_parts=[
+        {"type": "distribution", "date": "30/06/2025", "montant_par_part": 10.0},
+        {"type": "rachat", "date": "30/06/2025", "parts": 2_000.0},
+    ]))
+    assert resultat['parts'][1] == 8_000.0
+    # 100 000 distribués à 10 000 parts, puis 2 000 parts rachetées à la VL ex-distribution (990)
+    assert resultat['distributions'][1] == pytest.approx(100_000.0 + 2_000.0 * 990.0)
+    assert resultat['vl'][1] == pytest.approx(990.0)
+    # Une part initiale a reçu la distribution, puis 20 % des parts ont été rachetées
+    assert resultat['distribue_par_part'][1] == pytest.approx(10.0 + 990.0 * 0.2)
+
+
+def test_evenement_hors_grille_ignore():
+    resultat = calculer_projection(fonds_nu(evenements_parts=[
+        {"type": "souscription", "date": "15/03/2025", "parts": 1_000.0},
+        {"type": "inconnu", "date": "30/06/2025", "parts": 1_000.0},
+    ]))
+    np.testing.assert_allclose(resultat['parts'], 10_000.0)
+
+
+# === FISCALITÉ ===
+DATES_FISCALES = [datetime(2024, 12, 31), datetime(2025, 6, 30), datetime(2025, 12, 31), datetime(2026, 6, 30)]
+
+
+def actif_imposable(**champs):
+    return {"nom": "Actif", "is_a_provisionner": True, "regime_fiscal": "droit_commun", **champs}
+
+
+@pytest.mark.parametrize("report_deficits, attendu", [
+    (False, [0.0, 0.0, 15.0, 20.0]),
+    # La moins-value de S+1 absorbe la plus-value de S+2 et une partie de celle de S+3
+    (True, [0.0, 0.0, 0.0, 10.0]),
+])
+def test_report_des_deficits(report_deficits, attendu):
+    resultat = calculer_impots([actif_imposable()], {"report_deficits": report_deficits}, DATES_FISCALES,
+                               np.array([[0.0, -100.0, 60.0, 80.0]]))
+    np.testing.assert_allclose(resultat['impots'][0], attendu)
+    np.testing.assert_allclose(resultat['variations_nettes'][0], np.array([0.0, -100.0, 60.0, 80.0]) - attendu)
+
+
+def test_compensation_entre_actifs_repartie_sur_les_plus_values():
+    actifs = [actif_imposable(nom="A"), actif_imposable(nom="B"), actif_imposable(nom="C")]
+    variations = np.array([[0.0, 100.0], [0.0, 60.0], [0.0, -80.0]])
+    sans = calculer_impots(actifs, {}, DATES_FISCALES[:2], variations)
+    np.testing.assert_allclose(sans['impots'][:, 1], [25.0, 15.0, 0.0])
+    avec = calculer_impots(actifs, {"compensation": True}, DATES_FISCALES[:2], variations)
+    # Base du fonds 80, impôt 20 réparti au prorata des plus-values (100 / 60)
+    np.testing.assert_allclose(avec['impots'][:, 1], [12.5, 7.5, 0.0])
+
+
+def test_regimes_fiscaux_et_bareme_date():
+    actifs = [actif_imposable(nom="Droit commun"),
+              actif_imposable(nom="Participation", regime_fiscal="participation", quote_part_imposable=0.12),
+              actif_imposable(nom="Exonéré", regime_fiscal="exonere"),
+              {"nom": "Sans IS", "is_a_provisionner": False}]
+    fiscalite = {"taux": [{"date": "01/01/2000", "taux": 0.25}, {"date": "01/01/2026", "taux": 0.2}]}
+    resultat = calculer_impots(actifs, fiscalite, DATES_FISCALES, np.full((4, 4), 1_000.0))
+    np.testing.assert_allclose(resultat['taux'], [0.25, 0.25, 0.25, 0.2])
+    np.testing.assert_allclose(resultat['impots'][:, 2], [250.0, 30.0, 0.0, 0.0])
+    np.testing.assert_allclose(resultat['impots'][:, 3], [200.0, 24.0, 0.0, 0.0])
+
+
+# === FONDS DE FONDS ===
+def part_de_fonds(simulation_id, pct_detention=0.5):
+    return {"nom": f"Part {simulation_id}", "type": "fonds", "simulation_id": simulation_id,
+            "pct_detention": pct_detention, "valeur_actuelle": 0.0, "valeur_projetee": 0.0}
+
+
+def chargeur(simulations, appels=None):
+    def charger(simulation_id):
+        if appels is not None:
+            appels.append(simulation_id)
+        return simulations.get(simulation_id)
+    return charger
+
+
+def test_fonds_de_fonds_suit_la_projection_du_sous_fonds():
+    sous_fonds = fonds_nu(impacts=[{"type": "pct_anr", "libelle": "Gestion", "taux": -0.01}])
+    detenteur = fonds_nu(anr_derniere_vl=2_000_000.0, actifs=[part_de_fonds("sous"), part_de_fonds("sous", 0.1)])
+    appels = []
+    projections = projeter_sous_fonds(detenteur, chargeur({"sous": sous_fonds}, appels))
+    assert appels == ["sous"]
+    resultat = calculer_projection(detenteur, sous_fonds=projections)
+    anr_sous_fonds = calculer_projection(sous_fonds)['anr']
+    np.testing.assert_allclose(resultat['anr'] - 2_000_000.0, 0.6 * (anr_sous_fonds - anr_sous_fonds[0]))
+
+
+def test_fonds_de_fonds_dependances_projetees_d_abord_et_une_fois():
+    simulations = {"a": fonds_nu(actifs=[part_de_fonds("b"), part_de_fonds("c")]),
+                   "b": fonds_nu(actifs=[part_de_fonds("c")]),
+                   "c": fonds_nu(impacts=[("Frais", -1_000.0)])}
+    appels = []
+    projections = projeter_sous_fonds({"actifs": [part_de_fonds("a"), part_de_fonds("b")]},
+                                      chargeur(simulations, appels))
+    assert sorted(appels) == ["a", "b", "c"]
+    assert list(projections) == ["c", "b", "a"]
+
+
+def test_fonds_de_fonds_dependance_circulaire_refusee():
+    simulations = {"a": fonds_nu(nom_fonds="A", actifs=[part_de_fonds("b")]),
+                   "b": fonds_nu(nom_fonds="B", actifs=[part_de_fonds("a")])}
+    with pytest.raises(ValueError, match="Dépendance circulaire"):
+        projeter_sous_fonds(simulations["a"], chargeur(simulations))
+
+
+def test_fonds_de_fonds_sous_fonds_introuvable_valorise_a_la_saisie():
+    detenteur = fonds_nu(actifs=[dict(part_de_fonds("absent"), valeur_actuelle=1_000.0, valeur_projetee=1_500.0,
+                                      pct_detention=1.0)])
+    assert projeter_sous_fonds(detenteur, chargeur({})) == {}
+    resultat = calculer_projection(detenteur, sous_fonds={})
+    assert resultat['anr'][1] == pytest.approx(10_000_500.0)
+
+
+# === DEVISES ===
+COURBES_FX = {"USD": {"spot": 0.9, "date_spot": "31/12/2024",
+                      "points": [{"date": "31/12/2025", "cours": 1.0}]}}
+
+
+def test_cours_interpoles_entre_les_points_de_la_courbe():
+    cours = cours_par_date(COURBES_FX["USD"], DATES_FISCALES)
+    np.testing.assert_allclose(cours, [0.9, 0.9 + 0.1 * 181 / 365, 1.0, 1.0])
+    # Points de terme ajoutés au spot ; le choc ne porte que sur les cours projetés
+    courbe_points = {"spot": 0.9, "date_spot": "31/12/2024", "points": [{"date": "31/12/2025", "points": 0.05}]}
+    np.testing.assert_allclose(cours_par_date(courbe_points, DATES_FISCALES, choc=0.1)[[0, 2, 3]],
+                               [0.9, 0.95 * 1.1, 0.95 * 1.1])
+
+
+def test_actif_et_impact_en_devise_convertis_a_chaque_periode():
+    params = fonds_nu(actifs=[{"nom": "Actif US", "devise": "USD", "pct_detention": 1.0,
+                               "valeur_actuelle": 1_000_000.0, "valeur_projetee": 1_000_000.0}],
+                      impacts=[{"type": "fixe", "libelle": "Frais US", "montant": -1_000.0, "devise": "USD"}])
+    resultat = calculer_projection(params, courbes_fx=COURBES_FX)
+    cours = cours_par_date(COURBES_FX["USD"], resultat['dates'])
+    # Valeur en euros de l'actif : seule la variation de change fait bouger l'ANR
+    variations_actif = np.diff(1_000_000.0 * cours, prepend=1_000_000.0 * cours[0])
+    np.testing.assert_allclose(resultat['actifs'][0][1], variations_actif)
+    np.testing.assert_allclose(resultat['impacts'][0][1], np.where(np.arange(len(cours)) > 0, -1_000.0 * cours, 0.0))
+    with pytest.raises(ValueError, match="USD"):
+        calculer_projection(params)
+
+
+def test_sensibilite_fx():
+    params = fonds_nu(actifs=[{"nom": "Actif US", "devise": "USD", "pct_detention": 1.0,
+                               "valeur_actuelle": 1_000_000.0, "valeur_projetee": 1_100_000.0}])
+    sensibilite = sensibilite_fx(params, "USD", [-0.1, 0.0, 0.1], courbes_fx=COURBES_FX)
+    # Valeur finale de l'actif au cours final choqué, moins sa valeur initiale au spot non choqué
+    np.testing.assert_allclose(sensibilite['anr_final'], 10_000_000.0 + 1_100_000.0 * np.array([0.9, 1.0, 1.1])
+                               - 900_000.0)
+    np.testing.assert_allclose(sensibilite['vl_finale'], [1_009.0, 1_020.0, 1_031.0])
+
+
+# === ROLL-FORWARD ===
+def test_report_sur_une_nouvelle_vl():
+    params = fonds_nu(
+        impacts_multidates=[{"libelle": "Honoraires", "montants": [
+            {"date": "30/06/2025", "montant": -100.0}, {"date": "31/12/2025", "montant": -100.0}]}],
+        actifs=[{"nom": "Actif", "pct_detention": 1.0, "valeur_actuelle": 5_000_000.0,
+                 "valeur_projetee": 5_200_000.0, "variation": 200_000.0}],
+        evenements_parts=[{"type": "souscription", "date": "30/06/2025", "parts": 1_000.0},
+                          {"type": "souscription", "date": "30/06/2026", "parts": 500.0}])
+    reportes = reporter_parametres(params, datetime(2025, 6, 30), 11_500_000.0)
+    assert (reportes['date_vl_connue'], reportes['anr_derniere_vl']) == ("30/06/2025", 11_500_000.0)
+    assert reportes['impacts_multidates'][0]['montants'] == [{"date": "31/12/2025", "montant": -100.0}]
+    assert reportes['nombre_parts'] == 11_000.0
+    assert reportes['evenements_parts'] == [{"type": "souscription", "date": "30/06/2026", "parts": 500.0}]
+    assert reportes['actifs'][0]['valeur_actuelle'] == 5_200_000.0
+    assert reportes['actifs'][0]['variation'] == 0.0
+    # Les paramètres d'origine ne sont pas modifiés
+    assert params['actifs'][0]['valeur_actuelle'] == 5_000_000.0
+
+    reportes = reporter_parametres(params, datetime(2025, 6, 30), 11_500_000.0, occurrences_echues="reporter")
+    assert reportes['impacts_multidates'][0]['montants'] == [{"date": "31/12/2025", "montant": -200.0}]
+
+
+# === CONSOLIDATION ===
+def test_consolidation_sur_une_grille_commune():
+    a = pd.Series([100.0, 110.0, 120.0], index=pd.to_datetime(["2025-06-30", "2025-12-31", "2026-06-30"]))
+    b = pd.Series([50.0, 40.0], index=pd.to_datetime(["2025-12-31", "2026-03-31"]))
+    anr = consolider_series({"A": a, "B": b})
+    assert anr.index.name == "Date"
+    # Stock prolongé entre les dates propres de chaque fonds, jamais avant la première ni après la dernière
+    assert anr.loc["2026-03-31", "A"] == 110.0
+    assert pd.isna(anr.loc["2025-06-30", "B"]) and pd.isna(anr.loc["2026-06-30", "B"])
+    assert anr["Total"].tolist() == [100.0, 160.0, 150.0, 120.0]
+    # Flux non prolongé
+    distributions = consolider_series({"A": a, "B": b}, prolonger=False)
+    assert distributions["Total"].tolist() == [100.0, 160.0, 40.0, 120.0]
+    assert consolider_series({}).columns.tolist() == ["Total"]
+
+
+# === BACKTESTING ===
+def test_precision_par_fonds_scenario_et_horizon():
+    resultat = calculer_projection(fonds_nu(impacts=[("Frais", -10_000.0)]))
+    previsions = previsions_en_lignes(resultat, id="base", nom_fonds="Fonds test", nom_scenario="Base case")
+    # La VL connue n'est pas une prévision
+    assert previsions['horizon'].tolist() == list(range(1, len(resultat['dates'])))
+    historique = pd.DataFrame({"nom_fonds": ["Fonds test", "Fonds test", "Autre fonds"],
+                               "date": pd.to_datetime(["2025-06-30", "2025-12-31", "2025-06-30"]),
+                               "vl": [1_000.0, 990.0, 1.0]})
+    jointure, metriques = mesurer_precision(previsions, historique)
+    assert len(jointure) == 2
+    # VL prévues 999 et 998
+    np.testing.assert_allclose(metriques[["horizon", "observations", "biais", "mae", "rmse"]].to_numpy(float),
+                               [[1, 1, -1.0, 1.0, 1.0], [2, 1, 8.0, 8.0, 8.0]])
+    assert metriques['mape'].tolist() == pytest.approx([0.1, 800 / 990])
+
+
+# === SYNTHÈSE ===
+def test_synthese_de_la_projection():
+    resultat = calculer_projection(fonds_nu(impacts=[("Revenus", 10_000.0)], evenements_parts=[
+        {"type": "distribution", "date": "31/12/2026", "montant_par_part": 100.0}]))
+    resume = resumer_projection(resultat, nb_points=4)
+    assert resume['vl_initiale'] == 1_000.0
+    assert resume['vl_finale'] == pytest.approx(resultat['vl'][-1])
+    assert resume['variation'] == pytest.approx(resultat['vl'][-1] / 1_000.0 - 1)
+    assert (resume['date_vl_min'], resume['vl_min']) == ("31/12/2026", 904.0)
+    # Première et dernière VL comprises, points régulièrement espacés
+    assert resume['apercu'] == pytest.approx(resultat['vl'][[0, 3, 5, 8]])
+    assert resumer_projection(resultat)['apercu'] == pytest.approx(resultat['vl'])
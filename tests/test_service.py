@@ -0,0 +1,120 @@
+"""Tests du service HTTP de projection, démarré sur un port local le temps du module"""
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+
+from charge_service import SIMULATION_EXEMPLE
+from service import creer_application
+
+
+@pytest.fixture(scope="module")
+def port(tmp_path_factory):
+    repertoire = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("service"))
+    os.makedirs(os.path.join("data", "simulations"))
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    serveur = uvicorn.Server(uvicorn.Config(creer_application(1), host="127.0.0.1", port=port, log_level="warning"))
+    fil = threading.Thread(target=serveur.run, daemon=True)
+    fil.start()
+    fin = time.monotonic() + 30
+    while not serveur.started and time.monotonic() < fin:
+        time.sleep(0.05)
+    try:
+        yield port
+    finally:
+        serveur.should_exit = True
+        fil.join(timeout=30)
+        os.chdir(repertoire)
+
+
+def appeler(port, methode, chemin, corps=None):
+    connexion = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        connexion.request(methode, chemin, body=None if corps is None else json.dumps(corps),
+                          headers={"Content-Type": "application/json"})
+        reponse = connexion.getresponse()
+        return reponse.status, json.loads(reponse.read()), reponse.getheader("Server-Timing")
+    finally:
+        connexion.close()
+
+
+def test_projection(port):
+    statut, projection, chrono = appeler(port, "POST", "/projection", SIMULATION_EXEMPLE)
+    assert statut == 200
+    assert chrono.startswith("total;dur=")
+    assert len(projection['vl']) == len(projection['dates']) == 21
+    assert projection['resume']['vl_initiale'] == pytest.approx(1000.0)
+
+
+def test_projection_invalide(port):
+    statut, reponse, _ = appeler(port, "POST", "/projection", {**SIMULATION_EXEMPLE, "date_fin_fonds": "bientôt"})
+    assert statut == 400
+    assert any(erreur.startswith("$.date_fin_fonds") for erreur in reponse['erreurs'])
+    statut, _, _ = appeler(port, "POST", "/projection", "pas un objet")
+    assert statut == 400
+
+
+@pytest.mark.parametrize("corps", [
+    {"simulation_ids": [5]},
+    {"simulation_ids": ["../courbes_fx"]},
+    {"simulations": {"nom_fonds": "Fonds"}},
+    {},
+    [],
+])
+def test_lot_de_forme_invalide(port, corps):
+    statut, reponse, _ = appeler(port, "POST", "/lots", corps)
+    assert statut == 400
+    assert reponse['erreurs']
+
+
+def test_lot_avec_erreurs_par_element(port):
+    derive_orphelin = {"nom_fonds": "Fonds test de charge", "nom_scenario": "Stress", "scenario_parent": "Inexistant"}
+    statut, reponse, _ = appeler(port, "POST", "/lots", {
+        "simulations": [SIMULATION_EXEMPLE, {**SIMULATION_EXEMPLE, "anr_derniere_vl": "beaucoup"}, derive_orphelin],
+        "simulation_ids": ["inconnue"]
+    })
+    assert statut == 200
+    projection, invalide, orphelin, inconnue = reponse['resultats']
+    assert 'projection' in projection
+    assert any(erreur.startswith("$.anr_derniere_vl") for erreur in invalide['erreurs'])
+    assert "Inexistant" in orphelin['erreurs'][0]
+    assert inconnue['erreurs'] == ["Simulation inconnue introuvable"]
+
+
+def test_sauvegarde_lecture_et_liste(port):
+    simulation = {**SIMULATION_EXEMPLE, "nom_scenario": "Service"}
+    statut, reponse, _ = appeler(port, "POST", "/simulations", simulation)
+    assert statut == 201 and not reponse['doublon']
+    simulation_id = reponse['id']
+    # Contenu identique à la dernière version du scénario : pas de nouvelle copie
+    statut, reponse, _ = appeler(port, "POST", "/simulations", simulation)
+    assert statut == 200 and reponse == {"id": simulation_id, "doublon": True}
+
+    statut, lue, _ = appeler(port, "GET", f"/simulations/{simulation_id}")
+    assert statut == 200 and lue['nom_scenario'] == "Service"
+    statut, _, _ = appeler(port, "GET", "/simulations/inconnue")
+    assert statut == 404
+
+    statut, liste, _ = appeler(port, "GET", "/simulations?texte=service&taille=10")
+    assert statut == 200
+    assert [simulation['id'] for simulation in liste['simulations']] == [simulation_id]
+    assert liste['simulations'][0]['resume']['vl_finale'] is not None
+
+    statut, reponse, _ = appeler(port, "POST", "/lots", {"simulation_ids": [simulation_id]})
+    assert 'projection' in reponse['resultats'][0]
+
+
+def test_mesures(port):
+    appeler(port, "POST", "/projection", SIMULATION_EXEMPLE)
+    statut, mesures, _ = appeler(port, "GET", "/mesures")
+    assert statut == 200
+    assert mesures["POST /projection"]['requetes'] >= 1
+    assert mesures["POST /projection"]['p95_ms'] > 0
@@ -0,0 +1,238 @@
+"""Tests du format de stockage : migrations, validation et scénarios dérivés"""
+import io
+import json
+import os
+import zipfile
+
+import pytest
+
+from stockage import (VERSION_SCHEMA, REPERTOIRE_SIMULATIONS, EXTENSION, EXTENSION_HISTORIQUE, migrer,
+                      valider_simulation, ecrire_enregistrement, lire_enregistrement, lire_simulation, lire_index,
+                      encoder, decoder, empreinte, exporter_stockage, restaurer_stockage, supprimer_enregistrement,
+                      fonds_detenus, lire_fichiers_importes, importer_simulations)
+
+
+@pytest.fixture(autouse=True)
+def stockage_vide(tmp_path, monkeypatch):
+    """Chaque test travaille dans un répertoire `data` vide"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(REPERTOIRE_SIMULATIONS)
+
+
+def simulation(**champs):
+    simulation_data = {
+        "id": "base",
+        "nom_fonds": "Fonds test",
+        "nom_scenario": "Base case",
+        "date_creation": "2026-01-15 10:00:00",
+        "commentaire": "Base case - 15/01/2026",
+        "date_vl_connue": "31/12/2024",
+        "date_fin_fonds": "31/12/2028",
+        "anr_derniere_vl": 10_000_000.0,
+        "nombre_parts": 10_000.0,
+        "impacts": [{"libelle": "Frais corporate", "type": "fixe", "montant": -50_000.0}],
+        "impacts_multidates": [{"libelle": "Honoraires", "montants": [{"date": "30/06/2025", "montant": -100.0}]}],
+        "actifs": [{"nom": "Actif", "pct_detention": 1.0, "valeur_actuelle": 5_000_000.0,
+                    "valeur_projetee": 5_200_000.0, "is_a_provisionner": True}],
+        "evenements_parts": []
+    }
+    simulation_data.update(champs)
+    return simulation_data
+
+
+def test_validation_idempotente():
+    typee, erreurs = valider_simulation(simulation())
+    assert erreurs == []
+    assert typee['version_schema'] == VERSION_SCHEMA
+    assert valider_simulation(typee) == (typee, [])
+
+
+def test_validation_liste_toutes_les_erreurs_avec_leur_chemin():
+    _, erreurs = valider_simulation(simulation(
+        date_vl_connue="31/13/2024", anr_derniere_vl="beaucoup",
+        impacts_multidates=[{"libelle": "Honoraires", "montants": [{"date": "hier", "montant": -100.0}]}]))
+    assert len(erreurs) == 3
+    assert any(erreur.startswith("$.date_vl_connue") for erreur in erreurs)
+    assert any(erreur.startswith("$.anr_derniere_vl") for erreur in erreurs)
+    assert any(erreur.startswith("$.impacts_multidates[0].montants[0]") for erreur in erreurs)
+
+
+def test_migration_v1_puis_validation():
+    # Format historique : JSON indenté, sans version de schéma, impacts fixes en couples (libellé, montant)
+    ancienne = simulation(impacts=[["Frais corporate", -50_000.0]])
+    del ancienne['evenements_parts']
+    with open(os.path.join(REPERTOIRE_SIMULATIONS, "base" + EXTENSION_HISTORIQUE), 'w', encoding='utf-8') as f:
+        json.dump(ancienne, f, indent=4)
+
+    migree = migrer(decoder(json.dumps(ancienne).encode('utf-8')))
+    assert migree['version_schema'] == VERSION_SCHEMA
+    assert migree['evenements_parts'] == []
+    lue = lire_enregistrement("base")
+    assert lue == valider_simulation(migree)[0]
+    assert lue['impacts'][0]['type'] == "fixe"
+    assert lue['impacts'][0]['montant'] == -50_000.0
+
+
+def test_version_plus_recente_refusee():
+    with pytest.raises(ValueError):
+        migrer(simulation(version_schema=VERSION_SCHEMA + 1))
+
+
+def test_ecriture_puis_lecture_identiques():
+    typee, _ = valider_simulation(simulation(arrondi={"mode": "centimes", "regle": "bancaire", "granularite": "periode"}))
+    assert decoder(encoder(typee)) == typee
+    ecrire_enregistrement(typee)
+    assert lire_enregistrement("base") == typee
+    assert not os.path.exists(os.path.join(REPERTOIRE_SIMULATIONS, "base" + EXTENSION_HISTORIQUE))
+
+
+def test_scenario_derive_resolu_et_valide():
+    ecrire_enregistrement(simulation())
+    ecrire_enregistrement({
+        "id": "stress", "nom_fonds": "Fonds test", "nom_scenario": "Stress",
+        "date_creation": "2026-01-16 10:00:00", "commentaire": "", "scenario_parent": "Base case",
+        "surcharges": {"champs": {"anr_derniere_vl": 9_000_000.0},
+                       "actifs": {"modifies": {"Actif": {"valeur_projetee": 4_800_000.0}}}}
+    })
+    resolue = lire_simulation("stress")
+    assert resolue['scenario_parent'] == "Base case"
+    assert resolue['nom_scenario'] == "Stress"
+    assert resolue['anr_derniere_vl'] == 9_000_000.0
+    assert resolue['actifs'][0]['valeur_projetee'] == 4_800_000.0
+    assert resolue['impacts'] == lire_simulation("base")['impacts']
+
+
+def test_index_date_vl_du_scenario_derive_lue_sur_son_parent():
+    ecrire_enregistrement(simulation())
+    ecrire_enregistrement({
+        "id": "stress", "nom_fonds": "Fonds test", "nom_scenario": "Stress",
+        "date_creation": "2026-01-16 10:00:00", "commentaire": "", "scenario_parent": "Base case",
+        "surcharges": {"champs": {"anr_derniere_vl": 9_000_000.0}}
+    })
+    assert lire_index()['stress']['date_vl_connue'] == "31/12/2024"
+
+
+def test_surcharge_invalide_refusee_a_la_resolution():
+    ecrire_enregistrement(simulation())
+    ecrire_enregistrement({
+        "id": "stress", "nom_fonds": "Fonds test", "nom_scenario": "Stress",
+        "date_creation": "2026-01-16 10:00:00", "commentaire": "", "scenario_parent": "Base case",
+        "surcharges": {"champs": {"date_fin_fonds": "bientôt"}}
+    })
+    with pytest.raises(ValueError, match=r"\$\.date_fin_fonds"):
+        lire_simulation("stress")
+
+
+def test_empreinte_ignore_les_metadonnees_de_version():
+    typee, _ = valider_simulation(simulation())
+    reference = empreinte(typee)
+    copie, _ = valider_simulation(simulation(id="autre", date_creation="2026-02-01 09:00:00", commentaire="Copie"))
+    assert empreinte(copie) == reference
+    commentee, _ = valider_simulation(simulation(commentaire_simulation="Cession décalée"))
+    assert empreinte(commentee) != reference
+    modifiee, _ = valider_simulation(simulation(nombre_parts=10_001.0))
+    assert empreinte(modifiee) != reference
+
+
+RESUME = {"vl_initiale": 1000.0, "vl_finale": 1100.0, "variation": 0.1, "date_vl_min": "31/12/2024",
+          "vl_min": 1000.0, "apercu": [1000.0, 1100.0]}
+
+
+def test_syntheses_des_dependants_perimees_par_une_nouvelle_version():
+    ecrire_enregistrement(simulation(resume=RESUME))
+    ecrire_enregistrement({
+        "id": "stress", "nom_fonds": "Fonds test", "nom_scenario": "Stress", "resume": RESUME,
+        "date_creation": "2026-01-16 10:00:00", "commentaire": "", "scenario_parent": "Base case",
+        "surcharges": {"champs": {"anr_derniere_vl": 9_000_000.0}}
+    })
+    ecrire_enregistrement(simulation(id="fdf", nom_fonds="Fonds de fonds", resume=RESUME, actifs=[
+        {"nom": "Part du fonds test", "type": "fonds", "simulation_id": "stress", "pct_detention": 0.5,
+         "valeur_actuelle": 0.0, "valeur_projetee": 0.0}]))
+    assert fonds_detenus(lire_enregistrement("fdf")) == ["stress"]
+
+    # Synthèse ajoutée sans changer le contenu : rien n'est périmé
+    ecrire_enregistrement(simulation(resume={**RESUME, "vl_finale": 1200.0}))
+    assert all(entree['resume'] for entree in lire_index().values())
+
+    ecrire_enregistrement(simulation(id="base_v2", date_creation="2026-02-01 10:00:00", anr_derniere_vl=11_000_000.0,
+                                     resume=RESUME))
+    index = lire_index()
+    assert index['base_v2']['resume'] == RESUME
+    assert index['stress']['resume'] is None
+    assert index['fdf']['resume'] is None
+    assert index['base']['resume'] is not None
+
+
+def test_synthese_d_un_fonds_de_fonds_perimee_par_la_suppression_du_sous_fonds():
+    ecrire_enregistrement(simulation(id="sous_fonds", nom_fonds="Sous-fonds"))
+    ecrire_enregistrement(simulation(id="fdf", nom_fonds="Fonds de fonds", resume=RESUME, actifs=[
+        {"nom": "Part", "type": "fonds", "simulation_id": "sous_fonds", "pct_detention": 0.5,
+         "valeur_actuelle": 0.0, "valeur_projetee": 0.0}]))
+    supprimer_enregistrement("sous_fonds")
+    assert lire_index()['fdf']['resume'] is None
+
+
+def test_sauvegarde_copie_a_part_les_simulations_illisibles(tmp_path):
+    ecrire_enregistrement(simulation())
+    with open(os.path.join(REPERTOIRE_SIMULATIONS, "abimee" + EXTENSION), 'wb') as f:
+        f.write(b"pas du gzip")
+    destination = str(tmp_path / "sauvegarde.zip")
+    rapport = exporter_stockage(destination)
+    assert rapport['simulations'] == 1
+    assert list(rapport['illisibles']) == ["abimee"]
+    with zipfile.ZipFile(destination) as archive:
+        assert archive.read("illisibles/abimee" + EXTENSION) == b"pas du gzip"
+        assert json.loads(archive.read("manifeste.json"))['illisibles'] == rapport['illisibles']
+    os.remove(os.path.join(REPERTOIRE_SIMULATIONS, "abimee" + EXTENSION))
+    supprimer_enregistrement("base")
+    rapport = restaurer_stockage(destination)
+    assert (rapport['lues'], rapport['ecrites'], rapport['erreurs']) == (1, 1, [])
+    assert set(lire_index()) == {"base"}
+
+
+@pytest.mark.parametrize("conflit, attendu", [
+    ("ignorer", {"ignorees": 1, "ecrites": 0}),
+    ("remplacer", {"remplacees": 1, "ecrites": 1}),
+    ("dupliquer", {"dupliquees": 1, "ecrites": 1}),
+])
+def test_restauration_selon_le_mode_de_conflit(tmp_path, conflit, attendu):
+    ecrire_enregistrement(simulation())
+    destination = str(tmp_path / "sauvegarde.zip")
+    exporter_stockage(destination)
+    ecrire_enregistrement(simulation(anr_derniere_vl=12_000_000.0))
+    rapport = restaurer_stockage(destination, conflit=conflit)
+    assert {cle: rapport[cle] for cle in attendu} == attendu
+    anr = sorted(lire_enregistrement(simulation_id)['anr_derniere_vl'] for simulation_id in lire_index())
+    assert anr == {"ignorer": [12_000_000.0], "remplacer": [10_000_000.0],
+                   "dupliquer": [10_000_000.0, 12_000_000.0]}[conflit]
+
+
+def test_restauration_mode_de_conflit_inconnu(tmp_path):
+    with pytest.raises(ValueError):
+        restaurer_stockage(str(tmp_path / "absente.zip"), conflit="fusionner")
+
+
+def test_import_de_fichiers_valide_chaque_simulation_avec_son_chemin():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as f:
+        f.writestr("lot/simulations.json", json.dumps([
+            simulation(anr_derniere_vl="10 000 000,50", date_vl_connue="2024-12-31", scenario_parent="Autre"),
+            simulation(nombre_parts="beaucoup"),
+            {"nom_scenario": "Stress", "scenario_parent": "Base case", "surcharges": {}},
+        ]))
+        f.writestr("__MACOSX/lot/._simulations.json", b"")
+    fichiers = [("lot.zip", archive.getvalue()), ("abime.json", b"{pas du json")]
+    simulations, erreurs = lire_fichiers_importes(fichiers)
+    assert len(simulations) == 1
+    nom, typee = simulations[0]
+    assert nom == "lot.zip/lot/simulations.json"
+    assert (typee['anr_derniere_vl'], typee['date_vl_connue']) == (10_000_000.5, "31/12/2024")
+    assert 'scenario_parent' not in typee
+    assert len(erreurs) == 3
+    assert erreurs[0].startswith("lot.zip/lot/simulations.json $[1].nombre_parts")
+    assert erreurs[1].startswith("lot.zip/lot/simulations.json $[2] : scénario dérivé")
+    assert erreurs[2].startswith("abime.json : JSON illisible")
+
+    ids = importer_simulations([typee, typee], "Import test")
+    assert len(set(ids)) == 2 and "base" not in ids
+    assert {lire_index()[simulation_id]['commentaire'] for simulation_id in ids} == {"Base case - 15/01/2026"}
@@ -0,0 +1,127 @@
+"""Tests de la file de tâches : exécution, progression, annulation et reprise après arrêt"""
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import taches
+from taches import (REPERTOIRE_TACHES, ETATS_FINAUX, soumettre_tache, annuler_tache, lire_tache, lister_taches,
+                    supprimer_tache, marquer_taches_interrompues, repertoire_tache)
+
+
+@pytest.fixture(autouse=True)
+def file_vide(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+def attendre(tache_id, etats=ETATS_FINAUX, delai=5.0):
+    """État de la tâche dès qu'il fait partie de `etats`"""
+    limite = time.monotonic() + delai
+    while time.monotonic() < limite:
+        tache = lire_tache(tache_id)
+        if tache is not None and tache['etat'] in etats:
+            return tache
+        time.sleep(0.01)
+    raise AssertionError(f"Tâche {tache_id} : {lire_tache(tache_id)}")
+
+
+@pytest.fixture
+def traitement(monkeypatch):
+    """Enregistrer un traitement de test sous le nom donné"""
+    def enregistrer(nom, fonction):
+        monkeypatch.setitem(taches.TRAITEMENTS, nom, fonction)
+    return enregistrer
+
+
+def test_tache_terminee_avec_ses_fichiers_et_sa_progression(traitement):
+    def exporter(parametres, repertoire, suivi):
+        chemin = os.path.join(repertoire, "export.txt")
+        with open(chemin, 'w', encoding='utf-8') as f:
+            f.write(parametres['texte'])
+        suivi.avancer(3, 3)
+        return {"fichiers": [chemin], "erreurs": ["Fonds ignoré"]}
+    traitement("export", exporter)
+    tache_id = soumettre_tache("export", {"texte": "contenu"}, "Export")
+    tache = attendre(tache_id)
+    assert (tache['etat'], tache['faites'], tache['total'], tache['erreurs']) == ("terminee", 3, 3, ["Fonds ignoré"])
+    with open(tache['fichiers'][0], encoding='utf-8') as f:
+        assert f.read() == "contenu"
+    assert supprimer_tache(tache_id)
+    assert lire_tache(tache_id) is None
+    assert not os.path.exists(repertoire_tache(tache_id))
+
+
+def test_tache_echouee(traitement):
+    def echouer(parametres, repertoire, suivi):
+        raise RuntimeError("Fichier introuvable")
+    traitement("echec", echouer)
+    tache = attendre(soumettre_tache("echec", {}, "Échec"))
+    assert (tache['etat'], tache['erreurs']) == ("echouee", ["Fichier introuvable"])
+    assert not os.path.exists(repertoire_tache(tache['id']))
+
+
+def test_traitement_inconnu_refuse():
+    with pytest.raises(ValueError):
+        soumettre_tache("inconnu", {}, "Inconnu")
+
+
+def test_annulation_d_une_tache_en_cours(traitement):
+    demarree = threading.Event()
+
+    def boucler(parametres, repertoire, suivi):
+        demarree.set()
+        for i in range(1000):
+            suivi.avancer(i, 1000)
+            time.sleep(0.01)
+    traitement("boucle", boucler)
+    tache_id = soumettre_tache("boucle", {}, "Boucle")
+    assert demarree.wait(5)
+    assert supprimer_tache(tache_id) is False
+    assert annuler_tache(tache_id)
+    tache = attendre(tache_id)
+    assert tache['etat'] == "annulee"
+    assert not os.path.exists(repertoire_tache(tache_id))
+    assert annuler_tache(tache_id) is False
+
+
+def test_annulation_d_une_tache_en_attente(traitement):
+    liberation = threading.Event()
+    executees = []
+
+    def bloquer(parametres, repertoire, suivi):
+        executees.append(parametres['rang'])
+        liberation.wait(5)
+    traitement("bloquant", bloquer)
+    try:
+        occupees = [soumettre_tache("bloquant", {"rang": i}, "Bloquante") for i in range(taches.NB_TACHES_SIMULTANEES)]
+        for tache_id in occupees:
+            attendre(tache_id, {"en_cours"})
+        en_attente = soumettre_tache("bloquant", {"rang": -1}, "En attente")
+        assert annuler_tache(en_attente)
+        assert lire_tache(en_attente)['etat'] == "annulee"
+    finally:
+        liberation.set()
+    for tache_id in occupees:
+        assert attendre(tache_id)['etat'] == "terminee"
+    assert -1 not in executees
+
+
+def test_taches_interrompues_par_un_arret_du_serveur():
+    os.makedirs(REPERTOIRE_TACHES)
+    for tache_id, etat in (("en_cours", "en_cours"), ("terminee", "terminee")):
+        with open(os.path.join(REPERTOIRE_TACHES, tache_id + ".json"), 'w', encoding='utf-8') as f:
+            json.dump({"id": tache_id, "etat": etat, "date_creation": "2026-01-15 10:00:00"}, f)
+    marquer_taches_interrompues()
+    assert lire_tache("en_cours")['etat'] == "interrompue"
+    assert lire_tache("terminee")['etat'] == "terminee"
+
+
+def test_taches_expirees_purgees():
+    os.makedirs(REPERTOIRE_TACHES)
+    for tache_id, fin in (("ancienne", "2000-01-01 00:00:00"), ("recente", "2999-01-01 00:00:00")):
+        with open(os.path.join(REPERTOIRE_TACHES, tache_id + ".json"), 'w', encoding='utf-8') as f:
+            json.dump({"id": tache_id, "etat": "terminee", "date_creation": fin, "fin": fin}, f)
+    assert [tache['id'] for tache in lister_taches()] == ["recente"]
+    assert lire_tache("ancienne") is None